@@ -8,8 +8,23 @@ import state
 import sys # Import sys to access command-line arguments
 import threading
 import configparser
-from flask import Flask, render_template
-from flask_socketio import SocketIO, emit
+import json
+from collections import OrderedDict
+from flask import Flask, Response, render_template, send_from_directory, abort, request
+from flask_socketio import SocketIO, emit, join_room, leave_room
+import bokeh
+
+import bokeh_visuals
+import bokeh_server
+import map_gridding
+import map_checkpoint
+import logging_setup
+import metrics
+import nodding_manager
+import pipeline_trace
+import fits_processor
+import fits_watcher
+import processing_worker
 
 # Import functions from fits_watcher.py, including the new set_monitor_directory
 from fits_watcher import start_fits_monitor, stop_fits_monitor, set_socketio_instance, set_monitor_directory
@@ -25,6 +40,10 @@ fits_observer = None
 # --- Configuration File Handling ---
 CONFIG_FILE_PATH = os.path.join(app.root_path, 'static', 'config.ini')
 
+# URL prefix of the self-hosted BokehJS bundle. The bokeh version is part of the URL,
+# so the files can be served with an "immutable" Cache-Control header.
+BOKEHJS_URL_PREFIX = '/bokehjs'
+BOKEHJS_CACHE_MAX_AGE = 31536000 # 1 year, in seconds
 
 
 def _create_default_config():
@@ -36,6 +55,47 @@ def _create_default_config():
         'local_drive':  os.path.abspath(os.path.join(app.root_path, 'fits_files')), # Relative path for local debugging
         'remote_drive_1': '/roach2_nuraghe/data' # Absolute path example for remote
     }
+    config['Bokeh'] = {
+        'resources': 'cdn', # 'cdn' (public CDN) or 'local' (BokehJS served by this app, for offline networks)
+        'port': '5006', # Port of the Bokeh map viewer server (0 = map viewer disabled)
+        'allow_websocket_origin': 'localhost:5006', # Comma-separated host[:port] list allowed to open the map viewer
+        'plot_max_files': '500', # Plot pages kept in static/plots (the oldest are removed, 0 = no limit)
+        'plot_max_age_hours': '24' # Plot pages older than this are removed (0 = no limit)
+    }
+    config['Server'] = {
+        'mode': 'threaded', # 'threaded' (development server), 'single_loop' (one Tornado loop) or 'asgi' (uvicorn)
+        'replay_max_entries': '64', # (feed, scan) entries replayed from memory to clients connecting mid-scan
+        'trace_max_spans': '20000' # Pipeline trace spans kept in memory for /trace (oldest dropped first)
+    }
+    config['Logging'] = {
+        'level': 'INFO', # Level of the processing modules' log (DEBUG also prints profiling timers and array dumps)
+        'burst': '20', # Messages per second from each log statement before sampling starts
+        'sample_every': '100', # Beyond the burst, one message out of sample_every is printed (with the suppressed count)
+        'queue_size': '10000' # Log records waiting to be written; beyond it records are dropped, never blocking
+    }
+    config['Nodding'] = {
+        'pair_ttl': '600' # Seconds a nodding file waits for its partner feed before being dropped
+    }
+    config['Workers'] = {
+        'enabled': 'false', # Process the files in separate worker processes (see processing_worker.py)
+        'broker_address': '127.0.0.1:5050', # host:port of the file queue served by this app to the workers
+        'authkey': '', # Shared key of the file queue (required when enabled)
+        'local_workers': '2', # Worker processes started on this host (remote ones run processing_worker.py)
+        'message_queue': '' # Flask-SocketIO message queue (e.g. redis://host:6379); empty = through the file queue
+    }
+    config['Map'] = {
+        'gridding_mode': 'binning', # 'binning' (cell mean, HPBW/2) or 'convolution' (Gaussian kernel, HPBW/3)
+        'min_gridding_interval': '1.0', # Minimum interval between two gridding runs, in seconds
+        'memory_budget_mb': '512', # Total memory for the map sessions kept in memory (LRU eviction)
+        'multi_feed': 'false', # Grid every feed of a multi-feed map (with its sky offset) into one map
+        'checkpoint_dir': 'map_checkpoints', # On-disk map checkpoints, reloaded at startup (empty = disabled)
+        'checkpoint_interval': '30', # Minimum interval between two checkpoints of the same map, in seconds
+        'checkpoint_max_sessions': '20', # Map sessions kept on disk (the oldest ones are removed)
+        'baseline_order': '1', # Degree of the per-subscan baseline polynomial (-1 = no baseline removal)
+        'baseline_edge_fraction': '0.1', # Fraction of samples at each subscan edge used for the baseline fit
+        'hole_fill_radius_hpbw': '1.0', # Max distance (in HPBW) of the data used to fill unsampled cells (0 = disabled)
+        'hole_fill_cache_kernels': 'true' # Keep the FFT kernel spectra per grid shape between gridding runs
+    }
     os.makedirs(os.path.dirname(CONFIG_FILE_PATH), exist_ok=True)
     with open(CONFIG_FILE_PATH, 'w') as configfile:
         config.write(configfile)
@@ -67,6 +127,249 @@ def _get_drive_paths_from_config():
         return None
     return drive_paths
 
+def _get_bokeh_resources_mode_from_config():
+    """
+    Reads the BokehJS resources mode from the [Bokeh] section of config.ini.
+    Returns 'cdn' (default) or 'local'.
+    """
+    config = configparser.ConfigParser()
+    config.read(CONFIG_FILE_PATH)
+    mode = config.get('Bokeh', 'resources', fallback='cdn').strip().lower()
+    if mode not in ('cdn', 'local'):
+        print(f"WARNING: Unknown Bokeh resources mode '{mode}' in config.ini. Falling back to 'cdn'.")
+        mode = 'cdn'
+    return mode
+
+def _get_bokeh_server_settings_from_config():
+    """
+    Reads the Bokeh map viewer server settings from the [Bokeh] section of config.ini.
+    Returns (port, 0 if disabled; list of allowed websocket origins).
+    """
+    config = configparser.ConfigParser()
+    config.read(CONFIG_FILE_PATH)
+    try:
+        port = config.getint('Bokeh', 'port', fallback=5006)
+    except ValueError:
+        print("WARNING: Invalid Bokeh 'port' in config.ini. Falling back to 5006.")
+        port = 5006
+    origins = config.get('Bokeh', 'allow_websocket_origin', fallback=f'localhost:{port}')
+    return port, [origin.strip() for origin in origins.split(',') if origin.strip()]
+
+def _get_plot_retention_from_config():
+    """
+    Reads the plot pages retention from the [Bokeh] section of config.ini.
+    Returns (max files kept, max age in seconds); 0 disables the limit.
+    """
+    config = configparser.ConfigParser()
+    config.read(CONFIG_FILE_PATH)
+    try:
+        max_files = max(0, config.getint('Bokeh', 'plot_max_files', fallback=500))
+        max_age_hours = max(0.0, config.getfloat('Bokeh', 'plot_max_age_hours', fallback=24.0))
+    except ValueError:
+        print("WARNING: Invalid plot retention settings in config.ini. Falling back to 500 files and 24 hours.")
+        return 500, 24 * 3600.0
+    return max_files, max_age_hours * 3600.0
+
+def _get_server_mode_from_config():
+    """
+    Reads the server deployment mode from the [Server] section of config.ini.
+    Returns 'threaded' (default), 'single_loop' or 'asgi'.
+    """
+    config = configparser.ConfigParser()
+    config.read(CONFIG_FILE_PATH)
+    mode = config.get('Server', 'mode', fallback='threaded').strip().lower()
+    if mode not in ('threaded', 'single_loop', 'asgi'):
+        print(f"WARNING: Unknown server mode '{mode}' in config.ini. Falling back to 'threaded'.")
+        mode = 'threaded'
+    return mode
+
+def _get_replay_max_entries_from_config():
+    """
+    Reads from the [Server] section of config.ini how many (feed, scan) entries the replay buffer keeps.
+    """
+    config = configparser.ConfigParser()
+    config.read(CONFIG_FILE_PATH)
+    try:
+        max_entries = config.getint('Server', 'replay_max_entries', fallback=64)
+    except ValueError:
+        print("WARNING: Invalid 'replay_max_entries' in config.ini. Falling back to 64.")
+        max_entries = 64
+    return max(1, max_entries)
+
+def _get_trace_max_spans_from_config():
+    """
+    Reads from the [Server] section of config.ini how many pipeline trace spans are kept in memory.
+    """
+    config = configparser.ConfigParser()
+    config.read(CONFIG_FILE_PATH)
+    try:
+        return max(1, config.getint('Server', 'trace_max_spans', fallback=20000))
+    except ValueError:
+        print("WARNING: Invalid 'trace_max_spans' in config.ini. Falling back to 20000.")
+        return 20000
+
+def _get_logging_settings_from_config():
+    """
+    Reads the logging settings (level, rate limiting, queue size) from the [Logging] section of config.ini.
+    Returns the keyword arguments of logging_setup.setup_logging().
+    """
+    config = configparser.ConfigParser()
+    config.read(CONFIG_FILE_PATH)
+    level = config.get('Logging', 'level', fallback='INFO').strip().upper()
+    if level not in ('DEBUG', 'INFO', 'WARNING', 'ERROR'):
+        print(f"WARNING: Unknown log level '{level}' in config.ini. Falling back to 'INFO'.")
+        level = 'INFO'
+    try:
+        return {
+            'level': level,
+            'burst': max(1, config.getint('Logging', 'burst', fallback=20)),
+            'sample_every': max(1, config.getint('Logging', 'sample_every', fallback=100)),
+            'queue_size': max(1, config.getint('Logging', 'queue_size', fallback=10000)),
+        }
+    except ValueError:
+        print("WARNING: Invalid [Logging] settings in config.ini. Falling back to the defaults.")
+        return {'level': level}
+
+def _get_gridding_mode_from_config():
+    """
+    Reads the map gridding mode from the [Map] section of config.ini.
+    Returns 'binning' (default) or 'convolution'.
+    """
+    config = configparser.ConfigParser()
+    config.read(CONFIG_FILE_PATH)
+    mode = config.get('Map', 'gridding_mode', fallback='binning').strip().lower()
+    if mode not in ('binning', 'convolution'):
+        print(f"WARNING: Unknown map gridding mode '{mode}' in config.ini. Falling back to 'binning'.")
+        mode = 'binning'
+    return mode
+
+def _get_min_gridding_interval_from_config():
+    """
+    Reads the minimum interval between two gridding runs (seconds) from the [Map] section of config.ini.
+    """
+    config = configparser.ConfigParser()
+    config.read(CONFIG_FILE_PATH)
+    try:
+        return config.getfloat('Map', 'min_gridding_interval', fallback=1.0)
+    except ValueError:
+        print("WARNING: Invalid 'min_gridding_interval' in config.ini. Falling back to 1.0 s.")
+        return 1.0
+
+def _get_map_memory_budget_from_config():
+    """
+    Reads the total memory budget (MB) of the map sessions from the [Map] section of config.ini.
+    """
+    config = configparser.ConfigParser()
+    config.read(CONFIG_FILE_PATH)
+    try:
+        return config.getfloat('Map', 'memory_budget_mb', fallback=512.0)
+    except ValueError:
+        print("WARNING: Invalid 'memory_budget_mb' in config.ini. Falling back to 512 MB.")
+        return 512.0
+
+def _get_multi_feed_map_from_config():
+    """
+    Reads the multi-feed map mode flag from the [Map] section of config.ini.
+    """
+    config = configparser.ConfigParser()
+    config.read(CONFIG_FILE_PATH)
+    try:
+        return config.getboolean('Map', 'multi_feed', fallback=False)
+    except ValueError:
+        print("WARNING: Invalid 'multi_feed' in config.ini. Multi-feed map mode disabled.")
+        return False
+
+def _get_map_checkpoint_settings_from_config():
+    """
+    Reads the map checkpoint settings from the [Map] section of config.ini.
+    Returns (directory or None if disabled, interval in seconds, max sessions kept on disk).
+    A relative directory is resolved against the app root.
+    """
+    config = configparser.ConfigParser()
+    config.read(CONFIG_FILE_PATH)
+    directory = config.get('Map', 'checkpoint_dir', fallback='map_checkpoints').strip()
+    try:
+        interval = config.getfloat('Map', 'checkpoint_interval', fallback=30.0)
+        max_sessions = config.getint('Map', 'checkpoint_max_sessions', fallback=20)
+    except ValueError:
+        print("WARNING: Invalid map checkpoint settings in config.ini. Falling back to 30 s and 20 sessions.")
+        interval, max_sessions = 30.0, 20
+    if not directory:
+        return None, interval, max_sessions
+    return os.path.join(app.root_path, directory), interval, max_sessions
+
+def _get_baseline_options_from_config():
+    """
+    Reads the per-subscan baseline removal options from the [Map] section of config.ini.
+    Returns (polynomial degree, -1 if disabled; edge fraction).
+    """
+    config = configparser.ConfigParser()
+    config.read(CONFIG_FILE_PATH)
+    try:
+        order = config.getint('Map', 'baseline_order', fallback=1)
+        edge_fraction = config.getfloat('Map', 'baseline_edge_fraction', fallback=0.1)
+    except ValueError:
+        print("WARNING: Invalid baseline options in config.ini. Falling back to degree 1 and 10% edges.")
+        return 1, 0.1
+    if not 0.0 < edge_fraction <= 0.5:
+        print("WARNING: 'baseline_edge_fraction' must be in (0, 0.5]. Falling back to 0.1.")
+        edge_fraction = 0.1
+    return order, edge_fraction
+
+def _get_hole_filling_from_config():
+    """
+    Reads the map hole filling options from the [Map] section of config.ini.
+    Returns (max fill radius in HPBW units, 0 if disabled; kernel spectra caching flag).
+    """
+    config = configparser.ConfigParser()
+    config.read(CONFIG_FILE_PATH)
+    try:
+        radius = max(0.0, config.getfloat('Map', 'hole_fill_radius_hpbw', fallback=1.0))
+        cache_kernels = config.getboolean('Map', 'hole_fill_cache_kernels', fallback=True)
+    except ValueError:
+        print("WARNING: Invalid hole filling options in config.ini. Falling back to 1.0 HPBW with kernel caching.")
+        return 1.0, True
+    return radius, cache_kernels
+
+def _get_nodding_pair_ttl_from_config():
+    """
+    Reads how long (seconds) a nodding file waits for its partner feed from the [Nodding] section of config.ini.
+    """
+    config = configparser.ConfigParser()
+    config.read(CONFIG_FILE_PATH)
+    try:
+        return config.getfloat('Nodding', 'pair_ttl', fallback=600.0)
+    except ValueError:
+        print("WARNING: Invalid 'pair_ttl' in config.ini. Falling back to 600 s.")
+        return 600.0
+
+def _get_workers_settings_from_config():
+    """
+    Reads the split deployment settings from the [Workers] section of config.ini.
+    Returns None if the files are processed in this process, otherwise a dict with the broker
+    address (host, port), the authkey, the number of local workers and the Socket.IO message queue URL.
+    """
+    config = configparser.ConfigParser()
+    config.read(CONFIG_FILE_PATH)
+    try:
+        if not config.getboolean('Workers', 'enabled', fallback=False):
+            return None
+        local_workers = max(0, config.getint('Workers', 'local_workers', fallback=2))
+        address = processing_worker.parse_address(config.get('Workers', 'broker_address', fallback='127.0.0.1:5050'))
+    except ValueError:
+        print("WARNING: Invalid [Workers] settings in config.ini. Processing files in this process.")
+        return None
+    authkey = config.get('Workers', 'authkey', fallback='').strip()
+    if not authkey:
+        print("WARNING: [Workers] 'authkey' is empty in config.ini. Processing files in this process.")
+        return None
+    return {
+        'address': address,
+        'authkey': authkey.encode(),
+        'local_workers': local_workers,
+        'message_queue': config.get('Workers', 'message_queue', fallback='').strip() or None,
+    }
+
 def _check_mounted_drives(drive_paths):
     """
     Checks the status of each configured mounted drive and logs it.
@@ -87,6 +390,118 @@ def _check_mounted_drives(drive_paths):
 def index():
     return render_template('index.html')
 
+@app.route(f'{BOKEHJS_URL_PREFIX}/<version>/static/<path:filename>')
+def bokehjs_static(version, filename):
+    """
+    Serves the BokehJS bundle of the installed bokeh package, so that plot pages
+    do not need to reach the public CDN. Only the installed version is served.
+    """
+    if version != bokeh.__version__:
+        abort(404)
+    response = send_from_directory(bokeh_visuals.get_bokehjs_dir(), filename, max_age=BOKEHJS_CACHE_MAX_AGE)
+    response.headers['Cache-Control'] = f'public, max-age={BOKEHJS_CACHE_MAX_AGE}, immutable'
+    return response
+
+# --- Late-join replay ---
+class ReplayBuffer:
+    """
+    Bounded ring buffer of the last products emitted per (feed, scan): the last 'fits_header_update'
+    (full header and spectrum plot URL) of each feed and scan, oldest entries dropped first.
+    A client that subscribes to a feed (on connect or when changing feed) gets the latest state
+    of that feed from memory, with its current map of the same scan, without reading FITS files again.
+    """
+
+    def __init__(self, max_entries=64):
+        self._entries = OrderedDict() # (feed, scan_id) -> last full payload
+        self._max_entries = max_entries
+        self._lock = threading.Lock()
+
+    def record(self, feeds, scan_id, payload):
+        # Delta encoding happens per room when emitting: the buffer always keeps the full header
+        entry = dict(payload, header=dict(payload.get('header') or {}))
+        with self._lock:
+            for feed in feeds:
+                key = (int(feed), scan_id)
+                self._entries[key] = entry
+                self._entries.move_to_end(key)
+            while len(self._entries) > self._max_entries:
+                self._entries.popitem(last=False)
+
+    def latest(self, feed=None):
+        """Most recent (scan_id, payload) of the feed (of any feed if None), or None."""
+        with self._lock:
+            for (entry_feed, scan_id), payload in reversed(self._entries.items()):
+                if feed is None or entry_feed == feed:
+                    return scan_id, payload
+        return None
+
+    def replay_events(self, feed=None):
+        """Events (name, payload) that bring a new client up to date, oldest first."""
+        latest = self.latest(feed)
+        scan_id = None
+        events = []
+        if latest is not None:
+            scan_id, payload = latest
+            replayed = dict(payload, replay=True)
+            # Full header with the current version of the stream: the next live delta applies on top of it
+            full = fits_processor.get_feed_header(feed)
+            if full is not None and full['header_scan'] == scan_id:
+                replayed.update(full)
+            events.append(('fits_header_update', replayed))
+        map_result = _latest_map_result(scan_id, feed)
+        if map_result:
+            events.append(('map_state', dict(map_gridding.summarize_map_result(map_result), replay=True)))
+        return events
+
+def _latest_map_result(scan_id=None, feed=None):
+    """
+    Last gridding result of the scan for the feed (or the multi-feed map of the scan; of the
+    active map if scan_id is None or has no map yet).
+    """
+    if scan_id is not None:
+        for session_key in state.list_map_sessions():
+            cache = state.MAP_SESSIONS.get(session_key)
+            session_scan, _, session_feed = session_key
+            if session_scan != scan_id or (feed is not None and session_feed not in (feed, None)):
+                continue
+            if cache and cache.get('LATEST_RESULT'):
+                return cache['LATEST_RESULT']
+    result = state.LATEST_MAP_RESULT
+    return result if result and 'pyramid' in result else None
+
+replay_buffer = ReplayBuffer()
+
+def _replay_events(feed=None):
+    """Replay for one client (shared by the Flask-SocketIO and the async handlers)."""
+    try:
+        return replay_buffer.replay_events(feed)
+    except Exception as e:
+        print(f"WARNING: Replay failed: {e}")
+        return []
+
+@app.route('/metrics')
+def metrics_endpoint():
+    """
+    Pipeline metrics (per-stage latency histograms, files processed/dropped, bytes read,
+    queue depths) in the Prometheus text format.
+    """
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4; charset=utf-8')
+
+@app.route('/trace')
+def trace_endpoint():
+    """
+    Per-file pipeline spans in the Chrome trace-event format (open in chrome://tracing or Perfetto).
+    Optional query parameters: 'file' (substring of the file name), 'since' (epoch seconds).
+    """
+    try:
+        since = float(request.args['since']) if 'since' in request.args else None
+    except ValueError:
+        abort(400)
+    trace = pipeline_trace.chrome_trace(file_filter=request.args.get('file'), since=since)
+    response = Response(json.dumps(trace), mimetype='application/json')
+    response.headers['Content-Disposition'] = 'inline; filename="quicklook_trace.json"'
+    return response
+
 # --- SocketIO Event Handlers ---
 @socketio.on('connect')
 def test_connect():
@@ -96,42 +511,139 @@ def test_connect():
 @socketio.on('disconnect')
 def test_disconnect():
     print('Client disconnected:', threading.current_thread().name)
+    _remove_client_subscription(request.sid)
 
 @socketio.on('update_feed_selection')
 def handle_feed_selection(data):
     """
-    It receives the new selected feed from the front-end and updates the global variable.
+    It receives the feed selected by this client and moves the client to the room of that feed.
+    The latest state of the new feed is then replayed from memory to this client only.
+    """
+    previous_feed, new_feed = _apply_feed_selection(request.sid, data)
+    if new_feed is not None and new_feed != previous_feed:
+        if previous_feed is not None:
+            leave_room(state.feed_room(previous_feed))
+        join_room(state.feed_room(new_feed))
+        for event, payload in _replay_events(new_feed):
+            emit(event, payload)
+
+@socketio.on('header_resync')
+def handle_header_resync(data=None):
+    """
+    Sends the full current header to a client that lost a delta (see header_delta.py).
+    """
+    full_header = fits_processor.get_header_resync(request.sid)
+    if full_header is not None:
+        emit('fits_header_resync', full_header)
+
+def _apply_feed_selection(sid, data):
+    """
+    Updates the feed subscription of one client (shared by the Flask-SocketIO and the async handlers).
+    Each client has its own feed: the products of a file are emitted only to the rooms
+    of the subscribed feeds it contains. Returns (previous feed, new feed); new feed is None on errors.
     """
     # Extra check: be sure that the feed number is an integer and manage the errors
     try:
         # 1. Ottiene e converte il nuovo Feed (new_feed � una variabile locale)
         new_feed = int(data.get('feed', 0))
-
-        # 2. check and update the global state only if the value has changed
-        if new_feed != state.CURRENT_SELECTED_FEED:
-            
-            # update value inside the module 'state'
-            state.CURRENT_SELECTED_FEED = new_feed
-            
-            print(f"=====================================================")
-            print(f"SERVER STATE UPDATE: Feed selected to: {state.CURRENT_SELECTED_FEED}")
-            print(f"=====================================================")
-    
-            # (Optional: it is also possible to send a confirmation on the feed selected on the front-end)
-            # emit('feed_selection_confirmed', {'feed': CURRENT_SELECTED_FEED})
-    except ValueError:
+    except (TypeError, ValueError):
         print(f"ERRORE: No integer value for feed received: {data.get('feed')}")
+        return None, None
+
+    # 2. update the subscription of this client only
+    previous_feed = state.subscribe_feed(sid, new_feed)
+    _publish_subscriptions()
+    if previous_feed != new_feed:
+        print("=====================================================")
+        print(f"SERVER STATE UPDATE: Client {sid} subscribed to feed {new_feed}. Subscribed feeds: {sorted(state.subscribed_feeds())}")
+        print("=====================================================")
+    return previous_feed, new_feed
+
+def _remove_client_subscription(sid):
+    """
+    Removes the feed subscription of a disconnected client.
+    """
+    feed = state.unsubscribe_client(sid)
+    _publish_subscriptions()
+    if feed is not None:
+        print(f"Client {sid} unsubscribed from feed {feed}. Subscribed feeds: {sorted(state.subscribed_feeds())}")
+
+
+def _publish_subscriptions():
+    """
+    In split deployment the processing workers filter the files by the feeds subscribed here.
+    """
+    if file_broker is not None:
+        with state._feed_subscriptions_lock:
+            subscriptions = dict(state.FEED_SUBSCRIPTIONS)
+        file_broker.put_subscriptions(subscriptions)
+
+def _receive_worker_map(update):
+    """
+    Split deployment: the map sessions live in the workers. The web tier rebuilds the last result of each
+    session from the map updates (full pyramid or changed windows, see processing_worker.MapUpdateEncoder),
+    so the session selector of the map viewer and the map replay work as in a single process.
+    """
+    session_key = tuple(update['session_key']) if update.get('session_key') is not None else None
+    base = state.MAP_SESSIONS.get(session_key) if session_key is not None else None
+    result_maps = processing_worker.apply_map_update(update, base.get('LATEST_RESULT') if base else None)
+    if result_maps is None:
+        print(f"WARNING: Map update of {session_key} without its previous map: the full map is requested.")
+        if file_broker is not None and session_key is not None:
+            file_broker.request_full_map(session_key)
+        return
+    if session_key is not None:
+        state.put_map_result(session_key, result_maps)
+    bokeh_server.update_bokeh_plot(result_maps)
 
-    # ...
+file_broker = None
 
+def _start_processing_workers(workers_settings, processing_settings, socketio_instance, server_mode):
+    """
+    Split deployment: the new files go to a shared queue served by this process and are
+    processed by worker processes (on this host and/or remote hosts), see processing_worker.py.
+    """
+    global file_broker
+    message_queue = workers_settings['message_queue']
+    if message_queue and server_mode != 'threaded':
+        print("WARNING: [Workers] message_queue is supported in 'threaded' mode only. Results go through the file queue.")
+        message_queue = None
+    if message_queue:
+        # Clients are served by this process, the workers emit through the same message queue
+        socketio.init_app(app, message_queue=message_queue)
+
+    file_broker = processing_worker.start_broker(workers_settings['address'], workers_settings['authkey'])
+    file_broker.put_settings(processing_settings)
+    _publish_subscriptions()
+    processing_worker.start_result_drain(
+        file_broker,
+        emit=lambda event, data, kwargs: socketio_instance.emit(event, data, **kwargs),
+        on_map=_receive_worker_map,
+        on_record=replay_buffer.record,
+        on_done=fits_watcher.mark_file_done,
+        on_metrics=metrics.merge_remote,
+        on_trace=pipeline_trace.add_spans,
+    )
+    fits_watcher.set_file_dispatcher(file_broker.submit)
+
+    host, port = workers_settings['address']
+    local_address = ('127.0.0.1' if host in ('', '0.0.0.0') else host, port)
+    if workers_settings['local_workers'] > 0:
+        processing_worker.start_local_workers(workers_settings['local_workers'], local_address,
+                                              workers_settings['authkey'], message_queue)
 
 # --- Application Startup and Shutdown ---
 def start_app():
-    global fits_observer
+    global fits_observer, replay_buffer
 
     # 1. Parse command-line arguments
     is_debug_mode = '-d' in sys.argv
 
+    # 1b. Processing modules log through a bounded queue written by a single thread (never blocking the workers)
+    logging_settings = _get_logging_settings_from_config()
+    logging_setup.setup_logging(**logging_settings)
+    metrics.register_gauge(metrics.LOG_RECORDS_DROPPED, logging_setup.dropped_records)
+
     # 2. Get drive paths from config.ini
     drive_paths = _get_drive_paths_from_config()
     if not drive_paths:
@@ -179,11 +691,74 @@ def start_app():
     # 4. Check status of all configured drives (for informational purposes)
     _check_mounted_drives(drive_paths)
 
+    # 4b. Select the BokehJS resources referenced by the plot pages
+    if _get_bokeh_resources_mode_from_config() == 'local':
+        bokeh_visuals.set_plot_resources(
+            bokeh_visuals.make_self_hosted_resources(f"{BOKEHJS_URL_PREFIX}/{bokeh.__version__}/")
+        )
+
+    # 4c. Select the map gridding mode (the processing workers, if any, get the same settings)
+    processing_settings = {
+        'logging': logging_settings,
+        'gridding_mode': _get_gridding_mode_from_config(),
+        'hole_filling': _get_hole_filling_from_config(),
+        'min_gridding_interval': _get_min_gridding_interval_from_config(),
+        'memory_budget_bytes': int(_get_map_memory_budget_from_config() * 1024 * 1024),
+        'multi_feed': _get_multi_feed_map_from_config(),
+        'baseline': _get_baseline_options_from_config(),
+        'plot_retention': _get_plot_retention_from_config(),
+        'nodding_pair_ttl': _get_nodding_pair_ttl_from_config(),
+        'map_checkpoint': _get_map_checkpoint_settings_from_config(),
+    }
+    processing_worker.apply_processing_settings(processing_settings)
+
+    # 4d. Reload the map sessions saved before a restart. In the split deployment the maps live
+    # in the workers: each worker reloads the sessions of the scans the broker assigns to it.
+    workers_settings = _get_workers_settings_from_config()
+    if workers_settings is None:
+        map_checkpoint.restore_sessions()
+
+    # 4e. Keep the last products per feed and scan for the clients that connect mid-scan
+    replay_buffer = ReplayBuffer(_get_replay_max_entries_from_config())
+    fits_processor.set_event_recorder(replay_buffer.record)
+
+    # 4f. Size of the in-memory pipeline trace exported at /trace
+    pipeline_trace.configure(_get_trace_max_spans_from_config())
+
     # 5. Set the determined monitor directory in fits_watcher
     set_monitor_directory(monitor_path)
 
     # 6. Pass the SocketIO instance to the fits_watcher module
-    set_socketio_instance(socketio)
+    # In 'single_loop' mode Socket.IO, Flask and the Bokeh server share one Tornado loop and
+    # the workers post their updates to it through a single thread-safe queue.
+    server_mode = _get_server_mode_from_config()
+    bokeh_port, bokeh_origins = _get_bokeh_server_settings_from_config()
+    # In 'asgi' mode python-socketio is served by uvicorn (production): one event loop for all clients.
+    if server_mode == 'single_loop':
+        import single_loop_server
+        socketio_instance = single_loop_server.setup(app, _apply_feed_selection, _remove_client_subscription, port=5000,
+                                                     bokeh_port=bokeh_port, bokeh_origins=bokeh_origins,
+                                                     on_header_resync=fits_processor.get_header_resync,
+                                                     on_replay=_replay_events)
+    elif server_mode == 'asgi':
+        import asgi_server
+        socketio_instance = asgi_server.setup(app, _apply_feed_selection, _remove_client_subscription, port=5000,
+                                              on_header_resync=fits_processor.get_header_resync,
+                                              on_replay=_replay_events)
+    else:
+        socketio_instance = socketio
+    set_socketio_instance(socketio_instance)
+
+    # 6b. Split deployment: the files are processed by worker processes behind a shared queue
+    if workers_settings is not None:
+        _start_processing_workers(workers_settings, processing_settings, socketio_instance, server_mode)
+
+    # 6c. Queue depths exposed at /metrics
+    metrics.register_queue_depth('watcher', fits_watcher.pending_file_count)
+    metrics.register_queue_depth('gridding', fits_processor.pending_gridding_sessions)
+    metrics.register_queue_depth('nodding', nodding_manager.pending_pair_count)
+    if file_broker is not None:
+        metrics.register_queue_depth('workers', file_broker.queued_count)
 
     # 7. Start the FITS file monitor
     fits_observer = start_fits_monitor()
@@ -191,8 +766,20 @@ def start_app():
         print("FITS file monitor failed to start. Application will not monitor files.")
         return # Exit if monitor didn't start
 
-    # 8. Run the Flask-SocketIO server
-    socketio.run(app, debug=False, allow_unsafe_werkzeug=True, host='0.0.0.0', port=5000)
+    if server_mode == 'single_loop':
+        # 8-9. Run the shared loop (the Bokeh server was registered on it by setup())
+        single_loop_server.run()
+        return
+
+    # 8. Start the Bokeh map viewer server (every open viewer tab receives the map updates)
+    if bokeh_port > 0:
+        bokeh_server.start_bokeh_server(port=bokeh_port, allow_websocket_origin=bokeh_origins)
+
+    # 9. Run the Flask-SocketIO server
+    if server_mode == 'asgi':
+        asgi_server.run()
+    else:
+        socketio.run(app, debug=False, allow_unsafe_werkzeug=True, host='0.0.0.0', port=5000)
 
 if __name__ == '__main__':
     try:
@@ -201,9 +788,17 @@ if __name__ == '__main__':
         print("\nApplication stopped by user.")
     finally:
         # Stop the FITS file monitor gracefully when the application shuts down
+        bokeh_server.stop_bokeh_server()
+        processing_worker.stop_local_workers()
         if fits_observer:
             stop_fits_monitor(fits_observer)
 
             print("Application gracefully stopped.")
+        # Save the last subscans of every map (the periodic checkpoints are rate limited).
+        # In the split deployment the maps and their checkpoints belong to the workers.
+        fits_processor.stop_gridding(timeout=30)
+        if file_broker is None:
+            map_checkpoint.flush_sessions()
+        logging_setup.stop_logging()
 
    
@@ -0,0 +1,60 @@
+# asgi_server.py
+
+import asyncio
+
+from typing import Callable, Dict, List, Optional, Tuple
+
+import socketio
+import uvicorn
+from asgiref.wsgi import WsgiToAsgi
+
+import logging_setup
+from loop_bridge import LoopBridge, LoopSocketIO, register_async_handlers
+
+logger = logging_setup.get_logger(__name__)
+
+# --------------------------------------------------------
+# MODALIT� "ASGI": Socket.IO asincrono (python-socketio) servito da uvicorn
+# --------------------------------------------------------
+# Un solo event loop gestisce tutte le connessioni (nessun thread per client, a differenza
+# del server di sviluppo werkzeug). Flask viene montato come applicazione WSGI di fallback.
+# I thread di elaborazione consegnano gli emit al loop tramite loop_bridge.LoopBridge.
+# Un solo processo uvicorn: Socket.IO con pi� processi richiederebbe sticky session
+# e un message queue condiviso.
+
+_loop: Optional[asyncio.AbstractEventLoop] = None
+_server: Optional[uvicorn.Server] = None
+
+
+def setup(flask_app, on_feed_selection: Callable[[str, Dict], Tuple], on_disconnect: Callable[[str], None],
+          port: int = 5000, log_level: str = 'warning',
+          on_header_resync: Optional[Callable[[str], Optional[Dict]]] = None,
+          on_replay: Optional[Callable[[Optional[int]], List[Tuple[str, Dict]]]] = None) -> LoopSocketIO:
+    """
+    Prepara l'applicazione ASGI (Socket.IO + Flask) e il server uvicorn sulla porta indicata.
+    Ritorna l'istanza Socket.IO da passare ai worker (emit thread-safe).
+    """
+    global _loop, _server
+    _loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(_loop)
+    bridge = LoopBridge(_loop.call_soon_threadsafe)
+
+    sio = socketio.AsyncServer(async_mode='asgi', cors_allowed_origins='*')
+    register_async_handlers(sio, on_feed_selection, on_disconnect, on_header_resync, on_replay)
+
+    asgi_app = socketio.ASGIApp(sio, other_asgi_app=WsgiToAsgi(flask_app))
+    config = uvicorn.Config(asgi_app, host='0.0.0.0', port=port, log_level=log_level, loop='asyncio')
+    _server = uvicorn.Server(config)
+    logger.info(f"ASGI: Socket.IO + Flask su http://0.0.0.0:{port} (uvicorn)")
+
+    return LoopSocketIO(sio, bridge)
+
+
+def run() -> None:
+    """Esegue uvicorn sul loop preparato da setup() (blocca fino allo stop)."""
+    _loop.run_until_complete(_server.serve())
+
+
+def stop() -> None:
+    if _server is not None:
+        _server.should_exit = True
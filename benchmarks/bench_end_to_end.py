@@ -0,0 +1,266 @@
+# benchmarks/bench_end_to_end.py
+#
+# End-to-end latency benchmark of the FITS pipeline on synthetic observations (synthetic_fits.py):
+# no real data from /roach2_nuraghe/data needed. Two modes:
+#   direct:  process_fits_file() is called on each file, one after the other
+#   watcher: the files are moved into a folder watched by fits_watcher (PollingObserver) at a
+#            fixed interval, as replay_observation.py does, and processed by the watcher threads
+# For every pipeline stage (pipeline_trace spans) and for the total time from file arrival to the
+# 'fits_header_update' emit it reports count and p50/p90/p99/max latency.
+# A file whose reduction failed is still emitted (header only): failures are counted separately
+# (errors logged by the pipeline, dropped files, files without a 'reduction' span) and make the
+# benchmark exit with status 1.
+#
+# Usage (from the repository root):
+#   python benchmarks/bench_end_to_end.py --kind sardara_map skarab_nodding --subscans 20 --mode both
+#   python benchmarks/bench_end_to_end.py --kind sardara_multifeed_map --multi-feed --stable-interval 0.1
+
+import argparse
+import logging
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+
+from collections import defaultdict
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import fits_processor
+import fits_watcher
+import logging_setup
+import metrics
+import nodding_manager
+import pipeline_trace
+import state
+import synthetic_fits
+
+NODDING_PREFIX = 'Nodding Pair: '
+
+
+class RecordingEmitter:
+    """Stands in for the SocketIO instance: records the arrival time of every emitted product."""
+
+    def __init__(self):
+        self.emits = []  # (time, filename)
+        self._lock = threading.Lock()
+
+    def emit(self, event, data=None, **kwargs):
+        if event == 'fits_header_update':
+            with self._lock:
+                self.emits.append((time.time(), data.get('filename')))
+
+    def start_background_task(self, target, *args, **kwargs):
+        target(*args, **kwargs)
+
+    def count(self):
+        with self._lock:
+            return len(self.emits)
+
+
+class ErrorCounter(logging.Handler):
+    """Counts the ERROR records of the pipeline loggers (e.g. 'ERRORE GRAVE' of a failed reduction)."""
+
+    def __init__(self):
+        super().__init__(level=logging.ERROR)
+        self.errors = 0
+
+    def emit(self, record):
+        self.errors += 1
+
+
+def dropped_files():
+    """Files dropped by the pipeline so far, per reason (metrics counters)."""
+    return {dict(labels).get('reason'): value for (name, labels), value in metrics.snapshot()['counters'].items()
+            if name == metrics.FILES_DROPPED}
+
+
+def unreduced_files(spans, arrivals):
+    """
+    Arrived files without a 'reduction' span. Nodding files are reduced as a pair outside the file
+    context, so they are not checked here (a failed pair still logs an error).
+    """
+    reduced = {os.path.basename(s['file']) for s in spans if s['stage'] == 'reduction' and s['file']}
+    return sorted(name for name in arrivals
+                  if name not in reduced and not nodding_manager.SKARAB_NODDING_PATTERN.search(name))
+
+
+def product_latencies(emitter, arrivals):
+    """
+    Time from file arrival to the emit of its product, for every emitted product.
+    A nodding pair is emitted under 'Nodding Pair: <prefix> (...)': it is timed from the arrival
+    of the last file of the pair.
+    """
+    latencies = []
+    for emitted_at, filename in emitter.emits:
+        if filename in arrivals:
+            latencies.append(emitted_at - arrivals[filename])
+        elif filename and filename.startswith(NODDING_PREFIX):
+            prefix = filename[len(NODDING_PREFIX):].split(' (')[0]
+            pair = [t for name, t in arrivals.items() if name.startswith(prefix)]
+            if pair:
+                latencies.append(emitted_at - max(pair))
+    return latencies
+
+
+def percentiles_row(label, values_s):
+    if not values_s:
+        return f"{label:>20} {0:>7}"
+    v = np.asarray(values_s) * 1e3
+    return (f"{label:>20} {len(v):>7} {np.percentile(v, 50):>10.1f} {np.percentile(v, 90):>10.1f} "
+            f"{np.percentile(v, 99):>10.1f} {v.max():>10.1f}")
+
+
+def print_failures(errors, dropped, unreduced):
+    """Prints the failures of one run; returns their number."""
+    dropped = {reason: int(n) for reason, n in dropped.items() if n}
+    failures = errors + sum(dropped.values()) + len(unreduced)
+    if failures:
+        print(f"{'FAILURES':>20} errors logged: {errors}, dropped: {dropped or 0}, "
+              f"not reduced: {len(unreduced)} {unreduced[:3]}")
+    return failures
+
+
+def print_report(title, spans, latencies):
+    by_stage = defaultdict(list)
+    for span in sorted(spans, key=lambda s: s['start']):  # stages listed in pipeline order
+        by_stage[span['stage']].append(span['end'] - span['start'])
+    print(f"\n{title}")
+    print(f"{'stage':>20} {'count':>7} {'p50 [ms]':>10} {'p90 [ms]':>10} {'p99 [ms]':>10} {'max [ms]':>10}")
+    for stage, durations in by_stage.items():
+        print(percentiles_row(stage, durations))
+    print(percentiles_row('total (file->emit)', latencies))
+
+
+def last_span_seq():
+    spans = pipeline_trace.spans_since(0)
+    return spans[-1]['seq'] if spans else 0
+
+
+def wait_until_idle(emitter, timeout, settle_s=2.0):
+    """Waits for the watcher to empty its processing list and for the emits and the gridding to settle."""
+    deadline = time.time() + timeout
+    last_count, last_change = -1, time.time()
+    while time.time() < deadline:
+        count = emitter.count()
+        if count != last_count:
+            last_count, last_change = count, time.time()
+        busy = fits_watcher.pending_file_count() or fits_processor.pending_gridding_sessions()
+        if not busy and time.time() - last_change >= settle_s:
+            return True
+        time.sleep(0.1)
+    return False
+
+
+def run_direct(source_dir, manifest):
+    emitter = RecordingEmitter()
+    fits_processor.set_socketio_instance_for_processor(emitter)
+    first_seq = last_span_seq()
+    arrivals = {}
+    for entry in manifest['files']:
+        path = os.path.join(source_dir, entry['path'])
+        arrivals[os.path.basename(path)] = time.time()
+        with pipeline_trace.file_context(path):
+            fits_processor.process_fits_file(path)
+    wait_until_idle(emitter, timeout=120)
+    return pipeline_trace.spans_since(first_seq), arrivals, emitter
+
+
+def run_watcher(source_dir, manifest, watch_dir, interval_s, timeout_s):
+    emitter = RecordingEmitter()
+    fits_watcher.set_monitor_directory(watch_dir)
+    fits_watcher.set_socketio_instance(emitter)
+    observer = fits_watcher.start_fits_monitor()
+    first_seq = last_span_seq()
+    arrivals = {}
+    try:
+        for entry in manifest['files']:
+            src = os.path.join(source_dir, entry['path'])
+            dst = os.path.join(watch_dir, entry['path'])
+            os.makedirs(os.path.dirname(dst), exist_ok=True)
+            os.utime(src)  # the detection span starts from the file modification time
+            arrivals[os.path.basename(dst)] = time.time()
+            os.replace(src, dst)
+            time.sleep(interval_s)
+        if not wait_until_idle(emitter, timeout_s):
+            print(f"WARNING: pipeline still busy after {timeout_s:.0f} s.")
+    finally:
+        fits_watcher.stop_fits_monitor(observer)
+    return pipeline_trace.spans_since(first_seq), arrivals, emitter
+
+
+def main():
+    parser = argparse.ArgumentParser(description='End-to-end FITS pipeline latency benchmark')
+    parser.add_argument('--kind', nargs='+', default=['sardara_map'], choices=sorted(synthetic_fits.OBSERVATION_KINDS))
+    parser.add_argument('--subscans', type=int, default=20)
+    parser.add_argument('--rows', type=int, default=synthetic_fits.DEFAULT_ROWS)
+    parser.add_argument('--channels', type=int, default=None, help='Channels per spectrum (default per backend)')
+    parser.add_argument('--feeds', type=int, default=None, help='Number of acquired feeds (default per kind)')
+    parser.add_argument('--mode', choices=['direct', 'watcher', 'both'], default='both')
+    parser.add_argument('--interval', type=float, default=0.5, help='Seconds between two files in watcher mode')
+    parser.add_argument('--stable-interval', type=float, default=fits_processor.FILE_STABLE_CHECK_INTERVAL_S,
+                        help='Interval of the file stability checks (the production default dominates the latency)')
+    parser.add_argument('--multi-feed', action='store_true', help='Grid every feed of multi-feed maps')
+    parser.add_argument('--timeout', type=float, default=300.0, help='Max wait for the pipeline to drain')
+    parser.add_argument('--workdir', default=None, help='Working folder (default: temporary, removed at the end)')
+    parser.add_argument('--log-level', default='WARNING')
+    args = parser.parse_args()
+
+    logging_setup.setup_logging(args.log_level)
+    fits_processor.FILE_STABLE_CHECK_INTERVAL_S = args.stable_interval
+    state.MULTI_FEED_MAP = args.multi_feed
+    workdir = args.workdir or tempfile.mkdtemp(prefix='quicklook_bench_')
+    fits_processor.PLOT_SAVE_DIR = os.path.join(workdir, 'plots')
+    os.makedirs(fits_processor.PLOT_SAVE_DIR, exist_ok=True)
+
+    error_counter = ErrorCounter()
+    logging.getLogger(logging_setup.ROOT_LOGGER).addHandler(error_counter)
+    failures = 0
+    try:
+        for kind in args.kind:
+            feeds = tuple(range(args.feeds)) if args.feeds else synthetic_fits.OBSERVATION_KINDS[kind]['feeds']
+            # One simulated client per feed: every file is reduced and emitted
+            for feed in feeds:
+                state.subscribe_feed(f'bench-{feed}', feed)
+            modes = ['direct', 'watcher'] if args.mode == 'both' else [args.mode]
+            for mode in modes:
+                source_dir = os.path.join(workdir, f'{kind}_{mode}_source')
+                start = time.perf_counter()
+                manifest = synthetic_fits.generate_observation(source_dir, kind, args.subscans, args.rows,
+                                                               args.channels, feeds)
+                n_bytes = sum(f['bytes'] for f in manifest['files'])
+                print(f"\n{kind}: {len(manifest['files'])} files ({n_bytes / 1e6:.1f} MB) "
+                      f"generated in {time.perf_counter() - start:.1f} s.")
+
+                errors_before, dropped_before = error_counter.errors, dropped_files()
+                start = time.perf_counter()
+                if mode == 'direct':
+                    spans, arrivals, emitter = run_direct(source_dir, manifest)
+                else:
+                    watch_dir = os.path.join(workdir, f'{kind}_watched')
+                    os.makedirs(watch_dir, exist_ok=True)
+                    spans, arrivals, emitter = run_watcher(source_dir, manifest, watch_dir, args.interval, args.timeout)
+                elapsed = time.perf_counter() - start
+                print_report(f"{kind} [{mode}]: {emitter.count()} products emitted in {elapsed:.1f} s",
+                             spans, product_latencies(emitter, arrivals))
+                dropped = {reason: n - dropped_before.get(reason, 0) for reason, n in dropped_files().items()}
+                failures += print_failures(error_counter.errors - errors_before, dropped,
+                                           unreduced_files(spans, arrivals))
+            for feed in feeds:
+                state.unsubscribe_client(f'bench-{feed}')
+    finally:
+        logging_setup.stop_logging()
+        if args.workdir is None:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    if failures:
+        print(f"\nFAILED: {failures} failures (errors logged, dropped or not reduced files).")
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,94 @@
+# benchmarks/bench_point_cloud.py
+#
+# Benchmark of the map point-cloud accumulation: np.concatenate (old approach) versus the
+# preallocated PointCloudBuffer, plus the incremental gridding pass that reads its views.
+#
+# Usage (from the repository root):
+#   python benchmarks/bench_point_cloud.py [--samples 1000000 4000000] [--rows 2000]
+
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import state
+import map_gridding
+from point_cloud import PointCloudBuffer
+
+
+def _subscans(n_samples, rows_per_subscan, seed=0):
+    """Generates OTF-like subscans (RA scans stepping in DEC) covering ~1x1 degree."""
+    rng = np.random.default_rng(seed)
+    n_subscans = max(1, n_samples // rows_per_subscan)
+    ra = np.linspace(120.0, 121.0, rows_per_subscan)
+    for k in range(n_subscans):
+        dec = np.full(rows_per_subscan, 30.0 + k / n_subscans)
+        p0 = rng.normal(100.0, 1.0, rows_per_subscan)
+        p1 = rng.normal(100.0, 1.0, rows_per_subscan)
+        yield ra, dec, p0, p1
+
+
+def bench_concatenate(n_samples, rows):
+    cache = {'RA': np.array([]), 'DEC': np.array([]), 'P0': np.array([]), 'P1': np.array([])}
+    start = time.perf_counter()
+    for ra, dec, p0, p1 in _subscans(n_samples, rows):
+        cache['RA'] = np.concatenate([cache['RA'], ra])
+        cache['DEC'] = np.concatenate([cache['DEC'], dec])
+        cache['P0'] = np.concatenate([cache['P0'], p0])
+        cache['P1'] = np.concatenate([cache['P1'], p1])
+    elapsed = time.perf_counter() - start
+    nbytes = sum(a.nbytes for a in cache.values())
+    return elapsed, nbytes
+
+
+def bench_buffer(n_samples, rows):
+    buffer = PointCloudBuffer(columns=('RA', 'DEC', 'P_Pol0', 'P_Pol1'))
+    start = time.perf_counter()
+    for ra, dec, p0, p1 in _subscans(n_samples, rows):
+        buffer.append(RA=ra, DEC=dec, P_Pol0=p0, P_Pol1=p1)
+    elapsed = time.perf_counter() - start
+    return elapsed, buffer.nbytes
+
+
+def bench_gridding(n_samples, rows):
+    """Appends every subscan to the global cache and runs the incremental gridding after each."""
+    state.initialize_map_cache()
+    state.GLOBAL_HPBW_ARCSEC = 40.0
+    points = state.GLOBAL_MAP_CACHE['POINTS']
+    per_pass = []
+    for ra, dec, p0, p1 in _subscans(n_samples, rows):
+        points.append(RA=ra, DEC=dec, P_Pol0=p0, P_Pol1=p1)
+        start = time.perf_counter()
+        map_gridding.perform_gridding()
+        per_pass.append(time.perf_counter() - start)
+    return np.array(per_pass)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Map point-cloud accumulation benchmark')
+    parser.add_argument('--samples', type=int, nargs='+', default=[1_000_000, 4_000_000])
+    parser.add_argument('--rows', type=int, default=2000, help='Samples per subscan')
+    parser.add_argument('--skip-concatenate', action='store_true',
+                        help='Skip the (quadratic) np.concatenate baseline')
+    parser.add_argument('--gridding', action='store_true', help='Also time perform_gridding after each subscan')
+    args = parser.parse_args()
+
+    print(f"{'samples':>10} {'method':>12} {'time [s]':>10} {'memory [MB]':>12}")
+    for n in args.samples:
+        if not args.skip_concatenate:
+            t, nbytes = bench_concatenate(n, args.rows)
+            print(f"{n:>10} {'concatenate':>12} {t:>10.3f} {nbytes / 1e6:>12.1f}")
+        t, nbytes = bench_buffer(n, args.rows)
+        print(f"{n:>10} {'buffer':>12} {t:>10.3f} {nbytes / 1e6:>12.1f}")
+        if args.gridding:
+            per_pass = bench_gridding(n, args.rows)
+            print(f"{n:>10} {'gridding':>12} first={per_pass[0]:.4f}s "
+                  f"median={np.median(per_pass):.4f}s last={per_pass[-1]:.4f}s")
+
+
+if __name__ == '__main__':
+    main()
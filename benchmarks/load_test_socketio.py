@@ -0,0 +1,72 @@
+# benchmarks/load_test_socketio.py
+#
+# Load test of the Socket.IO server: many simulated observers connect and receive the
+# 'fits_header_update' events emitted while FITS files are processed (e.g. copied into the
+# monitored folder with replay_observation.py). For each event it reports how many clients got it
+# and the fan-out spread (time between the first and the last client receiving it).
+#
+# Usage (server already running, any [Server] mode):
+#   python benchmarks/load_test_socketio.py --url http://localhost:5000 --clients 500 --duration 120
+
+import argparse
+import asyncio
+import time
+
+from collections import defaultdict
+
+import numpy as np
+import socketio
+
+
+async def _client(index, url, arrivals, connect_times, feed):
+    sio = socketio.AsyncClient(reconnection=False)
+
+    @sio.on('fits_header_update')
+    async def on_update(data):
+        arrivals[(data.get('filename'), data.get('filename_extension'))].append(time.perf_counter())
+
+    start = time.perf_counter()
+    await sio.connect(url, transports=['websocket'])
+    connect_times.append(time.perf_counter() - start)
+    await sio.emit('update_feed_selection', {'feed': feed})
+    return sio
+
+
+async def run(url, n_clients, duration, feed, connect_batch):
+    arrivals = defaultdict(list)
+    connect_times = []
+    clients = []
+    for i in range(0, n_clients, connect_batch):
+        batch = range(i, min(i + connect_batch, n_clients))
+        clients += await asyncio.gather(*(_client(k, url, arrivals, connect_times, feed) for k in batch))
+    print(f"{len(clients)} clients connected. Connect time: median {np.median(connect_times) * 1e3:.1f} ms, "
+          f"max {max(connect_times) * 1e3:.1f} ms. Listening for {duration} s...")
+
+    await asyncio.sleep(duration)
+    await asyncio.gather(*(c.disconnect() for c in clients))
+
+    if not arrivals:
+        print("No 'fits_header_update' received: copy some FITS files into the monitored folder.")
+        return
+    print(f"{'event':>40} {'clients':>8} {'spread [ms]':>12}")
+    spreads = []
+    for (filename, extension), times in arrivals.items():
+        spread = (max(times) - min(times)) * 1e3
+        spreads.append(spread)
+        print(f"{str(filename) + str(extension or ''):>40} {len(times):>8} {spread:>12.1f}")
+    print(f"Events: {len(arrivals)}. Fan-out spread: median {np.median(spreads):.1f} ms, max {max(spreads):.1f} ms.")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Socket.IO fan-out load test')
+    parser.add_argument('--url', default='http://localhost:5000')
+    parser.add_argument('--clients', type=int, default=200)
+    parser.add_argument('--duration', type=float, default=60.0, help='Listening time in seconds')
+    parser.add_argument('--feed', type=int, default=0, help='Feed selected by every client')
+    parser.add_argument('--connect-batch', type=int, default=50, help='Clients connected concurrently')
+    args = parser.parse_args()
+    asyncio.run(run(args.url, args.clients, args.duration, args.feed, args.connect_batch))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,312 @@
+# benchmarks/soak_map_sessions.py
+#
+# Long-session soak test of the FITS pipeline in accelerated time. Hours of simulated observing
+# (maps, multi-feed maps, SKARAB nodding pairs and nodding files whose partner feed never arrives)
+# are pushed through process_fits_file() as fast as the pipeline allows, one new scan folder per
+# simulated scan, so every map opens a new map session and every nodding file a new pairing entry.
+# The copies are renamed with the simulated time of their scan: nodding files pair on the file
+# name, so every scan must have its own stamps.
+# At a fixed simulated interval the process is sampled: RSS, threads, open file descriptors, plot
+# pages on disk, map sessions (count and bytes) and unpaired nodding files. At the end the growth
+# measured after the warmup is compared with the budgets and the tracemalloc top allocators are
+# printed; the exit code is 1 when a budget is exceeded or the pipeline failed (errors logged, map
+# scans that opened no map session, orphan nodding files never expired), so the script can run in CI.
+#
+# Usage (from the repository root):
+#   python benchmarks/soak_map_sessions.py --hours 8 --subscan-period 10
+#   python benchmarks/soak_map_sessions.py --hours 2 --map-budget-mb 64 --max-rss-growth-mb 50 --no-tracemalloc
+
+import argparse
+import logging
+import os
+import resource
+import shutil
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import bokeh_visuals
+import fits_processor
+import logging_setup
+import nodding_manager
+import pipeline_trace
+import state
+import synthetic_fits
+
+from bench_end_to_end import ErrorCounter, dropped_files
+
+# Scan types cycled through during the session; 'skarab_orphan' writes only FEED_0 of a nodding pair
+SCAN_CYCLE = ('sardara_map', 'sardara_multifeed_map', 'skarab_nodding', 'skarab_orphan')
+TEMPLATE_KINDS = ('sardara_map', 'sardara_multifeed_map', 'skarab_nodding')
+MAP_SCAN_TYPES = ('sardara_map', 'sardara_multifeed_map')
+STAMP_LENGTH = len('YYYYMMDD-HHMMSS')
+
+
+class NullEmitter:
+    """Stands in for the SocketIO instance: counts the emits without keeping them."""
+
+    def __init__(self):
+        self.emitted = 0
+        self._lock = threading.Lock()
+
+    def emit(self, event, data=None, **kwargs):
+        with self._lock:
+            self.emitted += 1
+
+    def start_background_task(self, target, *args, **kwargs):
+        target(*args, **kwargs)
+
+
+def rss_bytes():
+    """Current resident set size (Linux), or the peak RSS where /proc is not available."""
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+
+def open_fd_count():
+    for fd_dir in ('/proc/self/fd', '/dev/fd'):
+        try:
+            return len(os.listdir(fd_dir))
+        except OSError:
+            continue
+    return -1
+
+
+def plot_file_count(plot_dir):
+    try:
+        return sum(1 for name in os.listdir(plot_dir) if name.endswith('_plot.html'))
+    except OSError:
+        return 0
+
+
+def sample(sim_s, wall_s, plot_dir):
+    return {'sim_h': sim_s / 3600.0, 'wall_s': wall_s, 'rss': rss_bytes(), 'threads': threading.active_count(),
+            'fds': open_fd_count(), 'plots': plot_file_count(plot_dir), 'sessions': len(state.list_map_sessions()),
+            'session_bytes': state.map_sessions_nbytes(), 'pending_pairs': nodding_manager.pending_pair_count()}
+
+
+def print_sample_header():
+    print(f"{'sim [h]':>8} {'wall [s]':>9} {'RSS [MB]':>9} {'threads':>8} {'fds':>5} {'plots':>6} "
+          f"{'sessions':>9} {'maps [MB]':>10} {'unpaired':>9}")
+
+
+def print_sample(s):
+    print(f"{s['sim_h']:>8.2f} {s['wall_s']:>9.1f} {s['rss'] / 2**20:>9.1f} {s['threads']:>8} {s['fds']:>5} "
+          f"{s['plots']:>6} {s['sessions']:>9} {s['session_bytes'] / 2**20:>10.1f} {s['pending_pairs']:>9}")
+
+
+def build_templates(template_dir, subscans, rows, channels):
+    """One synthetic observation per kind, copied into a new scan folder for every simulated scan."""
+    templates = {}
+    for kind in TEMPLATE_KINDS:
+        source_dir = os.path.join(template_dir, kind)
+        templates[kind] = (source_dir, synthetic_fits.generate_observation(source_dir, kind, subscans, rows, channels))
+    return templates
+
+
+def copy_scan(templates, scan_type, scan_start, data_dir):
+    """
+    Copies the template of scan_type into a new scan folder, replacing the template's time stamp
+    (folder and file names) with scan_start. Returns the scan folder and the copied file paths in order.
+    """
+    kind = 'skarab_nodding' if scan_type == 'skarab_orphan' else scan_type
+    source_dir, manifest = templates[kind]
+    stamp = time.strftime('%Y%m%d-%H%M%S', time.gmtime(scan_start))
+    scan_dir = os.path.join(data_dir, stamp + manifest['scan_dir'][STAMP_LENGTH:])
+    os.makedirs(scan_dir, exist_ok=True)
+    paths = []
+    for entry in manifest['files']:
+        name = os.path.basename(entry['path'])
+        if scan_type == 'skarab_orphan' and not name.endswith('_FEED_0.fits'):
+            continue
+        target = os.path.join(scan_dir, stamp + name[STAMP_LENGTH:])
+        paths.append(shutil.copy(os.path.join(source_dir, entry['path']), target))
+    return scan_dir, paths
+
+
+def wait_for_nodding_threads(timeout_s=30.0):
+    """Waits for the nodding pair threads started by fits_processor.process_fits_file."""
+    for thread in threading.enumerate():
+        if thread.name.startswith(fits_processor.NODDING_THREAD_PREFIX):
+            thread.join(timeout_s)
+
+
+def has_map_session(scan_dir):
+    """True if the scan opened a map session (keyed by scan folder and SCANID, see fits_processor._get_scan_id)."""
+    prefix = os.path.basename(scan_dir) + '/'
+    return any(session_key[0].startswith(prefix) for session_key in state.list_map_sessions())
+
+
+def check_budgets(args, baseline, final, samples):
+    """Growth after the warmup against the budgets; returns the list of exceeded budgets."""
+    failures = []
+    peak_session_bytes = max(s['session_bytes'] for s in samples + [final])
+    if peak_session_bytes > args.map_budget_mb * 2**20:
+        failures.append(f"map sessions reached {peak_session_bytes / 2**20:.1f} MB "
+                        f"(budget {args.map_budget_mb:.1f} MB)")
+    rss_growth_mb = (final['rss'] - baseline['rss']) / 2**20
+    if rss_growth_mb > args.max_rss_growth_mb:
+        failures.append(f"RSS grew by {rss_growth_mb:.1f} MB (budget {args.max_rss_growth_mb:.1f} MB)")
+    if final['threads'] - baseline['threads'] > args.max_thread_growth:
+        failures.append(f"threads grew from {baseline['threads']} to {final['threads']} "
+                        f"(budget +{args.max_thread_growth})")
+    if final['fds'] - baseline['fds'] > args.max_fd_growth:
+        failures.append(f"open files grew from {baseline['fds']} to {final['fds']} (budget +{args.max_fd_growth})")
+    if args.max_plot_files and final['plots'] > args.max_plot_files:
+        failures.append(f"{final['plots']} plot pages on disk (budget {args.max_plot_files})")
+    if final['pending_pairs'] > args.max_unpaired:
+        failures.append(f"{final['pending_pairs']} nodding files waiting for a partner (budget {args.max_unpaired})")
+    return failures
+
+
+def print_top_allocators(start_snapshot, limit):
+    print(f"\nTop {limit} allocation growth since the end of the warmup (tracemalloc):")
+    stats = tracemalloc.take_snapshot().compare_to(start_snapshot, 'lineno')
+    for stat in stats[:limit]:
+        print(f"  {stat}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Long-session memory soak test of the FITS pipeline')
+    parser.add_argument('--hours', type=float, default=4.0, help='Simulated observing time')
+    parser.add_argument('--subscan-period', type=float, default=10.0, help='Simulated seconds per subscan')
+    parser.add_argument('--subscans-per-scan', type=int, default=8)
+    parser.add_argument('--rows', type=int, default=50)
+    parser.add_argument('--channels', type=int, default=256)
+    parser.add_argument('--sample-every', type=float, default=15.0, help='Sampling interval, in simulated minutes')
+    parser.add_argument('--warmup-fraction', type=float, default=0.1,
+                        help='Fraction of the session before the baseline sample (caches and pools fill up)')
+    parser.add_argument('--map-budget-mb', type=float, default=64.0, help='Memory budget of the map sessions')
+    parser.add_argument('--nodding-ttl', type=float, default=5.0,
+                        help='Wall-clock seconds an unpaired nodding file waits for its partner')
+    parser.add_argument('--plot-max-files', type=int, default=200, help='Plot pages kept on disk')
+    parser.add_argument('--max-rss-growth-mb', type=float, default=100.0)
+    parser.add_argument('--max-thread-growth', type=int, default=5)
+    parser.add_argument('--max-fd-growth', type=int, default=10)
+    parser.add_argument('--max-plot-files', type=int, default=None, help='Default: --plot-max-files')
+    parser.add_argument('--max-unpaired', type=int, default=50)
+    parser.add_argument('--no-tracemalloc', action='store_true', help='Disable tracemalloc (much faster)')
+    parser.add_argument('--top', type=int, default=15, help='tracemalloc allocators printed')
+    parser.add_argument('--workdir', default=None, help='Working folder (default: temporary, removed at the end)')
+    parser.add_argument('--log-level', default='ERROR')
+    args = parser.parse_args()
+    if args.subscan_period * args.subscans_per_scan < 1.0:
+        parser.error('a simulated scan must last at least 1 s (the file names are stamped to the second)')
+    if args.max_plot_files is None:
+        args.max_plot_files = args.plot_max_files
+
+    logging_setup.setup_logging(args.log_level)
+    workdir = args.workdir or tempfile.mkdtemp(prefix='quicklook_soak_')
+    data_dir = os.path.join(workdir, 'data')
+    fits_processor.PLOT_SAVE_DIR = os.path.join(workdir, 'plots')
+    os.makedirs(fits_processor.PLOT_SAVE_DIR, exist_ok=True)
+    os.makedirs(data_dir, exist_ok=True)
+
+    fits_processor.FILE_STABLE_CHECK_INTERVAL_S = 0.0
+    state.MAP_MEMORY_BUDGET_BYTES = int(args.map_budget_mb * 2**20)
+    nodding_manager.set_pair_ttl(args.nodding_ttl)
+    bokeh_visuals.set_plot_retention(args.plot_max_files, 0)
+    bokeh_visuals.PLOT_PRUNE_INTERVAL_S = 1.0
+    emitter = NullEmitter()
+    fits_processor.set_socketio_instance_for_processor(emitter)
+    for feed in range(7):  # every feed of the multi-feed map is reduced
+        state.subscribe_feed(f'soak-{feed}', feed)
+    error_counter = ErrorCounter()
+    logging.getLogger(logging_setup.ROOT_LOGGER).addHandler(error_counter)
+
+    total_subscans = int(args.hours * 3600 / args.subscan_period)
+    sample_every = max(1, int(args.sample_every * 60 / args.subscan_period))
+    warmup = int(total_subscans * args.warmup_fraction)
+    failures = []
+    try:
+        start = time.perf_counter()
+        templates = build_templates(os.path.join(workdir, 'templates'), args.subscans_per_scan, args.rows, args.channels)
+        print(f"Templates generated in {time.perf_counter() - start:.1f} s. Simulating {args.hours:g} h "
+              f"({total_subscans} subscans, warmup {warmup}).\n")
+        print_sample_header()
+
+        start = time.perf_counter()
+        baseline, snapshot, processed, scan_index = None, None, 0, 0
+        sim_start = time.time()
+        map_scans_without_session, orphan_files = 0, 0
+        samples = [sample(0.0, 0.0, fits_processor.PLOT_SAVE_DIR)]
+        print_sample(samples[-1])
+        while processed < total_subscans:
+            scan_type = SCAN_CYCLE[scan_index % len(SCAN_CYCLE)]
+            scan_dir, paths = copy_scan(templates, scan_type, sim_start + processed * args.subscan_period, data_dir)
+            scan_index += 1
+            for path in paths:
+                with pipeline_trace.file_context(path):
+                    fits_processor.process_fits_file(path)
+            if scan_type in MAP_SCAN_TYPES and not has_map_session(scan_dir):
+                map_scans_without_session += 1
+            elif scan_type == 'skarab_orphan':
+                orphan_files += len(paths)
+            # Nodding pairs are reduced in a thread of their own: remove the folder once they are done
+            wait_for_nodding_threads()
+            shutil.rmtree(scan_dir, ignore_errors=True)
+
+            before = processed
+            processed += args.subscans_per_scan
+            if before < warmup <= processed:
+                baseline = sample(processed * args.subscan_period, time.perf_counter() - start,
+                                  fits_processor.PLOT_SAVE_DIR)
+                if not args.no_tracemalloc:
+                    tracemalloc.start()
+                    snapshot = tracemalloc.take_snapshot()
+            if before // sample_every != processed // sample_every or processed >= total_subscans:
+                samples.append(sample(processed * args.subscan_period, time.perf_counter() - start,
+                                      fits_processor.PLOT_SAVE_DIR))
+                print_sample(samples[-1])
+
+        while fits_processor.pending_gridding_sessions():
+            time.sleep(0.1)
+        # The expiry runs on the next nodding file: give the last orphans their TTL, then trigger it
+        time.sleep(args.nodding_ttl)
+        nodding_manager.expire_stale_pairs()
+        # Pruning is throttled (PLOT_PRUNE_INTERVAL_S): measure the plot folder after the last pass
+        bokeh_visuals.prune_plots(fits_processor.PLOT_SAVE_DIR, force=True)
+        final = sample(processed * args.subscan_period, time.perf_counter() - start, fits_processor.PLOT_SAVE_DIR)
+        print_sample(final)
+        print(f"\n{emitter.emitted} emits, {scan_index} scans in {final['wall_s']:.1f} s "
+              f"(x{processed * args.subscan_period / max(final['wall_s'], 1e-9):.0f} real time).")
+
+        if snapshot is not None:
+            print_top_allocators(snapshot, args.top)
+            tracemalloc.stop()
+        failures = check_budgets(args, baseline or samples[0], final, samples)
+        if error_counter.errors:
+            failures.append(f"{error_counter.errors} errors logged by the pipeline")
+        if map_scans_without_session:
+            failures.append(f"{map_scans_without_session} map scans opened no map session")
+        expired = int(dropped_files().get('nodding_unpaired', 0))
+        if expired != orphan_files:
+            failures.append(f"{expired} unpaired nodding files expired, {orphan_files} written without a partner")
+    finally:
+        for feed in range(7):
+            state.unsubscribe_client(f'soak-{feed}')
+        logging_setup.stop_logging()
+        if args.workdir is None:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    if failures:
+        print("\nFAILED:")
+        for failure in failures:
+            print(f"  {failure}")
+        sys.exit(1)
+    print("\nAll growth within budget.")
+
+
+if __name__ == '__main__':
+    main()
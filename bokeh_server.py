@@ -1,18 +1,26 @@
 # bokeh_server.py
 
+import asyncio
 import threading
+from collections import OrderedDict
+from functools import partial
 from bokeh.plotting import curdoc
 from bokeh.application import Application
 from bokeh.application.handlers.function import FunctionHandler
 from bokeh.server.server import Server
 import numpy as np # Importa NumPy
-from typing import Dict, Any, List, Optional
+from typing import Callable, Dict, Any, List, Optional, Tuple
+import itertools
 from threading import Thread
 
 # Importa i tuoi moduli: stato globale, visualizzazioni e Worker B
 import state
+import map_gridding
+import logging_setup
 # Importa la funzione di creazione del plot iniziale (es. da bokeh_visuals.py)
-from bokeh_visuals import create_map_layout 
+from bokeh_visuals import create_map_layout, LATEST_SESSION_OPTION
+
+logger = logging_setup.get_logger(__name__)
 
 # Variabili Globali per la Gestione del Server
 server: Optional[Server] = None
@@ -32,122 +40,353 @@ def modify_doc(doc):
     # 1. Creazione degli elementi Bokeh iniziali (figure, sources, color_mapper)
     layout_obj, doc_state = create_map_layout(doc)
     
-    # 2. Salva gli oggetti Bokeh nello stato globale per l'aggiornamento
-    # state.BOKEH_DOC_STATE viene popolato con {'doc': doc, 'source_pol0': ..., ...}
-    state.BOKEH_DOC_STATE = doc_state
-    
-    # 3. Aggiunge il layout al documento
+    # 2. Registra il documento tra le sessioni aperte: ogni risultato della grigliatura
+    # viene inviato a tutti i viewer collegati. La sessione viene rimossa alla chiusura.
+    session_id = doc.session_context.id if doc.session_context is not None else str(id(doc))
+    with state.bokeh_sessions_lock:
+        state.BOKEH_SESSIONS[session_id] = doc_state
+    logger.info(f"BOKEH: Nuova sessione del viewer {session_id}. Sessioni aperte: {len(state.BOKEH_SESSIONS)}")
+
+    def on_session_destroyed(session_context):
+        with state.bokeh_sessions_lock:
+            state.BOKEH_SESSIONS.pop(session_id, None)
+        logger.info(f"BOKEH: Sessione del viewer {session_id} chiusa. Sessioni aperte: {len(state.BOKEH_SESSIONS)}")
+
+    doc.on_session_destroyed(on_session_destroyed)
+
+    # 3. Ad ogni zoom/pan il viewer richiede solo il livello e il tile della piramide
+    # che corrispondono al nuovo viewport (callback eseguita sul thread del documento).
+    def on_range_change(attr, old, new):
+        if not doc_state.get('updating_ranges'):
+            _push_viewport_tiles(doc_state)
+
+    for rng in (doc_state['x_range'], doc_state['y_range']):
+        rng.on_change('start', on_range_change)
+        rng.on_change('end', on_range_change)
+
+    # 3b. Cambio della sessione di mappa visualizzata: si mostra l'ultimo risultato gi�
+    # calcolato per quella sessione, senza ri-grigliare.
+    def on_session_change(attr, old, new):
+        _select_session(doc_state, None if new == LATEST_SESSION_OPTION[0] else _decode_session_key(new))
+
+    doc_state['session_select'].on_change('value', on_session_change)
+    _refresh_session_options(doc_state)
+
+    # 4. Aggiunge il layout al documento
     doc.add_root(layout_obj)
 
+    # 5. Se una mappa � gi� disponibile, la mostra subito
+    if state.LATEST_MAP_RESULT is not None:
+        _apply_map_result(doc_state, state.LATEST_MAP_RESULT)
+
 # ----------------------------------------------------------------------
 # 2. GESTIONE AGGIORNAMENTO (Chiamato dal Worker B)
 # ----------------------------------------------------------------------
 
-def update_bokeh_plot(result_maps: Dict[str, Dict[str, Any]]):
+# Dimensione di riferimento del viewport (pixel) se quella reale non � ancora nota
+DEFAULT_VIEWPORT_PX = (600, 500)
+
+_result_counter = itertools.count(1)
+
+# Ultima versione di risultato per sessione di mappa: il riquadro 'dirty' di un risultato
+# � relativo al risultato precedente della stessa sessione ('base_version').
+_last_version_by_session: Dict[Any, int] = {}
+
+# Come viene eseguito l'invio di un risultato ai documenti: di default subito, nel thread
+# del chiamante; in modalit� single loop passa dalla coda del loop condiviso.
+_update_dispatcher: Callable[[Callable, Dict[str, Any]], None] = lambda fn, result_maps: fn(result_maps)
+
+
+def set_update_dispatcher(dispatcher: Callable[[Callable, Dict[str, Any]], None]):
+    """Imposta la funzione dispatcher(fn, result_maps) che esegue fn(result_maps). Chiamata da single_loop_server."""
+    global _update_dispatcher
+    _update_dispatcher = dispatcher
+
+# Tile gi� estratti dalla piramide, condivisi tra i documenti: i viewer che mostrano lo stesso
+# viewport (tipicamente l'intera mappa) ricevono lo stesso array, estratto una sola volta.
+# Usata solo dal thread del server Bokeh (le callback dei documenti girano sul suo IOLoop).
+TILE_CACHE_SIZE = 64
+_tile_cache: "OrderedDict[Tuple, Dict[str, Any]]" = OrderedDict()
+
+
+def _get_shared_tile(result_maps: Dict[str, Any], pol_key: str, x_start, x_end, y_start, y_end,
+                     width_px: int, height_px: int) -> Dict[str, Any]:
+    """get_map_tile con cache per (versione, polarizzazione, viewport): un'estrazione per tutti i documenti."""
+    key = (result_maps['version'], pol_key, x_start, x_end, y_start, y_end, width_px, height_px)
+    tile = _tile_cache.get(key)
+    if tile is None:
+        tile = map_gridding.get_map_tile(result_maps, pol_key, x_start, x_end, y_start, y_end, width_px, height_px)
+        _tile_cache[key] = tile
+        if len(_tile_cache) > TILE_CACHE_SIZE:
+            _tile_cache.popitem(last=False)
+    else:
+        _tile_cache.move_to_end(key)
+    return tile
+
+
+def _encode_session_key(session_key) -> str:
+    return "|".join(str(part) for part in session_key)
+
+
+def _decode_session_key(value: str):
+    scan_id, frame, feed = value.rsplit("|", 2)
+    return scan_id, frame, None if feed == 'None' else int(feed)
+
+
+def _session_label(session_key) -> str:
+    scan_id, frame, feed = session_key
+    return f"{scan_id} [{frame}]" + (" (multi-feed)" if feed is None else f" feed {feed}")
+
+
+def _refresh_session_options(doc_state: Dict[str, Any]):
+    """Aggiorna le opzioni del selettore con le sessioni di mappa attualmente in memoria."""
+    options = [LATEST_SESSION_OPTION] + [
+        (_encode_session_key(key), _session_label(key)) for key in state.list_map_sessions()
+    ]
+    if doc_state['session_select'].options != options:
+        doc_state['session_select'].options = options
+
+
+def _select_session(doc_state: Dict[str, Any], session_key):
+    """Mostra nel documento la sessione richiesta (None = ultima mappa aggiornata)."""
+    doc_state['session_key'] = session_key
+    if session_key is None:
+        result_maps = state.LATEST_MAP_RESULT
+    else:
+        map_cache = state.touch_map_session(session_key)
+        result_maps = map_cache['LATEST_RESULT'] if map_cache else None
+
+    if result_maps is None:
+        logger.info(f"BOKEH: Nessuna mappa grigliata disponibile per la sessione {session_key}.")
+        return
+
+    # Mappa diversa: la vista viene riadattata alla sua estensione
+    doc_state['map_extent'] = None
+    _apply_map_result(doc_state, result_maps)
+
+
+def _viewport_px(fig) -> Tuple[int, int]:
+    """Dimensione in pixel dell'area dati della figura (inner_width/inner_height se disponibili)."""
+    width = getattr(fig, 'inner_width', None) or fig.width or DEFAULT_VIEWPORT_PX[0]
+    height = getattr(fig, 'inner_height', None) or fig.height or DEFAULT_VIEWPORT_PX[1]
+    return int(width), int(height)
+
+
+def _push_viewport_tiles(doc_state: Dict[str, Any]):
+    """
+    Aggiorna i ColumnDataSource con il tile della piramide che corrisponde al viewport corrente.
+    Va eseguita sul thread del documento Bokeh. Se il tile non � cambiato non invia nulla.
+    """
+    result_maps = doc_state.get('result')
+    if not result_maps or 'pyramid' not in result_maps:
+        return
+
+    x_range, y_range = doc_state['x_range'], doc_state['y_range']
+    for pol_key in result_maps['pyramid']:
+        source = doc_state[f'source_{pol_key.lower()}']
+        width_px, height_px = _viewport_px(doc_state[f'figure_{pol_key.lower()}'])
+
+        tile = _get_shared_tile(result_maps, pol_key, x_range.start, x_range.end,
+                                y_range.start, y_range.end, width_px, height_px)
+        # Versione del risultato + geometria del tile (origine della mappa, livello, finestra)
+        tile_key = (result_maps['version'], result_maps['x0'], result_maps['y0'], tile['level'], tile['window'])
+        previous_key = doc_state['tiles'].get(pol_key)
+        if previous_key == tile_key:
+            continue
+        doc_state['tiles'][pol_key] = tile_key
+
+        # Stessa geometria e risultato successivo a quello mostrato: si inviano solo le celle modificate
+        if previous_key is not None and previous_key[1:] == tile_key[1:] \
+                and previous_key[0] == result_maps.get('base_version') and result_maps.get('dirty') is not None:
+            _patch_tile(source, pol_key, tile, result_maps['dirty'])
+            continue
+
+        source.data = {
+            'image': [tile['image']], # Il tile 2D della mappa (ndarray)
+            'x': [tile['x']],         # RA/X iniziale
+            'y': [tile['y']],         # DEC/Y iniziale
+            'dw': [tile['dw']],       # Larghezza in RA
+            'dh': [tile['dh']],       # Altezza in DEC
+        }
+        logger.info(f"BOKEH: Tile {pol_key} inviato (livello {tile['level']}, shape {tile['image'].shape}).")
+
+
+def _patch_tile(source, pol_key: str, tile: Dict[str, Any], dirty: Tuple[int, int, int, int]):
+    """
+    Aggiorna con ColumnDataSource.patch solo il riquadro modificato dell'immagine gi� mostrata.
+    dirty (righe/colonne del livello 0) viene riportato al livello e alla finestra del tile.
+    """
+    level = tile['level']
+    r0, r1, c0, c1 = tile['window']
+    scale = 2 ** level
+    d_r0 = max(dirty[0] // scale, r0) - r0
+    d_r1 = min(-(-dirty[1] // scale), r1) - r0
+    d_c0 = max(dirty[2] // scale, c0) - c0
+    d_c1 = min(-(-dirty[3] // scale), c1) - c0
+    if d_r1 <= d_r0 or d_c1 <= d_c0:
+        return # Nessuna cella modificata nel tile visualizzato
+
+    values = tile['image'][d_r0:d_r1, d_c0:d_c1]
+    source.patch({'image': [((0, slice(d_r0, d_r1), slice(d_c0, d_c1)), values.ravel())]})
+    logger.info(f"BOKEH: Patch {pol_key} inviata (livello {level}, {values.shape[0]} x {values.shape[1]} celle "
+                f"su {tile['image'].shape[0]} x {tile['image'].shape[1]}).")
+
+
+def _apply_map_result(doc_state: Dict[str, Any], result_maps: Dict[str, Any]):
+    """
+    Applica un nuovo risultato di grigliatura al documento: range colore, eventuale
+    adattamento dei range all'estensione della mappa e invio dei tile del viewport.
+    """
+    x_range, y_range = doc_state['x_range'], doc_state['y_range']
+    color_mapper = doc_state['color_mapper']
+    doc_state['result'] = result_maps
+
+    # Aggiornamento del Range di Colore (CRUCIALE per la ColorBar)
+    color_ranges = list(result_maps.get('color_range', {}).values())
+    if color_ranges:
+        color_mapper.low = min(low for low, _ in color_ranges)
+        color_mapper.high = max(high for _, high in color_ranges)
+
+    # Estensione della mappa (livello 0 della piramide)
+    n_rows, n_cols = next(iter(result_maps['pyramid'].values()))[0].shape
+    step = result_maps['step_deg']
+    extent = (result_maps['x0'], result_maps['x0'] + n_cols * step,
+              result_maps['y0'], result_maps['y0'] + n_rows * step)
+
+    previous_extent = doc_state['map_extent']
+    if extent != previous_extent:
+        # La vista segue la mappa che cresce solo se l'utente non ha zoomato/spostato il viewport
+        showing_full_map = previous_extent is None or (
+            (x_range.start, x_range.end, y_range.start, y_range.end) == previous_extent)
+        if showing_full_map:
+            doc_state['updating_ranges'] = True
+            try:
+                x_range.update(start=extent[0], end=extent[1])
+                y_range.update(start=extent[2], end=extent[3])
+            finally:
+                doc_state['updating_ranges'] = False
+        doc_state['map_extent'] = extent
+
+    _push_viewport_tiles(doc_state)
+
+
+def update_bokeh_plot(result_maps: Dict[str, Any]):
     """
     Aggiorna i ColumnDataSource del documento Bokeh con le nuove mappe grigliate.
     Questa funzione � CHIAMATA DA UN ALTRO THREAD (Worker B).
 
+    Il risultato viene salvato in state.LATEST_MAP_RESULT e al browser viene inviato solo il
+    tile della piramide multi-risoluzione che corrisponde al viewport corrente, quindi la
+    dimensione degli aggiornamenti non cresce con la mappa. Se la geometria del tile non �
+    cambiata viene inviato (patch) solo il riquadro modificato dall'ultima grigliatura.
+
     Parametri:
-    - result_maps: Dizionario contenente le mappe grigliate (es. {'Pol0': {...}, 'Pol1': {...}})
+    - result_maps: Dizionario restituito da map_gridding.perform_gridding()
     """
-    global server
-    
-    doc_state = state.BOKEH_DOC_STATE
-    if doc_state is None or doc_state['doc'] is None:
-        print("BOKEH: Stato del documento non inizializzato. Skippo aggiornamento.")
+    if 'pyramid' not in result_maps:
+        logger.info("BOKEH: Risultato della grigliatura senza piramide. Skippo aggiornamento.")
         return
 
-    def safe_update():
+    result_maps['version'] = next(_result_counter)
+    result_maps['base_version'] = _last_version_by_session.get(result_maps.get('session_key'))
+    _last_version_by_session[result_maps.get('session_key')] = result_maps['version']
+    state.LATEST_MAP_RESULT = result_maps
+
+    _update_dispatcher(_fan_out_map_result, result_maps)
+
+
+def _fan_out_map_result(result_maps: Dict[str, Any]):
+    """Invia il risultato a tutti i documenti aperti, ciascuno sul proprio next tick."""
+    with state.bokeh_sessions_lock:
+        doc_states = list(state.BOKEH_SESSIONS.values())
+    if not doc_states:
+        logger.info("BOKEH: Nessun viewer collegato. Skippo aggiornamento.")
+        return
+
+    def safe_update(doc_state):
         """
         Esegue l'aggiornamento dei ColumnDataSource del plot Bokeh in modo sicuro,
         essendo chiamata tramite doc.add_next_tick_callback.
         """
-        
-        # Recupero i riferimenti agli oggetti Bokeh dallo stato globale
-        source_pol0 = doc_state['source_pol0']
-        source_pol1 = doc_state['source_pol1']
-        color_mapper = doc_state['color_mapper']
-        
-        print(f"BOKEH: Esecuzione aggiornamento sicuro (safe_update) per {len(result_maps)} mappe.")
-
-        # --- Aggiornamento Pol0 ---
-        if 'Pol0' in result_maps:
-            grid_map = result_maps['Pol0']
-            
-            # Aggiornamento dei dati della mappa e delle dimensioni (ImageRenderer)
-            source_pol0.data = {
-                'image': [grid_map['image']], # La matrice 2D della mappa (ndarray)
-                'x': [grid_map['x']],         # RA/X iniziale
-                'y': [grid_map['y']],         # DEC/Y iniziale
-                'dw': [grid_map['dw']],       # Larghezza mappa in RA
-                'dh': [grid_map['dh']],       # Altezza mappa in DEC
-            }
-            
-            # Aggiornamento del Range di Colore (CRUCIALE per la ColorBar)
-            if 'low_color' in grid_map and 'high_color' in grid_map:
-                 color_mapper.low = grid_map['low_color']
-                 color_mapper.high = grid_map['high_color']
-
-            print(f"BOKEH: Aggiornamento dati Pol0 completato. Range colore: [{color_mapper.low:.2f}, {color_mapper.high:.2f}]")
-
-        # --- Aggiornamento Pol1 ---
-        if 'Pol1' in result_maps:
-            grid_map = result_maps['Pol1']
-            
-            # Aggiornamento dei dati della mappa e delle dimensioni
-            source_pol1.data = {
-                'image': [grid_map['image']], 
-                'x': [grid_map['x']],         
-                'y': [grid_map['y']],         
-                'dw': [grid_map['dw']],       
-                'dh': [grid_map['dh']],       
-            }
-            
-            # Aggiornamento del Range di Colore
-            if 'low_color' in grid_map and 'high_color' in grid_map:
-                 color_mapper.low = grid_map['low_color']
-                 color_mapper.high = grid_map['high_color']
-
-            print(f"BOKEH: Aggiornamento dati Pol1 completato. Range colore: [{color_mapper.low:.2f}, {color_mapper.high:.2f}]")
-
-        print("BOKEH: Trasmissione dati al frontend completata.")
+        _refresh_session_options(doc_state)
+
+        # Il documento riceve la mappa solo se segue l'ultima aggiornata o se visualizza questa sessione
+        viewed_key = doc_state['session_key']
+        if viewed_key is not None and viewed_key != result_maps.get('session_key'):
+            return
+
+        logger.info("BOKEH: Esecuzione aggiornamento sicuro (safe_update) della mappa.")
+        _apply_map_result(doc_state, result_maps)
+        logger.info(f"BOKEH: Trasmissione dati al frontend completata. Range colore: [{doc_state['color_mapper'].low:.2f}, {doc_state['color_mapper'].high:.2f}]")
 
 
     # Inietta la funzione di aggiornamento (safe_update) nella coda di esecuzione del server Bokeh
-    # Questo garantisce che l'aggiornamento avvenga sul thread corretto di Bokeh.
-    doc_state['doc'].add_next_tick_callback(safe_update)
-    print("BOKEH: Richiesta di aggiornamento inviata al thread del server.")
+    # di ciascun documento. Questo garantisce che l'aggiornamento avvenga sul thread corretto di Bokeh.
+    for doc_state in doc_states:
+        try:
+            doc_state['doc'].add_next_tick_callback(partial(safe_update, doc_state))
+        except Exception as e:
+            # Sessione in chiusura: verr� rimossa da on_session_destroyed
+            logger.warning(f"BOKEH: Impossibile aggiornare un documento ({e}).")
+    logger.info(f"BOKEH: Richiesta di aggiornamento inviata a {len(doc_states)} viewer.")
 
 
 # ----------------------------------------------------------------------
 # 3. AVVIO DEL SERVER
 # ----------------------------------------------------------------------
 
-def start_bokeh_server(port: int = 5006, app_name: str = '/map_viewer'):
+def start_bokeh_server(port: int = 5006, app_name: str = '/map_viewer',
+                       allow_websocket_origin: Optional[List[str]] = None, io_loop=None):
     """
-    Avvia il server Bokeh in un thread separato.
+    Avvia il server Bokeh in un thread separato, con il proprio IOLoop.
+    allow_websocket_origin: host[:porta] da cui i browser possono aprire il viewer
+    (default: solo localhost).
+    io_loop: se indicato, il server viene solo registrato su quel loop (nessun thread:
+    modalit� single loop, il loop viene avviato dal chiamante).
     """
     global server, server_thread
 
-    if server_thread and server_thread.is_alive():
-        print("BOKEH: Server gi� attivo.")
+    if (server_thread and server_thread.is_alive()) or (io_loop is not None and server is not None):
+        logger.info("BOKEH: Server gi� attivo.")
         return
 
-    print(f"BOKEH: Avvio Server su http://localhost:{port}{app_name}")
+    logger.info(f"BOKEH: Avvio Server su http://localhost:{port}{app_name}")
     
     # 1. Crea l'Applicazione Bokeh (usa la funzione modify_doc come handler)
     app = Application(FunctionHandler(modify_doc))
+    origins = allow_websocket_origin or [f"localhost:{port}"]
+
+    if io_loop is not None:
+        server = Server({app_name: app}, port=port, allow_websocket_origin=origins, io_loop=io_loop)
+        server.start()
+        logger.info(f"BOKEH: Server registrato sul loop condiviso (origini websocket: {', '.join(origins)}).")
+        return
 
-    # 2. Configura e avvia il Server
-    server = Server({app_name: app}, port=port, allow_websocket_origin=[f"localhost:{port}"])
+    started = threading.Event()
 
     def run_server():
-        # Questo blocca finch� il server non viene spento
-        server.run_until_shutdown()
+        global server
+        # Il thread non � il principale: serve un event loop proprio per l'IOLoop di Tornado.
+        # run_until_shutdown() non si pu� usare perch� installa gestori di segnale (solo main thread).
+        asyncio.set_event_loop(asyncio.new_event_loop())
+
+        # 2. Configura e avvia il Server
+        server = Server({app_name: app}, port=port, allow_websocket_origin=origins)
+        server.start()
+        started.set()
+        server.io_loop.start() # Blocca finch� il server non viene spento
 
     # 3. Avvia il thread del server
-    server_thread = Thread(target=run_server, daemon=True)
+    server_thread = Thread(target=run_server, name='BokehServer', daemon=True)
     server_thread.start()
+    started.wait(timeout=10)
     
-    print("BOKEH: Server avviato in thread separato.")
\ No newline at end of file
+    logger.info(f"BOKEH: Server avviato in thread separato (origini websocket: {', '.join(origins)}).")
+
+
+def stop_bokeh_server():
+    """Ferma il server Bokeh (se attivo)."""
+    if server is not None and server_thread and server_thread.is_alive():
+        server.io_loop.add_callback(server.io_loop.stop)
+        server_thread.join(timeout=5)
+        logger.info("BOKEH: Server fermato.")
@@ -1,6 +1,9 @@
 import os
 import numpy as np
 import state
+import pipeline_trace
+import logging_setup
+import threading
 import time
 
 # Moduli per la creazione di figure e layout di base
@@ -16,18 +19,126 @@ from bokeh.models import (
     ColumnDataSource, 
     LinearColorMapper, 
     ColorBar, 
-    Panel, 
-    Tabs
+    Tabs,
+    Select
 )
+try:
+    from bokeh.models import TabPanel as Panel # bokeh >= 3.0
+except ImportError:
+    from bokeh.models import Panel # bokeh 2.x
 from bokeh.models.mappers import LinearColorMapper
 from bokeh.palettes import Category10
 from bokeh.palettes import Magma256 
 from bokeh.plotting import figure, column, show # Import Bokeh plotting tools
 from bokeh.plotting import figure
 from bokeh.resources import CDN # For CDN resources (JS/CSS)
+from bokeh.resources import Resources
 
 from typing import Dict, Any, Tuple
 
+logger = logging_setup.get_logger(__name__)
+
+
+# Risorse BokehJS usate dalle pagine HTML standalone dei plot.
+# Default: CDN pubblico. In sala controllo (rete isolata) app.py imposta le risorse
+# servite localmente da Flask tramite set_plot_resources().
+_plot_resources = CDN
+
+
+# Conservazione delle pagine HTML dei plot (una per file elaborato): senza limiti la cartella
+# static/plots cresce per tutta la sessione. Si tengono al massimo PLOT_MAX_FILES pagine, nessuna
+# più vecchia di PLOT_MAX_AGE_S (0 = nessun limite). La pulizia gira al più ogni PLOT_PRUNE_INTERVAL_S.
+PLOT_MAX_FILES = 500
+PLOT_MAX_AGE_S = 24 * 3600.0
+PLOT_PRUNE_INTERVAL_S = 60.0
+_PLOT_SUFFIX = "_plot.html"
+
+_last_prune = 0.0
+_prune_lock = threading.Lock()
+
+
+def set_plot_retention(max_files, max_age_s):
+    """
+    Sets how many plot pages are kept in the plot folder and for how long (0 = no limit).
+    Called by app.py from the [Bokeh] section of config.ini.
+    """
+    global PLOT_MAX_FILES, PLOT_MAX_AGE_S
+    PLOT_MAX_FILES = max(0, int(max_files))
+    PLOT_MAX_AGE_S = max(0.0, float(max_age_s))
+
+
+def prune_plots(plot_save_dir, force=False):
+    """
+    Removes the oldest plot pages beyond PLOT_MAX_FILES and those older than PLOT_MAX_AGE_S.
+    Throttled to one scan of the folder every PLOT_PRUNE_INTERVAL_S unless force is True.
+    Returns the number of removed files.
+    """
+    global _last_prune
+    now = time.time()
+    with _prune_lock:
+        if not force and now - _last_prune < PLOT_PRUNE_INTERVAL_S:
+            return 0
+        _last_prune = now
+    try:
+        with os.scandir(plot_save_dir) as entries:
+            plots = [(entry.stat().st_mtime, entry.path) for entry in entries
+                     if entry.is_file() and entry.name.endswith(_PLOT_SUFFIX)]
+    except OSError as e:
+        logger.warning(f"Pulizia dei plot non riuscita in {plot_save_dir}: {e}")
+        return 0
+
+    plots.sort(reverse=True) # Dal più recente
+    stale = plots[PLOT_MAX_FILES:] if PLOT_MAX_FILES else []
+    if PLOT_MAX_AGE_S:
+        stale += [plot for plot in plots[:len(plots) - len(stale)] if now - plot[0] > PLOT_MAX_AGE_S]
+    removed = 0
+    for _, path in stale:
+        try:
+            os.remove(path)
+            removed += 1
+        except OSError:
+            pass # Già rimosso (es. da un altro worker sulla stessa cartella)
+    if removed:
+        logger.debug(f"Rimossi {removed} plot HTML da {plot_save_dir}.")
+    return removed
+
+
+def set_plot_resources(resources):
+    """
+    Sets the BokehJS resources referenced by the standalone plot pages written by
+    _plot_and_save_html and _plot_and_save_skarab_nodding_html.
+
+    Args:
+        resources (bokeh.resources.Resources): e.g. CDN or the self-hosted resources
+                                               returned by make_self_hosted_resources().
+    """
+    global _plot_resources
+    _plot_resources = resources
+    logger.info(f"Bokeh plot resources set to mode '{resources.mode}'.")
+
+
+def make_self_hosted_resources(root_url):
+    """
+    Builds Resources whose script URLs point to the BokehJS bundle served by the Flask app
+    (e.g. root_url='/bokehjs/3.0.0/' -> '/bokehjs/3.0.0/static/js/bokeh.min.js').
+    The Bokeh version is part of root_url, so the files behind it never change and can be
+    cached by the browser as immutable.
+    """
+    return Resources(mode="server", root_url=root_url)
+
+
+def get_bokehjs_dir():
+    """
+    Returns the directory containing the BokehJS bundle shipped with the installed bokeh package
+    (the folder that contains 'js/bokeh.min.js').
+    """
+    try:
+        from bokeh.util.paths import bokehjs_path # bokeh >= 3.1
+        return str(bokehjs_path())
+    except ImportError:
+        from bokeh.util.paths import bokehjsdir # bokeh 3.0
+        return bokehjsdir()
+
 
 
 def _plot_and_save_skarab_nodding_html(plot_save_dir, 
@@ -73,7 +184,8 @@ def _plot_and_save_skarab_nodding_html(plot_save_dir,
             p.legend.click_policy = "hide"
 
         end_time_bokeh_build = time.time()
-        print(f"PROFILING: [Timer 2 NODDING] Costruzione Oggetto Bokeh completata in {end_time_bokeh_build - start_time_bokeh_build:.4f} secondi.")
+        logger.debug(f"PROFILING: [Timer 2 NODDING] Costruzione Oggetto Bokeh completata in {end_time_bokeh_build - start_time_bokeh_build:.4f} secondi.")
+        pipeline_trace.record_span('plot_build', start_time_bokeh_build, end_time_bokeh_build)
 
         # --- SEZIONE SCRITTURA FILE HTML ---
         start_time_io_write = time.time()
@@ -83,21 +195,22 @@ def _plot_and_save_skarab_nodding_html(plot_save_dir,
         full_plot_path = os.path.join(plot_save_dir, plot_html_filename)
         plot_static_url = f"/static/plots/{plot_html_filename}"
 
-        html_content = file_html(final_plot_layout, CDN, title=f"SKARAB Nodding Plot: {filename_prefix}")
+        html_content = file_html(final_plot_layout, _plot_resources, title=f"SKARAB Nodding Plot: {filename_prefix}")
         with open(full_plot_path, "w") as f:
             f.write(html_content)
 
         end_time_io_write = time.time()
-        print(f"PROFILING: [Timer 3 NODDING] Scrittura file HTML completata in {end_time_io_write - start_time_io_write:.4f} secondi.")
+        logger.debug(f"PROFILING: [Timer 3 NODDING] Scrittura file HTML completata in {end_time_io_write - start_time_io_write:.4f} secondi.")
+        pipeline_trace.record_span('html_write', start_time_io_write, end_time_io_write)
+        prune_plots(plot_save_dir)
 
         end_time_total = time.time()
-        print(f"PROFILING: TEMPO TOTALE (Nodding) completato in {end_time_total - start_time_total:.4f} secondi.")
-        print("---------------------------------------")
+        logger.debug(f"PROFILING: TEMPO TOTALE (Nodding) completato in {end_time_total - start_time_total:.4f} secondi.")
         
         return plot_static_url
 
     except Exception as e:
-        print(f"ERRORE GRAVE nel plotting NODDING per {filename_prefix}: {e}")
+        logger.error(f"ERRORE GRAVE nel plotting NODDING per {filename_prefix}: {e}")
         return None
 
 
@@ -109,9 +222,7 @@ def _plot_and_save_html(plot_save_dir, filepath, filename_prefix, filename_exten
     f_min = float(freq)
     f_max = float(f_min) + float(bw)
 
-    print(f_min)
-    print(f_max)
-    print((f_max-f_min)/chs)
+    logger.debug("Asse in frequenza: %s - %s MHz, %s MHz per canale", f_min, f_max, (f_max - f_min) / chs)
 
 
 
@@ -216,7 +327,8 @@ def _plot_and_save_html(plot_save_dir, filepath, filename_prefix, filename_exten
         # ----------------------------------------------------------------------
         # TIMER 2: Tempo di Generazione Plot (p.line e costruzione del layout)
         end_time_bokeh_build = time.time()
-        print(f"PROFILING: [Timer 2] Costruzione Oggetto Bokeh completata in {end_time_bokeh_build - start_time_bokeh_build:.4f} secondi.")
+        logger.debug(f"PROFILING: [Timer 2] Costruzione Oggetto Bokeh completata in {end_time_bokeh_build - start_time_bokeh_build:.4f} secondi.")
+        pipeline_trace.record_span('plot_build', start_time_bokeh_build, end_time_bokeh_build)
 
 
         # --- SEZIONE 3: SCRITTURA FILE HTML (Potenziale bottleneck I/O Rete) ---
@@ -229,30 +341,34 @@ def _plot_and_save_html(plot_save_dir, filepath, filename_prefix, filename_exten
         plot_static_url = f"/static/plots/{plot_html_filename}"
 
         # Generazione del contenuto HTML e scrittura su disco
-        html_content = file_html(final_plot_layout, CDN, title=f"FITS Data Plot: {filename_prefix}")
+        html_content = file_html(final_plot_layout, _plot_resources, title=f"FITS Data Plot: {filename_prefix}")
         with open(full_plot_path, "w") as f:
             f.write(html_content)
 
         # ----------------------------------------------------------------------
         # TIMER 3: Tempo di Scrittura I/O (file_html e scrittura su disco)
         end_time_io_write = time.time()
-        print(f"PROFILING: [Timer 3] Scrittura file HTML completata in {end_time_io_write - start_time_io_write:.4f} secondi.")
+        logger.debug(f"PROFILING: [Timer 3] Scrittura file HTML completata in {end_time_io_write - start_time_io_write:.4f} secondi.")
+        pipeline_trace.record_span('html_write', start_time_io_write, end_time_io_write)
+        prune_plots(plot_save_dir)
 
 
         # ----------------------------------------------------------------------
         # END TIME: Tempo Totale
         end_time_total = time.time()
-        print(f"PROFILING: TEMPO TOTALE per il plotting completato in {end_time_total - start_time_total:.4f} secondi.")
-        print("---------------------------------------")
+        logger.debug(f"PROFILING: TEMPO TOTALE per il plotting completato in {end_time_total - start_time_total:.4f} secondi.")
         
         return plot_static_url
 
     except Exception as e:
-        print(f"ERRORE GRAVE nel plotting per {filename_prefix}: {e}")
-        print("---------------------------------------")
+        logger.error(f"ERRORE GRAVE nel plotting per {filename_prefix}: {e}")
         return None
 
 
+# Opzione del selettore di sessione che segue sempre l'ultima mappa aggiornata
+LATEST_SESSION_OPTION = ("__latest__", "Ultima mappa aggiornata")
+
+
 # IMPORTANTE: La firma deve riflettere le importazioni corrette.
 # Usiamo 'Tuple' da typing e rimuoviamo 'layout' che non esiste pi� come tipo.
 def create_map_layout(doc) -> Tuple[Any, Dict[str, Any]]: 
@@ -293,9 +409,15 @@ def create_map_layout(doc) -> Tuple[Any, Dict[str, Any]]:
     
     # --- 3. Creazione delle Figure (p0 e p1) ---
 
+    # Range espliciti e condivisi tra Pol0 e Pol1: il viewer invia solo il tile della
+    # piramide che corrisponde al viewport, quindi i range non devono adattarsi ai dati (DataRange1d).
+    x_range = Range1d(start=0.0, end=1.0)
+    y_range = Range1d(start=0.0, end=1.0)
+
     # --- Figura Pol0 ---
     p0 = figure(
         title="Polarizzazione 0 (Pol0)",
+        x_range=x_range, y_range=y_range,
         x_axis_label="X (RA/EL)",
         y_axis_label="Y (DEC/AZ)",
         active_scroll="wheel_zoom",
@@ -320,6 +442,7 @@ def create_map_layout(doc) -> Tuple[Any, Dict[str, Any]]:
     # Usiamo lo stesso ColorMapper
     p1 = figure(
         title="Polarizzazione 1 (Pol1)",
+        x_range=x_range, y_range=y_range,
         x_axis_label="X (RA/EL)",
         y_axis_label="Y (DEC/AZ)",
         active_scroll="wheel_zoom",
@@ -343,18 +466,31 @@ def create_map_layout(doc) -> Tuple[Any, Dict[str, Any]]:
     tab0 = Panel(child=p0, title="Pol0")
     tab1 = Panel(child=p1, title="Pol1")
     map_tabs = Tabs(tabs=[tab0, tab1])
+
+    # Selettore della sessione di mappa (scan ID + sistema di coordinate) da visualizzare.
+    # Le opzioni vengono aggiornate da bokeh_server ad ogni nuova grigliatura.
+    session_select = Select(title="Mappa", value=LATEST_SESSION_OPTION[0], options=[LATEST_SESSION_OPTION], width=600)
     
     # Usa 'column' per definire il layout principale che sar� la root del documento
-    final_layout = column(map_tabs)
+    final_layout = column(session_select, map_tabs)
     
     # --- 5. Ritorno dello Stato per l'Aggiornamento ---
     
-    # Questo � il dizionario che verr� salvato in state.BOKEH_DOC_STATE
+    # Questo � il dizionario che verr� registrato in state.BOKEH_SESSIONS
     doc_state = {
         'doc': doc,
         'source_pol0': source_pol0,
         'source_pol1': source_pol1,
-        'color_mapper': color_mapper 
+        'color_mapper': color_mapper,
+        'figure_pol0': p0,
+        'figure_pol1': p1,
+        'x_range': x_range,
+        'y_range': y_range,
+        'session_select': session_select,
+        'session_key': None,  # Sessione visualizzata (None = segue l'ultima mappa aggiornata)
+        'result': None,       # Risultato della grigliatura attualmente mostrato
+        'tiles': {},          # Ultimo tile inviato per polarizzazione (livello e finestra)
+        'map_extent': None,   # Estensione della mappa mostrata dall'ultimo aggiornamento
     }
     
     return final_layout, doc_state
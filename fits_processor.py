@@ -1,7 +1,7 @@
 # fits_processor.py
 
 
-from typing import Dict, List, Tuple, Any
+from typing import Dict, List, Optional, Tuple, Any
 
 from math import pi
 import os
@@ -15,6 +15,12 @@ import nodding_manager # <--- ASSICURATI CHE IL MODULO SIA ACCESSIBILE
 
 import threading
 import map_gridding # Worker B
+import map_checkpoint
+import map_baseline
+import metrics
+import pipeline_trace
+import logging_setup
+from concurrent.futures import ThreadPoolExecutor
 
 
 from astropy.io import fits
@@ -29,13 +35,25 @@ from bokeh.embed import file_html # For saving plot to HTML
 
 from bokeh_visuals import _plot_and_save_skarab_nodding_html, _plot_and_save_html
 
-# Variabile per tenere traccia del thread di grigliatura attivo
-gridding_thread = None
+from gridding_scheduler import GriddingScheduler
+from header_delta import HeaderDeltaEncoder
+
+logger = logging_setup.get_logger(__name__)
 
 
 # Global variable for SocketIO instance
 _socketio_instance = None
 
+# Callback recorder(feeds, scan_id, payload) che conserva gli eventi emessi per il replay (app.py)
+_event_recorder = None
+
+# Stability check of the new files: size unchanged for FILE_STABLE_CHECKS checks, FILE_STABLE_CHECK_INTERVAL_S apart
+FILE_STABLE_CHECK_INTERVAL_S = 0.5
+FILE_STABLE_CHECKS = 3
+
+# Name prefix of the threads that reduce the nodding pairs (shown in the log)
+NODDING_THREAD_PREFIX = 'nodding-'
+
 # Define the directory for saving plots within static
 # Ensure this directory exists relative to app.py
 PLOT_SAVE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'static', 'plots')
@@ -43,7 +61,7 @@ PLOT_SAVE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'static
 # Create the plots directory if it doesn't exist
 if not os.path.exists(PLOT_SAVE_DIR):
     os.makedirs(PLOT_SAVE_DIR)
-    print(f"Created Bokeh plots directory: {PLOT_SAVE_DIR}")
+    logger.info(f"Created Bokeh plots directory: {PLOT_SAVE_DIR}")
 
 def set_socketio_instance_for_processor(sio):
     """
@@ -52,7 +70,15 @@ def set_socketio_instance_for_processor(sio):
     """
     global _socketio_instance
     _socketio_instance = sio
-    print("SocketIO instance passed to fits_processor.py")
+    logger.info("SocketIO instance passed to fits_processor.py")
+
+def set_event_recorder(recorder):
+    """
+    Imposta la funzione che riceve ogni 'fits_header_update' emesso (header completo),
+    usata da app.py per il replay verso i client che si collegano a scansione in corso.
+    """
+    global _event_recorder
+    _event_recorder = recorder
 
 def _wait_for_file_completion(filepath, timeout=300, check_interval=0.5, stable_checks=3):
     """
@@ -73,7 +99,7 @@ def _wait_for_file_completion(filepath, timeout=300, check_interval=0.5, stable_
     Returns:
         bool: True if the file became stable within the timeout, False otherwise.
     """
-    print(f"Waiting for {os.path.basename(filepath)} to be completely written...")
+    logger.debug(f"Waiting for {os.path.basename(filepath)} to be completely written...")
     start_time = time.time()
     last_size = -1 # Initialize with an invalid size to ensure first check updates it
     stable_count = 0 # Counter for consecutive stable size checks
@@ -81,19 +107,19 @@ def _wait_for_file_completion(filepath, timeout=300, check_interval=0.5, stable_
     while True:
         # Check if timeout has been reached
         if time.time() - start_time > timeout:
-            print(f"Timeout waiting for {os.path.basename(filepath)} to complete. Last recorded size: {last_size} bytes.")
+            logger.warning(f"Timeout waiting for {os.path.basename(filepath)} to complete. Last recorded size: {last_size} bytes.")
             return False
 
         # Check if the file still exists (it might be moved or deleted during waiting)
         if not os.path.exists(filepath):
-            print(f"File {os.path.basename(filepath)} disappeared while waiting.")
+            logger.warning(f"File {os.path.basename(filepath)} disappeared while waiting.")
             return False
 
         try:
             current_size = os.path.getsize(filepath)
         except OSError as e:
             # Handle cases where the file might be temporarily locked or inaccessible
-            print(f"Warning: Could not get size of {os.path.basename(filepath)}: {e}. Retrying in {check_interval}s...")
+            logger.warning(f"Could not get size of {os.path.basename(filepath)}: {e}. Retrying in {check_interval}s...")
             time.sleep(check_interval)
             continue # Skip to the next iteration
 
@@ -102,7 +128,7 @@ def _wait_for_file_completion(filepath, timeout=300, check_interval=0.5, stable_
             stable_count += 1
             if stable_count >= stable_checks:
                 # File has been stable for enough checks, consider it complete
-                print(f"File {os.path.basename(filepath)} appears stable at {current_size} bytes.")
+                logger.debug(f"File {os.path.basename(filepath)} appears stable at {current_size} bytes.")
                 return True
         else:
             # File size has changed, reset stable counter and update last size
@@ -112,12 +138,12 @@ def _wait_for_file_completion(filepath, timeout=300, check_interval=0.5, stable_
         time.sleep(check_interval) # Wait before checking again
 
 
-def _extract_data_and_perform_averages(filepath, filename_prefix, filename_extension, feeds, chs, spectrum_type, backend, freq, lo, bw, sub_scan_type):
+def _extract_data_and_perform_averages(filepath, filename_prefix, filename_extension, feeds, chs, spectrum_type, backend, freq, lo, bw, sub_scan_type, scan_id=None, make_plot=True):
 
      # ----------------------------------------------------------------------
     # START TIME: Inizio della funzione
     start_time_total = time.time()
-    print(f"\n--- PROFILING INIZIATO: {filename_prefix} ---")
+    logger.debug(f"--- PROFILING INIZIATO: {filename_prefix} ---")
 
     data = [] 
     averages = []
@@ -173,7 +199,7 @@ def _extract_data_and_perform_averages(filepath, filename_prefix, filename_exten
             
             # Get the hpbw for grid mapping    
             hpbw_arcsec = calculate_hpbw(float(freq), 64, k_factor=1.22)
-            print(f'hpbw in arcsec {hpbw_arcsec}')     
+            logger.debug("hpbw in arcsec %s", hpbw_arcsec)
             
             # -------------------------------------------------------------------
             # ?? AGGIORNAMENTO DELLO STATO GLOBALE HPBW ??
@@ -182,7 +208,22 @@ def _extract_data_and_perform_averages(filepath, filename_prefix, filename_exten
             
             # Check whether FITS file is part of a map or a single spetrum
             is_map = is_map_by_keyword(sub_scan_type)
-            print(f'FITS file relative to a map: {is_map}')
+            logger.info(f'FITS file relative to a map: {is_map}')
+
+            # Mappa multi-feed: offset dei feed (FEED TABLE) e angolo parallattico vanno
+            # letti prima della chiusura del file
+            feed_geometry = None
+            if is_map and state.MULTI_FEED_MAP:
+                feed_geometry = _get_feed_geometry(hdul, sub_scan_type)
+
+            # Coordinate della strisciata (RA-DEC o AZ-EL), anch'esse lette prima della chiusura del file
+            x_data = y_data = None
+            if sub_scan_type in ('RA', 'DEC'):
+                x_data = np.array(hdul["DATA TABLE"].data["raj2000"])
+                y_data = np.array(hdul["DATA TABLE"].data["decj2000"])
+            elif sub_scan_type in ('AZ', 'EL'):
+                x_data = np.array(hdul["DATA TABLE"].data["az"])
+                y_data = np.array(hdul["DATA TABLE"].data["el"])
 
         if data:
             if(type(data[0][0]) == np.ndarray):
@@ -192,23 +233,15 @@ def _extract_data_and_perform_averages(filepath, filename_prefix, filename_exten
                 
                 if not is_map:
 
-                    # ----------------------------------------------------
-                    # ?? QUI INSERIAMO LA LOGICA DI RESET ??
-                    # ----------------------------------------------------
-                    
-                    # Verifichiamo se Pol0 (o qualsiasi altra Pol) contiene dati.
-                    if state.GLOBAL_MAP_CACHE['Pol0']['RA'].size > 0:
-                        print(">>> Rilevato cambio di modalit� a Spettro. Reset CACHE MAPPA.")
-                        # Chiama la funzione di reset dal modulo state.py
-                        state.initialize_map_cache()
-
+                    # N.B.: uno spettro (tracking, calibrazione, ...) NON resetta pi� le mappe:
+                    # le sessioni di mappa sono indicizzate per scansione in state.MAP_SESSIONS.
 
                     # ----------------------------------------------------
                     # CASO 1: SPETTRO QUICK-LOOK (Media Verticale)
                     # La media viene calcolata per ogni canale lungo l'asse 0 (tempo/righe).
                     # Risultato: array 1D (Spettro Medio).
                     # ----------------------------------------------------
-                    print("MODE: SPECTRA (Vertical Averaging)")
+                    logger.debug("MODE: SPECTRA (Vertical Averaging)")
                     for i in range(len(data)):
                         averages.append(np.nanmean(data[i], axis=0)) # <--- MEDIA VERTICALE
                         
@@ -222,59 +255,91 @@ def _extract_data_and_perform_averages(filepath, filename_prefix, filename_exten
                     # La media viene calcolata per ogni riga lungo l'asse 1 (canali).
                     # Risultato: array 1D (Potenza P_i) per ogni riga.
                     # ----------------------------------------------------
-                    print("MODE: MAP (Horizontal Averaging for P_i)")
+                    logger.debug("MODE: MAP (Horizontal Averaging for P_i)")
                     # Nota: Poich� stiamo mappando, di solito si assume la prima polarizzazione/feed
                     # se ci sono dati duplicati, ma qui manteniamo la struttura esistente:
 
                     # Check the type of Map i.e. RA-DEC or AZ-EL
                     # We get the answer from th value of sub_sca_type
 
-                    if(sub_scan_type == 'RA' or sub_scan_type == 'DEC'):
-                        # Get RA and DEC data
-                        x_data = np.array(hdul["DATA TABLE"].data["raj2000"])
-                        y_data = np.array(hdul["DATA TABLE"].data["decj2000"])
+                    map_frame = 'RA_DEC' if sub_scan_type in ('RA', 'DEC') else 'AZ_EL'
+                    # x_data / y_data: coordinate lette nel blocco fits.open
 
-                    if(sub_scan_type == 'AZ' or sub_scan_type == 'EL'):
-                        # Get RA and DEC data
-                        x_data = np.array(hdul["DATA TABLE"].data["az"])
-                        y_data = np.array(hdul["DATA TABLE"].data["el"])
-                      
-                    
-                    all_pi_data = []
-                    for i in range(len(data)):
-                        # Esegui la media orizzontale (lungo i canali)
-                        pi_data = np.nanmean(data[i], axis=1) # <--- MEDIA ORIZZONTALE (Potenza P_i)
+                    # Esegui la media orizzontale (lungo i canali) di tutte le colonne:
+                    # con pi� feed le colonne vengono ridotte in parallelo.
+                    all_pi_data = _horizontal_averages(data) # <--- MEDIA ORIZZONTALE (Potenza P_i)
+                    for pi_data in all_pi_data:
 
-                        print(pi_data)
+                        logger.debug("P_i della strisciata: %s", pi_data)
                         
                         # In modalit� MAPPA, 'averages' conterr� le P_i di tutte le polarizzazioni/feeds
-                        # di quel file, ma tipicamente per la mappa userai SOLO il primo set.
+                        # di quel file; per la mappa si usa il primo feed, oppure tutti in modalit� multi-feed.
                         averages.append(pi_data) 
-                        all_pi_data.append(pi_data) # Raccogli tutti i P_i per i metadata
                         
                     # L'asse X in questo caso non � il canale, ma il Punto Campione (la riga)
                     # Questi P_i verranno poi accoppiati con RA/DEC.
                     x = np.linspace(0, len(averages[0]), len(averages[0]))
                     x_axis_label_val = 'Sampling Point'
 
+                    # --- RIMOZIONE DELLA BASELINE DELLA STRISCIATA (tutte le colonne in un'unica soluzione) ---
+                    # I valori grezzi restano nella nuvola di punti accanto a quelli corretti.
+                    all_pi_raw = all_pi_data
+                    all_pi_data = map_baseline.remove_subscan_baseline(all_pi_raw)
+
+                    # Feed della mappa: ogni feed ha la propria sessione (file .fitsN e FEED_N di SKARAB),
+                    # mentre la mappa multi-feed accumula tutti i feed nella stessa sessione (feed None)
+                    if filename_extension != '.fits':
+                        map_feed = int(feed_number)
+                    elif backend == 'SKARAB':
+                        map_feed = _get_skarab_feed_id_from_path(filepath)
+                    else:
+                        map_feed = int(feeds[0]) if len(feeds) else 0
+
+                    # --- MODALIT� MULTI-FEED: tutti i feed nella stessa nuvola, con il proprio offset ---
+                    if feed_geometry is not None:
+                        # Stesso ordine delle colonne estratte sopra (2 colonne per feed in doppia polarizzazione)
+                        if filename_extension != '.fits':
+                            map_feeds = [int(feed_number)]
+                            pols_per_feed = 2 if spectrum_type == 'spectra' else 1
+                        else:
+                            map_feeds = [_get_skarab_feed_id_from_path(filepath)] if backend == 'SKARAB' else [int(f) for f in feeds]
+                            pols_per_feed = 2 if spectrum_type in ('spectra', 'simple') else 1
+                        if len(all_pi_data) == len(map_feeds) * pols_per_feed:
+                            x_map, y_map, all_pi_data = _combine_feeds_for_map(
+                                x_data, y_data, all_pi_data, map_feeds, pols_per_feed, feed_geometry, map_frame)
+                            _, _, all_pi_raw = _combine_feeds_for_map(
+                                x_data, y_data, all_pi_raw, map_feeds, pols_per_feed, feed_geometry, map_frame)
+                            x_data, y_data = x_map, y_map
+                            map_feed = None
+                            logger.info(f"Mappa multi-feed: {len(map_feeds)} feed aggiunti alla nuvola ({len(x_data)} punti).")
+                        else:
+                            logger.warning(f"Mappa multi-feed: colonne ({len(all_pi_data)}) non coerenti con i feed {map_feeds}. Uso il primo feed.")
+
                     # --- AGGIORNAMENTO DELLE DUE NUVOLA DI PUNTI ---
 
                     if len(all_pi_data) >= 2:
-                        print("Rilevati dati per due polarizzazioni. Inizio aggiornamento Dual-Pol.")
+                        logger.debug("Rilevati dati per due polarizzazioni. Inizio aggiornamento Dual-Pol.")
+
+                        # Sessione di mappa della scansione (creata alla prima strisciata)
+                        session_key = (scan_id or filename_prefix, map_frame, map_feed)
+                        map_cache = state.get_map_session(session_key)
+                        map_cache['HPBW_ARCSEC'] = hpbw_arcsec
                         
                         # CHIAMATA ESECUTIVA
                         update_global_point_cloud_dual_pol(
                             x_data_new=x_data, 
                             y_data_new=y_data, 
-                            all_pi_data_new=all_pi_data # Passa [P_i_Pol0, P_i_Pol1]
+                            all_pi_data_new=all_pi_data, # Passa [P_i_Pol0, P_i_Pol1]
+                            all_pi_raw_new=all_pi_raw, # Valori prima della rimozione della baseline
+                            map_cache=map_cache
                         )
 
                         # Trigger Asincrono
-                        trigger_gridding_process() # <--- LA CHIAMATA � QUI
+                        trigger_gridding_process(session_key) # <--- LA CHIAMATA � QUI
 
                         
                     elif len(all_pi_data) == 1:
-                        print("Rilevati dati per singola polarizzazione/feed. Nessuna azione di aggiornamento dual-pol.")
+                        logger.debug("Rilevati dati per singola polarizzazione/feed. Nessuna azione di aggiornamento dual-pol.")
                         # Potresti aggiungere qui una logica per gestire il singolo feed se necessario
                         
                     # --- SUCCESSIVAMENTE: ATTIVAZIONE GRIGLIATORE ASINCRONO (Worker B) ---
@@ -308,14 +373,18 @@ def _extract_data_and_perform_averages(filepath, filename_prefix, filename_exten
         # ----------------------------------------------------------------------
         # TIMER 1: Tempo di I/O Disco (fits.open/hdul.data) e Calcolo Media (np.mean)
         end_time_io_calc = time.time()
-        print(f"PROFILING: [Timer 1] I/O Disco + Calcolo Media completato in {end_time_io_calc - start_time_io_calc:.4f} secondi.")
+        logger.debug(f"PROFILING: [Timer 1] I/O Disco + Calcolo Media completato in {end_time_io_calc - start_time_io_calc:.4f} secondi.")
+        pipeline_trace.record_span('reduction', start_time_io_calc, end_time_io_calc)
+
+        if not make_plot:
+            # File usato solo per la mappa (feed non selezionato in modalit� multi-feed)
+            return None
 
         return _plot_and_save_html(PLOT_SAVE_DIR, filepath, filename_prefix, filename_extension, feeds, chs, spectrum_type, 
             backend, x_axis_label_val, x, averages, feed_number, start_time_total, freq, lo, bw)
     
     except Exception as e:
-        print(f"ERRORE GRAVE nel calcolo delle medie per {filename_prefix}: {e}")
-        print("---------------------------------------")
+        logger.error(f"ERRORE GRAVE nel calcolo delle medie per {filename_prefix}: {e}")
         return None
 
 
@@ -344,7 +413,7 @@ def _extract_skarab_nodding_data(filepath, spectrum_type, start_time_total):
                     data.append(np.array(hdul["DATA TABLE"].data["Ch0"]))
                     data.append(np.array(hdul["DATA TABLE"].data["Ch1"]))
                 else:
-                    print(f"SKARAB NODDING EXTRACT: Canali Ch0/Ch1 non trovati per tipo '{spectrum_type}'.")
+                    logger.warning(f"SKARAB NODDING EXTRACT: Canali Ch0/Ch1 non trovati per tipo '{spectrum_type}'.")
                     return None
             
             elif spectrum_type == 'stokes':
@@ -352,11 +421,11 @@ def _extract_skarab_nodding_data(filepath, spectrum_type, start_time_total):
                 if 'Ch0' in data_table_columns:
                     data.append(np.array(hdul["DATA TABLE"].data["Ch0"]))
                 else:
-                    print(f"SKARAB NODDING EXTRACT: Canale Ch0 non trovato per tipo '{spectrum_type}'.")
+                    logger.warning(f"SKARAB NODDING EXTRACT: Canale Ch0 non trovato per tipo '{spectrum_type}'.")
                     return None
             
             else:
-                 print(f"SKARAB NODDING EXTRACT: Tipo di spettro '{spectrum_type}' non gestito.")
+                 logger.warning(f"SKARAB NODDING EXTRACT: Tipo di spettro '{spectrum_type}' non gestito.")
                  return None
 
         if data and data[0].ndim == 2:
@@ -378,15 +447,74 @@ def _extract_skarab_nodding_data(filepath, spectrum_type, start_time_total):
             }
             
         else:
-            print(f"SKARAB NODDING EXTRACT: Dati non validi o non 2D in {os.path.basename(filepath)}")
+            logger.warning(f"SKARAB NODDING EXTRACT: Dati non validi o non 2D in {os.path.basename(filepath)}")
             return None
             
     except Exception as e:
-        print(f"SKARAB NODDING EXTRACT: Errore durante l'estrazione dati da {os.path.basename(filepath)}: {e}")
+        logger.error(f"SKARAB NODDING EXTRACT: Errore durante l'estrazione dati da {os.path.basename(filepath)}: {e}")
         return None
 
 
 
+# Header delta-encoded per flusso (room del feed, oppure BROADCAST_STREAM senza sottoscrizioni)
+_header_encoder = HeaderDeltaEncoder()
+BROADCAST_STREAM = '*'
+HEADER_DELTA_ENABLED = True
+
+
+def set_header_delta(enabled: bool):
+    """
+    Abilita/disabilita la codifica delta degli header. Disabilitata nei worker di
+    processing_worker.py: lo stato dei flussi sarebbe diviso tra processi diversi.
+    """
+    global HEADER_DELTA_ENABLED
+    HEADER_DELTA_ENABLED = bool(enabled)
+
+
+def _emit_header_update(payload, feeds, scan_id):
+    """
+    Emette 'fits_header_update' solo nelle room Socket.IO dei feed sottoscritti contenuti in feeds:
+    il prodotto � calcolato una volta e ricevuto da tutti i client di quei feed.
+    Senza client sottoscritti l'evento viene inviato a tutti.
+    L'header viene inviato completo alla prima subscan della scansione, poi solo le keyword cambiate.
+    """
+    if _event_recorder is not None:
+        _event_recorder(feeds, scan_id, payload)
+
+    if not _socketio_instance:
+        logger.warning("SocketIO instance not set in fits_processor.py, cannot emit header data.")
+        return
+
+    rooms = state.rooms_for_feeds(feeds)
+    if rooms is not None and not rooms:
+        logger.debug(f"No client subscribed to feeds {list(feeds)}: nothing to emit.")
+        return
+
+    # Ogni room ha la propria sequenza di versioni (i client di feed diversi ricevono eventi diversi)
+    with pipeline_trace.span('emit', rooms=len(rooms) if rooms is not None else 'all'):
+        for room in (rooms if rooms is not None else [None]):
+            encoded = _header_encoder.encode(room or BROADCAST_STREAM, scan_id, payload) if HEADER_DELTA_ENABLED else payload
+            kwargs = {} if room is None else {'to': room}
+            _socketio_instance.start_background_task(_socketio_instance.emit, 'fits_header_update', encoded, **kwargs)
+
+
+def get_header_resync(sid):
+    """
+    Header completo corrente per il flusso del client (richiesta 'header_resync' da script.js),
+    o None se non ne sono ancora stati inviati.
+    """
+    return get_feed_header(state.FEED_SUBSCRIPTIONS.get(sid))
+
+
+def get_feed_header(feed=None):
+    """
+    Header completo e versione correnti del flusso di un feed (del flusso broadcast se feed è None
+    o se al feed non è ancora stato inviato niente), o None. Usato anche per il replay (app.py).
+    """
+    full = _header_encoder.full_header(state.feed_room(feed)) if feed is not None else None
+    return full or _header_encoder.full_header(BROADCAST_STREAM)
+
+
 def process_fits_file(filepath):
     """
     Manages the processing of a detected .fits file.
@@ -396,19 +524,28 @@ def process_fits_file(filepath):
     """
     # Wait for the file to become stable (fully written)
     # from "load_subscans" first index is the item number in the list, second index the value [0]=file name, [1] signal flag, [2]=time
-    if not _wait_for_file_completion(filepath):
-        print(f"Skipping processing of {os.path.basename(filepath)}: File did not stabilize or disappeared.")
+    with pipeline_trace.span('stabilization_wait'):
+        is_stable = _wait_for_file_completion(filepath, check_interval=FILE_STABLE_CHECK_INTERVAL_S,
+                                              stable_checks=FILE_STABLE_CHECKS)
+    if not is_stable:
+        logger.warning(f"Skipping processing of {os.path.basename(filepath)}: File did not stabilize or disappeared.")
+        metrics.file_dropped('not_stable')
         return
 
     try:
+        file_size = os.path.getsize(filepath)
+        metrics.bytes_read(file_size)
+        read_start = time.time()
         with fits.open(filepath) as hdul:
 
-            print(f"\n--- Primary Header Keywords and Values for {os.path.basename(filepath)} ---")
+            logger.debug(f"--- Primary Header Keywords and Values for {os.path.basename(filepath)} ---")
 
             # ?? NUOVA LOGICA: ESTRAZIONE E FILTRO ??
             header_data, acq_feeds_unique_values, should_process = extract_metadata_and_filter(filepath, hdul)
+            pipeline_trace.record_span('fits_read', read_start, time.time(), n_bytes=file_size)
 
             if not should_process:
+                metrics.file_dropped('feed_filter')
                 return # File scartato dal filtro feed
 
                       
@@ -445,19 +582,23 @@ def process_fits_file(filepath):
                             spectrum_type_pair = hdul_A["SECTION TABLE"].data["type"][0]
                 
                     except Exception as e:
-                        print(f"SKARAB NODDING: Impossibile estrarre metadati per la coppia. Errore: {e}")
+                        logger.error(f"SKARAB NODDING: Impossibile estrarre metadati per la coppia. Errore: {e}")
+                        metrics.file_dropped('nodding_metadata')
                         return # Interrompiamo il processo se i metadati non sono validi
                     
                     # Avviamo il processo Nodding nel thread
                     threading.Thread(
                         target=process_skarab_nodding_pair, 
-                        args=(coupled_files, common_prefix, feed_A_id, feed_B_id, spectrum_type_pair, header_data)
+                        args=(coupled_files, common_prefix, feed_A_id, feed_B_id, spectrum_type_pair, header_data),
+                        name=f"{NODDING_THREAD_PREFIX}{common_prefix}"
                     ).start()
+                    metrics.file_processed('nodding_pair')
                     
                     return # <--- INTERRUZIONE: L'elaborazione Nodding � gestita.
                 
                 else:
                     # File registrato, ma non � ancora pronto per l'accoppiamento.
+                    metrics.file_processed('nodding_waiting')
                     return # <--- INTERRUZIONE: In attesa del partner.
 
             # ----------------------------------------------------------------------
@@ -477,27 +618,31 @@ def process_fits_file(filepath):
         # --- Get data and generate the Bokeh plot ---
         # plot_url = create_and_save_bokeh_plot___(filepath)
         plot_url = _extract_data_and_perform_averages(filepath, filename_base, filename_extension, 
-            acq_feeds_unique_values, int(header_data.get("bins")), header_data.get("spectrum"), backend, freq, lo, bw, header_data.get("sub_scan_type"))
+            acq_feeds_unique_values, int(header_data.get("bins")), header_data.get("spectrum"), backend, freq, lo, bw, header_data.get("sub_scan_type"),
+            _get_scan_id(filepath, header_data), make_plot=not header_data.get("map_only", False))
+
+        if header_data.get("map_only"):
+            # Feed non selezionato: il file contribuisce solo alla mappa multi-feed, nessun emit
+            logger.info(f"Multi-feed map: {os.path.basename(filepath)} added to the map only (feed not selected).")
+            metrics.file_processed('map_only')
+            return
 
             
         if plot_url:
             header_data["plot_url"] = plot_url
-            print(f"Plot URL added to data: {plot_url}")
+            logger.debug(f"Plot URL added to data: {plot_url}")
         else:
-            print("No plot URL generated for this FITS file.")
+            logger.info("No plot URL generated for this FITS file.")
 
 
-        if _socketio_instance:
-            print(f"Emitting FITS header and plot URL for {os.path.basename(filepath)} to frontend.")
-            _socketio_instance.start_background_task(
-                _socketio_instance.emit, 'fits_header_update', header_data
-            )
-        else:
-            print("Warning: SocketIO instance not set in fits_processor.py, cannot emit header data.")
+        logger.info(f"Emitting FITS header and plot URL for {os.path.basename(filepath)} to frontend.")
+        _emit_header_update(header_data, header_data.get("target_feeds", []), _get_scan_id(filepath, header_data))
+        metrics.file_processed('emitted')
 
     except Exception as e:
 
-        print(f"Error processing FITS file {os.path.basename(filepath)}: {e}")
+        logger.error(f"Error processing FITS file {os.path.basename(filepath)}: {e}")
+        metrics.file_dropped('error')
 
 
 
@@ -515,9 +660,11 @@ def process_skarab_nodding_pair(filepaths_tuple, common_prefix, feed_A_id, feed_
     """
     file_A_path, file_B_path = filepaths_tuple
     start_time_total = time.time() 
+    # Thread dedicato alla coppia: gli span della traccia vengono attribuiti alla coppia
+    pipeline_trace.set_current_file(f"{common_prefix}_nodding_pair")
     BACKEND = 'SKARAB'
     
-    print(f"\n--- PROFILING INIZIATO: Nodding Pair {common_prefix} ---")
+    logger.debug(f"--- PROFILING INIZIATO: Nodding Pair {common_prefix} ---")
 
     # ----------------------------------------------------------------------
     # TIMER 1: I/O Disco e Calcolo Media per entrambi i file A e B
@@ -527,17 +674,18 @@ def process_skarab_nodding_pair(filepaths_tuple, common_prefix, feed_A_id, feed_
     # _extract_skarab_nodding_data esegue I/O e calcola np.nanmean
     result_A = _extract_skarab_nodding_data(file_A_path, spectrum_type, start_time_total)
     if result_A is None: 
-        print(f"Errore estrazione dati A per {common_prefix}")
+        logger.error(f"Errore estrazione dati A per {common_prefix}")
         return
 
     # 2. ESTRAZIONE DATI FILE B
     result_B = _extract_skarab_nodding_data(file_B_path, spectrum_type, start_time_total)
     if result_B is None: 
-        print(f"Errore estrazione dati B per {common_prefix}")
+        logger.error(f"Errore estrazione dati B per {common_prefix}")
         return
     
     end_time_io_calc = time.time()
-    print(f"PROFILING: [Timer 1 NODDING] I/O Disco + Calcolo Media completato in {end_time_io_calc - start_time_io_calc:.4f} secondi.")
+    logger.debug(f"PROFILING: [Timer 1 NODDING] I/O Disco + Calcolo Media completato in {end_time_io_calc - start_time_io_calc:.4f} secondi.")
+    pipeline_trace.record_span('reduction', start_time_io_calc, end_time_io_calc)
     # ----------------------------------------------------------------------
     
 
@@ -555,11 +703,11 @@ def process_skarab_nodding_pair(filepaths_tuple, common_prefix, feed_A_id, feed_
         feeds_for_legend = [feed_A_id, feed_B_id]
         expected_lines = 2
     else:
-        print(f"Tipo di spettro non riconosciuto per Nodding: {spectrum_type}")
+        logger.warning(f"Tipo di spettro non riconosciuto per Nodding: {spectrum_type}")
         return
 
     if len(final_averages) != expected_lines:
-         print(f"Errore di unificazione Nodding: attese {expected_lines} linee, trovate {len(final_averages)}.")
+         logger.error(f"Errore di unificazione Nodding: attese {expected_lines} linee, trovate {len(final_averages)}.")
          return
          
     # 5. GENERAZIONE PLOT (Contiene i Timer 2 e 3)
@@ -597,11 +745,9 @@ def process_skarab_nodding_pair(filepaths_tuple, common_prefix, feed_A_id, feed_
             final_data_to_emit['header']['COMMENT'] = "Dati Nodding Pair (Unificazione Feeds A+B)"
          
          
-         _socketio_instance.start_background_task(
-             _socketio_instance.emit, 'fits_header_update', final_data_to_emit
-         )
+         _emit_header_update(final_data_to_emit, [feed_A_id, feed_B_id], _get_scan_id(filepaths_tuple[0], primary_header_data))
          
-         print(f"NODDING: Emesso header e plot URL per la coppia {common_prefix}.")
+         logger.info(f"NODDING: Emesso header e plot URL per la coppia {common_prefix}.")
     
     
     """
@@ -639,6 +785,111 @@ def _get_skarab_feed_id_from_path(filepath):
 
 
 
+# Pool per le riduzioni orizzontali (P_i) delle colonne di pi� feed: np.nanmean rilascia il GIL
+_reduction_pool = ThreadPoolExecutor(max_workers=min(8, os.cpu_count() or 1), thread_name_prefix='MapReduction')
+
+
+def _horizontal_averages(data):
+    """Media orizzontale (lungo i canali) di ciascuna colonna; in parallelo se ci sono pi� di 2 colonne."""
+    if len(data) <= 2:
+        return [np.nanmean(item, axis=1) for item in data]
+    return list(_reduction_pool.map(lambda item: np.nanmean(item, axis=1), data))
+
+
+def _unit_to_deg(unit, default):
+    """Fattore di conversione in gradi per l'unit� di una colonna FITS (TUNIT)."""
+    unit = (unit or default).strip().lower()
+    if unit.startswith('deg'):
+        return 1.0
+    if unit.startswith('arcsec'):
+        return 1.0 / 3600.0
+    if unit.startswith('arcmin'):
+        return 1.0 / 60.0
+    return 180.0 / pi # radianti
+
+
+def _get_feed_geometry(hdul, sub_scan_type):
+    """
+    Legge gli offset dei feed dalla FEED TABLE (DISCOS: radianti, nel sistema orizzontale)
+    e, per le mappe RA/DEC, l'angolo parallattico dalla DATA TABLE.
+
+    Returns:
+        dict: {'offsets': {feed: (dx_deg, dy_deg)}, 'coord_to_deg': float, 'par_angle_rad': ndarray o None}
+              oppure None se la FEED TABLE non � disponibile.
+    """
+    try:
+        feed_table = hdul["FEED TABLE"]
+        columns = feed_table.columns
+        offset_to_deg = _unit_to_deg(columns['xOffset'].unit, default='rad')
+        offsets = {
+            int(row['id']): (float(row['xOffset']) * offset_to_deg, float(row['yOffset']) * offset_to_deg)
+            for row in feed_table.data
+        }
+
+        # Feed effettivamente acquisiti (RF INPUTS): gli altri vengono ignorati
+        acquired_feeds = {int(f) for f in hdul["RF INPUTS"].data["feed"]}
+        offsets = {feed: offset for feed, offset in offsets.items() if feed in acquired_feeds}
+
+        data_table = hdul["DATA TABLE"]
+        coord_column = 'raj2000' if sub_scan_type in ('RA', 'DEC') else 'az'
+        # Le coordinate della mappa sono trattate in gradi da map_gridding (unit� assente = gradi)
+        coord_to_deg = _unit_to_deg(data_table.columns[coord_column].unit, default='deg')
+
+        par_angle_rad = None
+        if sub_scan_type in ('RA', 'DEC') and 'par_angle' in data_table.columns.names:
+            par_to_deg = _unit_to_deg(data_table.columns['par_angle'].unit, default='rad')
+            par_angle_rad = np.deg2rad(np.array(data_table.data['par_angle'], dtype=np.float64) * par_to_deg)
+
+        return {'offsets': offsets, 'coord_to_deg': coord_to_deg, 'par_angle_rad': par_angle_rad}
+
+    except Exception as e:
+        logger.warning(f"Mappa multi-feed: impossibile leggere gli offset dei feed ({e}). Uso solo il primo feed.")
+        return None
+
+
+def _combine_feeds_for_map(x_data, y_data, all_pi_data, map_feeds, pols_per_feed, feed_geometry, map_frame):
+    """
+    Applica a ciascun feed il proprio offset e concatena tutti i feed in un'unica strisciata
+    (x, y, [P_Pol0, P_Pol1]) da aggiungere alla nuvola di punti condivisa.
+
+    Gli offset DISCOS sono nel sistema orizzontale: per le mappe RA/DEC vengono ruotati
+    dell'angolo parallattico (se presente nella DATA TABLE), poi divisi per cos(latitudine).
+    """
+    coord_to_deg = feed_geometry['coord_to_deg']
+    par_angle = feed_geometry['par_angle_rad']
+    cos_lat = np.cos(np.deg2rad(np.asarray(y_data, dtype=np.float64) * coord_to_deg))
+    cos_lat = np.where(np.abs(cos_lat) < 1e-6, 1e-6, cos_lat)
+
+    xs, ys, p0s, p1s = [], [], [], []
+    for k, feed in enumerate(map_feeds):
+        dx, dy = feed_geometry['offsets'].get(feed, (0.0, 0.0))
+        if map_frame == 'RA_DEC' and par_angle is not None:
+            d_lon = dx * np.cos(par_angle) - dy * np.sin(par_angle)
+            d_lat = dx * np.sin(par_angle) + dy * np.cos(par_angle)
+        else:
+            d_lon, d_lat = dx, dy
+
+        xs.append(x_data + (d_lon / cos_lat) / coord_to_deg)
+        ys.append(y_data + d_lat / coord_to_deg)
+        p0 = all_pi_data[k * pols_per_feed]
+        p0s.append(p0)
+        p1s.append(all_pi_data[k * pols_per_feed + 1] if pols_per_feed == 2 else np.full_like(p0, np.nan))
+
+    return np.concatenate(xs), np.concatenate(ys), [np.concatenate(p0s), np.concatenate(p1s)]
+
+
+def _get_scan_id(filepath, header_data):
+    """
+    Identificativo della scansione usato come chiave delle sessioni di mappa:
+    cartella della scansione + SCANID dell'header primario.
+    Es: 20250212-185345-KBAND-3C84AZ/1
+    """
+    scan_dir = os.path.basename(os.path.dirname(filepath))
+    scan_number = header_data.get("header", {}).get("SCANID", "?")
+    return f"{scan_dir}/{scan_number}"
+
+
+
 def calculate_hpbw(frequency_mhz, antenna_diameter_m, k_factor=1.22):
     # Costanti
     c = 3.0e8  # Velocit� della luce in m/s
@@ -669,7 +920,7 @@ def is_map_by_keyword(raw_keyword_value: str) -> bool:
     # 1. Pulizia e normalizzazione del valore della keyword
     cleaned_value = raw_keyword_value.strip()
 
-    print(f"SubScanType: {cleaned_value}")
+    logger.debug("SubScanType: %s", cleaned_value)
     
     # 2. Regola di Decisione
     # Se la keyword pulita corrisponde a uno degli assi di scansione, � una Mappa.
@@ -684,7 +935,9 @@ def is_map_by_keyword(raw_keyword_value: str) -> bool:
 def update_global_point_cloud_dual_pol(
     x_data_new: np.ndarray, 
     y_data_new: np.ndarray, 
-    all_pi_data_new: List[np.ndarray]
+    all_pi_data_new: List[np.ndarray],
+    map_cache: Dict[str, Any] = None,
+    all_pi_raw_new: Optional[List[np.ndarray]] = None
 ) -> None:
     """
     Aggiorna due Nuvole di Punti (Pol0 e Pol1) all'interno dello stato globale (state.py) 
@@ -696,102 +949,160 @@ def update_global_point_cloud_dual_pol(
     - ra_data_new: Array NumPy delle coordinate RA della nuova strisciata (in gradi).
     - dec_data_new: Array NumPy delle coordinate DEC della nuova strisciata (in gradi).
     - all_pi_data_new: Lista NumPy 1D di Potenze P_i (index 0 = Pol0, index 1 = Pol1).
+    - map_cache: Sessione di mappa da aggiornare (default: la sessione attiva, state.GLOBAL_MAP_CACHE).
+    - all_pi_raw_new: P_i prima della rimozione della baseline (colonne P_raw_*), opzionale.
     """
     
     # Chiavi di polarizzazione e limite massimo di polarizzazioni da gestire
     polarization_keys = ['Pol0', 'Pol1'] 
     num_pols = min(len(all_pi_data_new), 2)
-    
-    # 1. Calcola i limiti RA/DEC della nuova strisciata (sono uguali per entrambe le pol.)
-    x_min_new = x_data_new.min()
-    x_max_new = x_data_new.max()
-    y_min_new = y_data_new.min()
-    y_max_new = y_data_new.max()
 
-    # 2. Cicla sulle polarizzazioni disponibili e aggiorna la cache
+    # La nuvola di punti � un buffer structure-of-arrays condiviso dalle polarizzazioni:
+    # RA/DEC vengono scritti una sola volta e i limiti globali sono aggiornati dal buffer.
+    if map_cache is None:
+        map_cache = state.GLOBAL_MAP_CACHE
+    points = map_cache['POINTS']
+    new_columns = {'RA': x_data_new, 'DEC': y_data_new}
+
+    # 1. Cicla sulle polarizzazioni disponibili e prepara le colonne P
     for i in range(num_pols):
         pol_key = polarization_keys[i]
         pi_data_current = all_pi_data_new[i]
         
-        # Accede direttamente allo stato globale importato
-        cache = state.GLOBAL_MAP_CACHE[pol_key] 
-        
         # CONTROLLO DI CONSISTENZA:
         if len(x_data_new) != len(pi_data_current):
-            print(f"ERRORE: Dati RA/DEC ({len(x_data_new)}) e P_i ({len(pi_data_current)}) per {pol_key} non corrispondono. Skippo.")
+            logger.error(f"ERRORE: Dati RA/DEC ({len(x_data_new)}) e P_i ({len(pi_data_current)}) per {pol_key} non corrispondono. Skippo.")
             continue
-            
-        # APPEND DATA
-        cache['RA'] = np.concatenate([cache['RA'], x_data_new])
-        cache['DEC'] = np.concatenate([cache['DEC'], x_data_new])
-        cache['P'] = np.concatenate([cache['P'], pi_data_current])
-        
-        # UPDATE GLOBAL LIMITS
-        cache['RA_min'] = min(cache['RA_min'], x_min_new)
-        cache['RA_max'] = max(cache['RA_max'], x_max_new)
-        cache['DEC_min'] = min(cache['DEC_min'], y_min_new)
-        cache['DEC_max'] = max(cache['DEC_max'], y_max_new)
-        
-        print(f"? Aggiornata Nuvola {pol_key}. Totale Punti: {len(cache['RA'])}")
 
+        new_columns[f'P_{pol_key}'] = pi_data_current
+        if all_pi_raw_new is not None:
+            new_columns[f'P_raw_{pol_key}'] = all_pi_raw_new[i]
+
+    # 2. APPEND DATA (le polarizzazioni mancanti vengono riempite con NaN e ignorate in grigliatura)
+    total_points = points.append(**new_columns)
+
+    logger.info(f"? Aggiornata Nuvola {', '.join(polarization_keys[:num_pols])}. Totale Punti: {total_points}")
+
+
+
+# Sessioni di mappa con nuove strisciate da grigliare (accorpate dallo scheduler)
+_dirty_map_sessions = set()
+_dirty_map_sessions_lock = threading.Lock()
+
+# Sessioni grigliate con punti non ancora salvati su disco (usate solo dal thread della grigliatura)
+_unsaved_map_sessions = set()
 
 
 def run_gridding_task():
     """
     Wrapper che esegue il compito di grigliatura (Worker B) e gestisce l'output.
-    Viene eseguito nel thread separato avviato da trigger_gridding_process().
+    Viene eseguito nel thread dello scheduler avviato da trigger_gridding_process().
+    Griglia tutte le sessioni di mappa che hanno ricevuto nuove strisciate.
     """
-    try:
-        print("Worker B: Grigliatura in corso...")
-        
-        # Chiama la funzione principale del Worker B, che legge lo stato globale
-        # e restituisce le mappe grigliate (es. {'Pol0': mappa_2D, 'Pol1': mappa_2D})
-        result_maps = map_gridding.perform_gridding()
-        
-        if result_maps:
-            print(f"Worker B: GRIGLIATURA COMPLETATA. Mappe pronte per la visualizzazione.")
+    with _dirty_map_sessions_lock:
+        session_keys = list(_dirty_map_sessions)
+        _dirty_map_sessions.clear()
+
+    for session_key in session_keys:
+        try:
+            map_cache = state.MAP_SESSIONS.get(session_key)
+            if map_cache is None:
+                logger.warning(f"Worker B: Sessione {session_key} non pi� presente (eliminata dal budget di memoria). Skippo.")
+                continue
+
+            logger.info(f"Worker B: Grigliatura in corso per la sessione {session_key}...")
             
-            # CHIAMATA AL WORKER C (Bokeh Server)
-            # Invia le mappe grigliate al server Bokeh per l'aggiornamento dinamico del browser
-            update_bokeh_plot(result_maps)
+            # Chiama la funzione principale del Worker B, che legge la sessione di mappa
+            # e restituisce le mappe grigliate (es. {'Z_Pol0': mappa_2D, 'Z_Pol1': mappa_2D, ...})
+            with pipeline_trace.span('gridding', session=str(session_key)):
+                result_maps = map_gridding.perform_gridding(map_cache)
             
-    except Exception as e:
-        print(f"Worker B: ERRORE grave durante il grigliamento: {e}")
+            if result_maps:
+                logger.info(f"Worker B: GRIGLIATURA COMPLETATA. Mappe pronte per la visualizzazione.")
+                map_cache['LATEST_RESULT'] = result_maps
+                
+                # CHIAMATA AL WORKER C (Bokeh Server)
+                # Invia le mappe grigliate al server Bokeh per l'aggiornamento dinamico del browser
+                update_bokeh_plot(result_maps)
+
+            # Checkpoint periodico su disco (nuvola di punti e griglie), se abilitato. Le sessioni
+            # non salvate per il limite di frequenza vengono salvate quando la grigliatura resta inattiva.
+            if map_checkpoint.CHECKPOINT_DIR and not map_checkpoint.checkpoint_session(map_cache):
+                _unsaved_map_sessions.add(session_key)
+            else:
+                _unsaved_map_sessions.discard(session_key)
+                
+        except Exception as e:
+            logger.error(f"Worker B: ERRORE grave durante il grigliamento della sessione {session_key}: {e}")
+
+    # Il risultato (piramide) fa parte della memoria delle sessioni
+    state.enforce_map_memory_budget()
+
+
+
+def flush_map_checkpoints():
+    """
+    Checkpoint forzato delle sessioni grigliate ma non ancora salvate (ultime strisciate di una mappa).
+    Eseguito dallo scheduler della grigliatura dopo map_checkpoint.IDLE_FLUSH_S secondi di inattività.
+    """
+    while _unsaved_map_sessions:
+        session_key = _unsaved_map_sessions.pop()
+        map_cache = state.MAP_SESSIONS.get(session_key)
+        if map_cache is not None:
+            map_checkpoint.checkpoint_session(map_cache, force=True)
+
 
+def stop_gridding(timeout=None):
+    """Ferma lo scheduler della grigliatura dopo l'ultimo passaggio pendente. Chiamata da app.py alla chiusura."""
+    _gridding_scheduler.stop(timeout)
 
 
+# Scheduler della grigliatura: accorpa le richieste in arrivo durante una grigliatura
+# ed esegue sempre un passaggio finale dopo l'ultima richiesta. Dopo un periodo di inattività
+# salva le sessioni che il limite di frequenza dei checkpoint ha lasciato indietro.
+_gridding_scheduler = GriddingScheduler(run_gridding_task, min_interval_s=1.0, name='Worker B',
+                                        idle_task=flush_map_checkpoints, idle_after_s=map_checkpoint.IDLE_FLUSH_S)
 
 
-def trigger_gridding_process():
+def pending_gridding_sessions() -> int:
+    """Sessioni di mappa in attesa di grigliatura (profondità della coda per metrics.py)."""
+    with _dirty_map_sessions_lock:
+        return len(_dirty_map_sessions)
+
+
+def set_min_gridding_interval(seconds: float):
     """
-    Avvia il grigliamento in un thread separato se non c'� gi� un processo attivo.
+    Sets the minimum interval (in seconds) between two gridding runs. Called by app.py.
     """
-    global gridding_thread
-    
-    # Controlla se il thread precedente � terminato o non � mai partito
-    if gridding_thread is None or not gridding_thread.is_alive():
-        
-        print(">>> Worker A: ATTIVAZIONE ASINCRONA DEL GRIGLIATORE...")
-        
-        # Crea e avvia il nuovo thread
-        gridding_thread = threading.Thread(target=run_gridding_task)
-        gridding_thread.start()
-    else:
-        # Se il grigliatore � ancora occupato a elaborare la strisciata precedente,
-        # la richiesta viene ignorata (o potresti implementare una coda).
-        print(">>> Worker A: Grigliatore gi� attivo. Richiesta di grigliatura ignorata.")
+    _gridding_scheduler.min_interval_s = max(0.0, float(seconds))
+    logger.info(f"Minimum gridding interval set to {_gridding_scheduler.min_interval_s:.2f} s.")
 
 
+def trigger_gridding_process(session_key=None):
+    """
+    Marca la sessione di mappa come da ri-grigliare (default: la sessione attiva).
+    Le richieste vengono accorpate dallo scheduler: se il grigliatore � occupato,
+    la richiesta verr� servita dal passaggio successivo.
+    """
+    if session_key is None:
+        session_key = state.GLOBAL_MAP_CACHE.get('KEY')
+    with _dirty_map_sessions_lock:
+        _dirty_map_sessions.add(session_key)
+    logger.info(f">>> Worker A: Richiesta di grigliatura per {session_key} inviata allo scheduler.")
+    _gridding_scheduler.request()
 
 
-def extract_metadata_and_filter(filepath: str, hdul: fits.HDUList) -> tuple[Dict[str, Any] | None, bool]:
+
+
+def extract_metadata_and_filter(filepath: str, hdul: fits.HDUList) -> tuple[Dict[str, Any] | None, Any, bool]:
     """
     Estrae tutti i metadati FITS, determina l'acquisizione, e filtra
     se il file non contiene dati per il feed selezionato dall'utente.
 
     Ritorna: 
-    - (header_data, should_process): Dizionario con i metadati OPPURE None, e un flag
-                                     che indica se l'elaborazione deve continuare.
+    - (header_data, acq_feeds_unique_values, should_process): Dizionario con i metadati OPPURE None,
+      i feed dell'acquisizione (None se il file viene scartato) e un flag che indica se
+      l'elaborazione deve continuare.
     """
     
     header = hdul[0].header
@@ -888,12 +1199,13 @@ def extract_metadata_and_filter(filepath: str, hdul: fits.HDUList) -> tuple[Dict
                 feeds_relative_to_file.append(filename_extension.removeprefix('.fits'))
                         
 
-    print('*** List of feeds relative to acquisition:',  acq_feeds_unique_values)
-    print('*** List of feeds relative to file:', feeds_relative_to_file)
+    logger.debug("List of feeds relative to acquisition: %s", acq_feeds_unique_values)
+    logger.debug("List of feeds relative to file: %s", feeds_relative_to_file)
 
-    # We process data only if the fits file has data related to the feed selected by the user in the front-end
-    # Get the feed selected by the user
-    selected_feed_str = str(state.CURRENT_SELECTED_FEED)
+    # We process data only if the fits file has data related to at least one feed subscribed by a client
+    # (the union of the per-client selections): the file is reduced once for all of them.
+    subscribed_feeds_str = [str(f) for f in sorted(state.subscribed_feeds())]
+    selected_feed_str = ", ".join(subscribed_feeds_str)
     # Convert unique_values in a string for omogeneous comparison
     if(acq_type == "DUAL" and header_data["backend"] == "SKARAB"):
 
@@ -908,18 +1220,25 @@ def extract_metadata_and_filter(filepath: str, hdul: fits.HDUList) -> tuple[Dict
     header_data["feeds_relative_to_file"] = unique_values_str
 
 
-    if selected_feed_str not in unique_values_str: 
-        
-        print(f"PROCESSOR FILTER: File discarded: {filename}. Selected Feed ({selected_feed_str}) not found in those listed in the fits file ({acq_feeds_str}).")
-        return None, False # File will not be processed
+    header_data["target_feeds"] = [int(f) for f in subscribed_feeds_str if f in unique_values_str]
+
+    if not header_data["target_feeds"]: 
+
+        # In modalit� mappa multi-feed i file di mappa degli altri feed servono comunque alla mappa
+        if state.MULTI_FEED_MAP and is_map_by_keyword(str(header.get("SubScanType", ""))):
+            logger.info(f"PROCESSOR FILTER: {filename} kept for the multi-feed map only (subscribed feeds {selected_feed_str} not in file).")
+            header_data["map_only"] = True
+
+        else:
+            logger.info(f"PROCESSOR FILTER: File discarded: {filename}. Subscribed Feeds ({selected_feed_str}) not found in those listed in the fits file ({acq_feeds_str}).")
+            return None, None, False # File will not be processed
         
       
     for keyword, value in header.items():
         if keyword not in ['COMMENT', 'HISTORY']:
-            print(f"{keyword}: {value}")
+            logger.debug("%s: %s", keyword, value)
             header_data["header"][keyword] = str(value)
 
-    print("--------------------------------------------------\n")
 
     # Keyword aggiuntive da HduTables
     try:
@@ -934,7 +1253,7 @@ def extract_metadata_and_filter(filepath: str, hdul: fits.HDUList) -> tuple[Dict
     
     except Exception as e:
         
-        print(f"Attention - error while extracting values from extension tables: {e}")
+        logger.warning(f"Attention - error while extracting values from extension tables: {e}")
     
     return header_data, acq_feeds_unique_values,True # Tutto ?? OK, processa 
 
@@ -955,7 +1274,7 @@ def determine_map_coordinates(header_data: Dict[str, Any]) -> str:
     subscan_type = header_data.get("SubScanType")
 
     if subscan_type is None:
-        print("WARNING: Keyword 'SubScanType' mancante nell'header.")
+        logger.warning("Keyword 'SubScanType' mancante nell'header.")
         return "OTHER"
         
     # Standardizza il valore per la comparazione (opzionale, ma sicuro)
@@ -968,18 +1287,18 @@ def determine_map_coordinates(header_data: Dict[str, Any]) -> str:
     # --- 2. CASI MAPPA (Coordinate Celesti) ---
     elif subscan_type in ["RA", "DEC"]:
         # Se la scansione avviene in RA o DEC, usiamo le coordinate celesti.
-        print(f"DEBUG: SubScanType '{subscan_type}'. Scelgo RA/DEC.")
+        logger.debug(f"SubScanType '{subscan_type}'. Scelgo RA/DEC.")
         return "RA_DEC"
         
     # --- 3. CASI MAPPA (Coordinate Orizzontali) ---
     elif subscan_type in ["AZ", "EL"]:
         # Se la scansione avviene in AZ o EL, usiamo le coordinate orizzontali.
-        print(f"DEBUG: SubScanType '{subscan_type}'. Scelgo EL/AZ.")
+        logger.debug(f"SubScanType '{subscan_type}'. Scelgo EL/AZ.")
         return "EL_AZ"
         
     # --- 4. FALLBACK ---
     else:
-        print(f"PROCESSOR: Tipo di scansione '{subscan_type}' non riconosciuto per la mappatura. Skippo.")
+        logger.warning(f"PROCESSOR: Tipo di scansione '{subscan_type}' non riconosciuto per la mappatura. Skippo.")
         return "OTHER"
 
 
@@ -997,7 +1316,7 @@ def _get_map_coordinates(header_data: Dict[str, Any]) -> str:
     subscan_type = header_data.get("SUBSCAN") # Assumiamo che "SUBSCAN" sia la chiave corretta
 
     if subscan_type is None:
-        print("WARNING: Keyword 'SUBSCAN' mancante nell'header. Skippo l'elaborazione.")
+        logger.warning("Keyword 'SUBSCAN' mancante nell'header. Skippo l'elaborazione.")
         return "OTHER"
         
     # --- 1. CASI NON-MAPPA ---
@@ -1008,17 +1327,17 @@ def _get_map_coordinates(header_data: Dict[str, Any]) -> str:
     # --- 2. CASI MAPPA (Coordinate Celesti) ---
     elif subscan_type in ["RA", "DEC"]:
         # Se la scansione avviene in RA o DEC, usiamo le coordinate celesti.
-        print(f"DEBUG: SUBSCAN � '{subscan_type}'. Scelgo RA/DEC.")
+        logger.debug(f"SUBSCAN � '{subscan_type}'. Scelgo RA/DEC.")
         return "RA_DEC"
         
     # --- 3. CASI MAPPA (Coordinate Orizzontali) ---
     elif subscan_type in ["AZ", "EL"]:
         # Se la scansione avviene in AZ o EL, usiamo le coordinate orizzontali.
-        print(f"DEBUG: SUBSCAN � '{subscan_type}'. Scelgo EL/AZ.")
+        logger.debug(f"SUBSCAN � '{subscan_type}'. Scelgo EL/AZ.")
         return "EL_AZ"
         
     # --- 4. FALLBACK ---
     else:
         # Qualsiasi altro valore che non � esplicitamente gestito
-        print(f"PROCESSOR: Tipo di scansione '{subscan_type}' non riconosciuto per la mappatura. Skippo.")
+        logger.warning(f"PROCESSOR: Tipo di scansione '{subscan_type}' non riconosciuto per la mappatura. Skippo.")
         return "OTHER"
\ No newline at end of file
@@ -8,9 +8,15 @@ from watchdog.observers.polling import PollingObserver
 from watchdog.events import FileSystemEventHandler
 import time
 
+import metrics
+import pipeline_trace
+import logging_setup
+
 # Import the processing functions from the fits_processor.py file
 from fits_processor import process_fits_file, set_socketio_instance_for_processor
 
+logger = logging_setup.get_logger(__name__)
+
 # Global variable to hold the directory to monitor.
 # It's initialized to a default, but can be updated by set_monitor_directory.
 MONITOR_DIRECTORY = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fits_files_default') # Changed to 'default'
@@ -35,6 +41,10 @@ _socketio_instance = None
 _processing_files = set()
 _processing_lock = threading.Lock() # To ensure thread-safe access to _processing_files
 
+# Optional function that hands a file over to the processing workers (see processing_worker.py)
+# instead of processing it in this process. Set by app.py when [Workers] enabled = true.
+_file_dispatcher = None
+
 
 def set_monitor_directory(path):
     """
@@ -46,7 +56,7 @@ def set_monitor_directory(path):
     """
     global MONITOR_DIRECTORY
     MONITOR_DIRECTORY = os.path.abspath(path) # Ensure it's an absolute path
-    print(f"Monitor directory set to: {MONITOR_DIRECTORY}")
+    logger.info(f"Monitor directory set to: {MONITOR_DIRECTORY}")
 
 
 
@@ -61,7 +71,40 @@ def set_socketio_instance(sio):
     global _socketio_instance
     _socketio_instance = sio
     set_socketio_instance_for_processor(sio) # Pass it down to the processor module
-    print("SocketIO instance passed to fits_watcher.py (and fits_processor.py)")
+    logger.info("SocketIO instance passed to fits_watcher.py (and fits_processor.py)")
+
+
+def set_file_dispatcher(dispatcher):
+    """
+    Sets the function that receives the paths of the new FITS files instead of `process_fits_file`.
+    The file stays in the processing list until `mark_file_done` is called for it.
+
+    Args:
+        dispatcher (callable): Function taking the file path (e.g. FileBroker.submit), or None.
+    """
+    global _file_dispatcher
+    _file_dispatcher = dispatcher
+
+
+def pending_file_count():
+    """
+    Returns the number of files detected and not yet processed (queue depth exposed by metrics.py).
+    """
+    with _processing_lock:
+        return len(_processing_files)
+
+
+def mark_file_done(filepath):
+    """
+    Removes a file from the processing list (called when a processing worker reports it as done).
+
+    Args:
+        filepath (str): The path to the processed file.
+    """
+    with _processing_lock:
+        if filepath in _processing_files:
+            _processing_files.remove(filepath)
+            logger.info(f"Finished processing and removed {os.path.basename(filepath)} from processing list.")
 
 
 class FitsFileHandler(FileSystemEventHandler):
@@ -90,14 +133,16 @@ class FitsFileHandler(FileSystemEventHandler):
         # 1. Check if the file ends with any of the defined FITS extensions using regex
         # This will match '.fits', '.fits0', '.fits123', etc. (case-insensitive)
         if not FITS_EXTENSION_PATTERN.search(filename_base): # Search in original case for filename_base
-            print(f"File '{filename_base}' skipped: Not a recognized FITS extension.") # Optional: uncomment for verbose logging
+            logger.debug(f"File '{filename_base}' skipped: Not a recognized FITS extension.")
+            metrics.file_dropped('not_fits')
             return # Not a FITS file, ignore
 
         # 2. Exclude files whose filename starts with 'Sum', 'Sum_', or 'summary' (case-insensitive)
         if lower_filename_base.startswith('sum') or \
            lower_filename_base.startswith('sum_') or \
            lower_filename_base.startswith('summary'):
-            print(f"File '{filename_base}' skipped: Filename starts with 'Sum', 'Sum_', or 'summary'.")
+            logger.debug(f"File '{filename_base}' skipped: Filename starts with 'Sum', 'Sum_', or 'summary'.")
+            metrics.file_dropped('summary')
             return # Ignore this file
        
         # 3. Exclude files located in specified temporary subfolders ('tempfits', 'tmp')
@@ -115,17 +160,24 @@ class FitsFileHandler(FileSystemEventHandler):
 
             # Check if any component matches an excluded subfolder
             if len(EXCLUDED_SUBFOLDERS.intersection(path_components)) > 0:
-                print(f"File '{filename_base}' skipped: Located in an excluded temporary subfolder ({filepath}).")
+                logger.debug(f"File '{filename_base}' skipped: Located in an excluded temporary subfolder ({filepath}).")
+                metrics.file_dropped('excluded_folder')
                 return # Ignore this file
 
         # If all checks pass, proceed with processing
         with _processing_lock:
             if filepath in _processing_files:
-                print(f"File {os.path.basename(filepath)} is already being processed or was processed. Skipping duplicate event.")
+                logger.debug(f"File {os.path.basename(filepath)} is already being processed or was processed. Skipping duplicate event.")
+                metrics.file_dropped('duplicate_event')
                 return
             _processing_files.add(filepath)
 
-        print(f"\n--- Detected new FITS file: {os.path.basename(filepath)} ---")
+        logger.info(f"--- Detected new FITS file: {os.path.basename(filepath)} ---")
+        # Detection latency: time since the file was last written (mostly the polling interval)
+        try:
+            pipeline_trace.record_span('detection', min(os.path.getmtime(filepath), time.time()), time.time(), file_id=filepath)
+        except OSError:
+            pass
 
 
 
@@ -141,14 +193,21 @@ class FitsFileHandler(FileSystemEventHandler):
         Args:
             filepath (str): The path to the file being processed.
         """
+        if _file_dispatcher is not None:
+            # Split deployment: a worker process processes the file and reports it as done
+            try:
+                _file_dispatcher(filepath)
+            except Exception as e:
+                logger.error(f"Could not dispatch {os.path.basename(filepath)} to the processing workers: {e}")
+                mark_file_done(filepath)
+            return
+
         try:
-            process_fits_file(filepath)
+            with pipeline_trace.file_context(filepath):
+                process_fits_file(filepath)
         finally:
             # Ensure the file is removed from the processing set in a thread-safe manner.
-            with _processing_lock:
-                if filepath in _processing_files:
-                    _processing_files.remove(filepath)
-                    print(f"Finished processing and removed {os.path.basename(filepath)} from processing list.")
+            mark_file_done(filepath)
 
 
 def start_fits_monitor():
@@ -170,7 +229,7 @@ def start_fits_monitor():
     # Schedule the event handler to monitor the directory non-recursively (only direct files).
     observer.schedule(event_handler, MONITOR_DIRECTORY, recursive=True)
     observer.start() # Start the observer thread.
-    print(f"FITS file monitor started for directory: {MONITOR_DIRECTORY}")
+    logger.info(f"FITS file monitor started for directory: {MONITOR_DIRECTORY}")
     return observer
 
 def stop_fits_monitor(observer):
@@ -183,4 +242,4 @@ def stop_fits_monitor(observer):
     if observer:
         observer.stop() # Stop the observer thread.
         observer.join() # Wait for the observer thread to terminate.
-        print("FITS file monitor stopped.")
+        logger.info("FITS file monitor stopped.")
@@ -0,0 +1,134 @@
+# gridding_scheduler.py
+
+import threading
+import time
+import logging_setup
+
+from typing import Callable, Dict, Optional
+
+logger = logging_setup.get_logger(__name__)
+
+
+class GriddingScheduler:
+    """
+    Scheduler "coalescente" per la grigliatura della mappa (Worker B).
+
+    Ogni richiesta marca la mappa come 'dirty'. Un unico thread persistente esegue il task:
+    le richieste che arrivano mentre il task � in esecuzione (o durante l'intervallo minimo
+    tra due esecuzioni) vengono accorpate in UNA sola esecuzione successiva. Nessuna
+    richiesta viene scartata: dopo l'ultima richiesta pendente viene sempre eseguito un
+    passaggio finale.
+
+    Con idle_task, quando non arrivano richieste per idle_after_s secondi dopo l'ultima
+    esecuzione, idle_task viene eseguito una volta nello stesso thread (es. il salvataggio
+    su disco delle mappe, limitato nel tempo durante l'acquisizione).
+
+    Per ogni esecuzione vengono registrati la latenza (dalla richiesta pi� vecchia accorpata
+    alla fine del task) e il numero di richieste assorbite.
+    """
+
+    def __init__(self, task: Callable[[], None], min_interval_s: float = 1.0, name: str = 'GriddingScheduler',
+                 idle_task: Optional[Callable[[], None]] = None, idle_after_s: float = 5.0):
+        self._task = task
+        self.min_interval_s = min_interval_s
+        self._idle_task = idle_task
+        self.idle_after_s = idle_after_s
+        self._name = name
+        self._cond = threading.Condition()
+        self._thread: Optional[threading.Thread] = None
+        self._stopped = False
+
+        self._pending = 0               # Richieste arrivate dall'ultima esecuzione
+        self._oldest_request: Optional[float] = None
+        self._last_run_start = 0.0
+        self._last_run_end = 0.0
+        self._idle_pending = False      # idle_task da eseguire dopo l'ultima esecuzione
+
+        self.runs = 0
+        self.last_stats: Dict[str, float] = {}
+
+    def request(self) -> None:
+        """Marca la mappa come da ri-grigliare. Non blocca mai il chiamante."""
+        with self._cond:
+            self._pending += 1
+            if self._oldest_request is None:
+                self._oldest_request = time.time()
+            if self._thread is None or not self._thread.is_alive():
+                self._stopped = False
+                self._thread = threading.Thread(target=self._run, name=self._name, daemon=True)
+                self._thread.start()
+            self._cond.notify()
+
+    def stop(self, timeout: Optional[float] = None) -> None:
+        """Ferma il thread dello scheduler (le richieste pendenti vengono prima eseguite)."""
+        with self._cond:
+            self._stopped = True
+            self._cond.notify()
+            thread = self._thread
+        if thread is not None:
+            thread.join(timeout)
+
+    def _wait_for_request(self) -> bool:
+        """
+        Attende una richiesta (con self._cond acquisito). Ritorna True se invece è il momento di
+        eseguire idle_task: nessuna richiesta per idle_after_s secondi dall'ultima esecuzione.
+        """
+        while self._pending == 0 and not self._stopped:
+            if self._idle_task is None or not self._idle_pending:
+                self._cond.wait()
+                continue
+            idle_wait_s = self._last_run_end + self.idle_after_s - time.time()
+            if idle_wait_s <= 0:
+                self._idle_pending = False
+                return True
+            self._cond.wait(idle_wait_s)
+        return False
+
+    def _run_idle_task(self) -> None:
+        try:
+            self._idle_task()
+        except Exception as e:
+            logger.error(f"{self._name}: ERRORE durante l'esecuzione del task di inattività: {e}")
+
+    def _run(self) -> None:
+        while True:
+            with self._cond:
+                run_idle = self._wait_for_request()
+                if not run_idle and self._pending == 0 and self._stopped:
+                    return
+            if run_idle:
+                self._run_idle_task()
+                continue
+
+            with self._cond:
+                # Intervallo minimo tra due esecuzioni: le richieste che arrivano nel
+                # frattempo vengono accorpate in questa esecuzione.
+                wait_s = self._last_run_start + self.min_interval_s - time.time()
+                while wait_s > 0 and not self._stopped:
+                    self._cond.wait(wait_s)
+                    wait_s = self._last_run_start + self.min_interval_s - time.time()
+
+                absorbed = self._pending
+                oldest_request = self._oldest_request
+                self._pending = 0
+                self._oldest_request = None
+                self._last_run_start = time.time()
+
+            run_start = self._last_run_start
+            try:
+                self._task()
+            except Exception as e:
+                logger.error(f"{self._name}: ERRORE durante l'esecuzione del task: {e}")
+            run_end = time.time()
+            with self._cond:
+                self._last_run_end = run_end
+                self._idle_pending = True
+
+            self.runs += 1
+            self.last_stats = {
+                'absorbed_requests': absorbed,
+                'latency_s': run_end - oldest_request,
+                'run_time_s': run_end - run_start,
+            }
+            logger.info(f"{self._name}: esecuzione #{self.runs} completata. Richieste accorpate: {absorbed}. "
+                        f"Latenza: {self.last_stats['latency_s']:.3f} s (task: {self.last_stats['run_time_s']:.3f} s).")
@@ -0,0 +1,64 @@
+# header_delta.py
+
+import threading
+
+from collections import OrderedDict
+from typing import Any, Dict, Hashable, Optional
+
+# --------------------------------------------------------
+# CODIFICA DELTA DEGLI HEADER DI 'fits_header_update'
+# --------------------------------------------------------
+# Le subscan di una stessa scansione condividono quasi tutte le keyword dell'header primario:
+# per ogni flusso (room Socket.IO) l'header completo viene inviato alla prima subscan della
+# scansione, poi solo le keyword cambiate. Ogni messaggio porta un numero di versione: un
+# client che trova un buco nella sequenza chiede l'header completo (resync).
+#
+# Campi aggiunti al payload:
+#   header_mode:    'full' (header = header completo) o 'delta' (header = keyword cambiate)
+#   header_scan:    scansione a cui si riferisce l'header
+#   header_version: versione dell'header dopo l'applicazione di questo messaggio
+#   header_removed: keyword rimosse rispetto alla versione precedente (solo 'delta')
+
+
+class HeaderDeltaEncoder:
+    """Stato dell'ultimo header inviato per ciascun flusso (LRU, al massimo max_streams flussi)."""
+
+    def __init__(self, max_streams: int = 256):
+        self._streams: "OrderedDict[Hashable, Dict[str, Any]]" = OrderedDict()
+        self._max_streams = max_streams
+        self._lock = threading.Lock()
+
+    def encode(self, stream_key: Hashable, scan_key: str, payload: Dict[str, Any]) -> Dict[str, Any]:
+        """Ritorna una copia del payload con l'header codificato (completo o delta) per il flusso."""
+        header = dict(payload.get('header') or {})
+        encoded = dict(payload)
+
+        with self._lock:
+            stream = self._streams.get(stream_key)
+            if stream is None or stream['scan'] != scan_key:
+                # Nuova scansione (o nuovo flusso): header completo, versione ripartita da 1
+                stream = {'scan': scan_key, 'version': 1, 'header': header}
+                self._streams[stream_key] = stream
+                encoded.update(header=header, header_mode='full', header_scan=scan_key, header_version=1)
+            else:
+                previous = stream['header']
+                changed = {k: v for k, v in header.items() if previous.get(k) != v}
+                removed = [k for k in previous if k not in header]
+                stream['version'] += 1
+                stream['header'] = header
+                encoded.update(header=changed, header_mode='delta', header_scan=scan_key,
+                               header_version=stream['version'], header_removed=removed)
+
+            self._streams.move_to_end(stream_key)
+            while len(self._streams) > self._max_streams:
+                self._streams.popitem(last=False)
+        return encoded
+
+    def full_header(self, stream_key: Hashable) -> Optional[Dict[str, Any]]:
+        """Header completo e versione correnti del flusso (risposta a una richiesta di resync)."""
+        with self._lock:
+            stream = self._streams.get(stream_key)
+            if stream is None:
+                return None
+            return {'header': dict(stream['header']), 'header_mode': 'full',
+                    'header_scan': stream['scan'], 'header_version': stream['version']}
@@ -0,0 +1,126 @@
+# logging_setup.py
+
+import logging
+import logging.handlers
+import queue
+import sys
+import threading
+import time
+
+from typing import Dict, Optional, Tuple
+
+# --------------------------------------------------------
+# LOGGING NON BLOCCANTE PER IL PERCORSO DI ELABORAZIONE
+# --------------------------------------------------------
+# I moduli usano logging_setup.get_logger(__name__), sotto il logger radice 'quicklook'.
+# I thread di elaborazione mettono i record in una coda limitata (put non bloccante: se la coda
+# è piena il record viene scartato e contato) e un solo thread (QueueListener) li scrive su stdout.
+# Per ogni punto di chiamata (file + riga) i messaggi fino a WARNING sono limitati: i primi
+# LOG_BURST per secondo passano, poi ne passa uno ogni LOG_SAMPLE_EVERY con il numero dei
+# messaggi soppressi. WARNING ed ERROR passano sempre. I dump di array sono solo a livello DEBUG.
+
+ROOT_LOGGER = 'quicklook'
+LOG_FORMAT = '%(asctime)s %(levelname)-7s [%(threadName)s] %(name)s: %(message)s'
+
+LOG_LEVEL = logging.INFO
+LOG_BURST = 20            # Messaggi al secondo per punto di chiamata prima del campionamento
+LOG_SAMPLE_EVERY = 100    # Oltre il burst passa un messaggio ogni LOG_SAMPLE_EVERY
+LOG_QUEUE_SIZE = 10000    # Record in attesa di essere scritti (oltre vengono scartati)
+
+_listener: Optional[logging.handlers.QueueListener] = None
+_queue_handler: Optional['_DroppingQueueHandler'] = None
+
+
+def get_logger(name: str) -> logging.Logger:
+    """Logger di un modulo sotto il logger radice dell'applicazione (es. 'quicklook.fits_processor')."""
+    return logging.getLogger(f'{ROOT_LOGGER}.{name}')
+
+
+class RateLimitFilter(logging.Filter):
+    """Limita e campiona i messaggi di ciascun punto di chiamata (livelli inferiori a WARNING)."""
+
+    def __init__(self, burst: int, sample_every: int, window_s: float = 1.0):
+        super().__init__()
+        self.burst = burst
+        self.sample_every = max(1, sample_every)
+        self.window_s = window_s
+        self._sites: Dict[Tuple[str, int], list] = {}  # (file, riga) -> [inizio finestra, messaggi, soppressi]
+        self._lock = threading.Lock()
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno >= logging.WARNING:
+            return True
+        now = time.monotonic()
+        key = (record.pathname, record.lineno)
+        with self._lock:
+            site = self._sites.get(key)
+            if site is None or now - site[0] >= self.window_s:
+                suppressed = site[2] if site else 0
+                self._sites[key] = site = [now, 0, 0]
+            else:
+                suppressed = 0
+            site[1] += 1
+            if site[1] > self.burst and (site[1] - self.burst) % self.sample_every:
+                site[2] += 1
+                return False
+            suppressed += site[2]
+            site[2] = 0
+        if suppressed:
+            record.msg = f'{record.msg} [{suppressed} messaggi simili soppressi]'
+        return True
+
+
+class _DroppingQueueHandler(logging.handlers.QueueHandler):
+    """QueueHandler che non blocca mai: con la coda piena il record viene scartato e contato."""
+
+    def __init__(self, log_queue: queue.Queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+def setup_logging(level: str = 'INFO', burst: int = LOG_BURST, sample_every: int = LOG_SAMPLE_EVERY,
+                  queue_size: int = LOG_QUEUE_SIZE) -> None:
+    """
+    Configura il logger radice dell'applicazione: coda limitata + thread di scrittura su stdout,
+    filtro di rate limiting. Chiamata da app.py all'avvio (e dai worker di elaborazione).
+    """
+    global _listener, _queue_handler, LOG_LEVEL, LOG_BURST, LOG_SAMPLE_EVERY, LOG_QUEUE_SIZE
+    stop_logging()
+
+    LOG_LEVEL = logging.getLevelName(str(level).upper()) if isinstance(level, str) else int(level)
+    if not isinstance(LOG_LEVEL, int):
+        LOG_LEVEL = logging.INFO
+    LOG_BURST, LOG_SAMPLE_EVERY, LOG_QUEUE_SIZE = int(burst), int(sample_every), int(queue_size)
+
+    log_queue: queue.Queue = queue.Queue(maxsize=LOG_QUEUE_SIZE)
+    _queue_handler = _DroppingQueueHandler(log_queue)
+    _queue_handler.addFilter(RateLimitFilter(LOG_BURST, LOG_SAMPLE_EVERY))
+
+    stream_handler = logging.StreamHandler(sys.stdout)
+    stream_handler.setFormatter(logging.Formatter(LOG_FORMAT))
+    _listener = logging.handlers.QueueListener(log_queue, stream_handler, respect_handler_level=False)
+    _listener.start()
+
+    root = logging.getLogger(ROOT_LOGGER)
+    root.handlers[:] = [_queue_handler]
+    root.setLevel(LOG_LEVEL)
+    root.propagate = False
+
+
+def dropped_records() -> int:
+    """Record scartati perché la coda era piena (esposto da metrics.py)."""
+    return _queue_handler.dropped if _queue_handler is not None else 0
+
+
+def stop_logging() -> None:
+    """Scrive i record ancora in coda e ferma il thread di scrittura."""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
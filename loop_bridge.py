@@ -0,0 +1,148 @@
+# loop_bridge.py
+
+import asyncio
+import inspect
+import queue
+import threading
+
+from typing import Any, Callable, Dict, Hashable, List, Optional, Tuple
+
+import socketio
+
+import logging_setup
+import state
+
+logger = logging_setup.get_logger(__name__)
+
+# --------------------------------------------------------
+# PONTE TRA I THREAD DI LAVORO E UN EVENT LOOP (modalit� 'single_loop' e 'asgi')
+# --------------------------------------------------------
+# I worker (watchdog, elaborazione FITS, grigliatura) restano thread: invece di svegliare
+# il loop per ogni emit pubblicano le richieste in un'unica coda thread-safe, svuotata a
+# blocchi dal loop.
+
+
+class LoopBridge:
+    """
+    Coda thread-safe verso l'IOLoop. post() pu� essere chiamata da qualsiasi thread:
+    il loop viene svegliato una sola volta per tutte le richieste pendenti, che vengono
+    eseguite in blocco. Le richieste con la stessa coalesce_key vengono accorpate
+    (resta solo la pi� recente, es. pi� mappe della stessa sessione).
+    """
+
+    def __init__(self, call_soon_threadsafe: Callable[[Callable], Any]):
+        # IOLoop.add_callback (Tornado) o loop.call_soon_threadsafe (asyncio)
+        self._call_soon_threadsafe = call_soon_threadsafe
+        self._queue: "queue.SimpleQueue" = queue.SimpleQueue()
+        self._lock = threading.Lock()
+        self._scheduled = False
+        self._latest: Dict[Hashable, tuple] = {}
+        self.drains = 0
+        self.executed = 0
+
+    def post(self, fn: Callable, *args, coalesce_key: Optional[Hashable] = None, **kwargs) -> None:
+        item = (fn, args, kwargs)
+        with self._lock:
+            if coalesce_key is not None:
+                replaced = coalesce_key in self._latest
+                self._latest[coalesce_key] = item
+                if replaced:
+                    return # Gi� in coda: verr� eseguita la versione pi� recente
+                item = coalesce_key
+            self._queue.put(item)
+            if self._scheduled:
+                return
+            self._scheduled = True
+        self._call_soon_threadsafe(self._drain) # Thread-safe: sveglia il loop
+
+    def _drain(self) -> None:
+        with self._lock:
+            self._scheduled = False
+        batch = []
+        while True:
+            try:
+                batch.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+
+        for item in batch:
+            if not isinstance(item, tuple):
+                with self._lock:
+                    item = self._latest.pop(item)
+            fn, args, kwargs = item
+            try:
+                result = fn(*args, **kwargs)
+                if inspect.isawaitable(result):
+                    asyncio.ensure_future(result)
+            except Exception as e:
+                logger.error(f"LOOP BRIDGE: Errore nell'esecuzione di {getattr(fn, '__name__', fn)}: {e}")
+        self.drains += 1
+        self.executed += len(batch)
+
+
+class LoopSocketIO:
+    """
+    Sostituto dell'istanza Flask-SocketIO per fits_watcher/fits_processor nelle modalit� asincrone:
+    stessa interfaccia (emit, start_background_task), ma gli emit passano dal LoopBridge.
+    """
+
+    def __init__(self, sio: socketio.AsyncServer, bridge: LoopBridge):
+        self.sio = sio
+        self.bridge = bridge
+
+    def emit(self, event: str, data: Any = None, **kwargs) -> None:
+        self.bridge.post(self.sio.emit, event, data, **kwargs)
+
+    def start_background_task(self, target: Callable, *args, **kwargs) -> None:
+        if target == self.emit:
+            target(*args, **kwargs) # L'emit non blocca: nessun thread necessario
+        else:
+            threading.Thread(target=target, args=args, kwargs=kwargs, daemon=True).start()
+
+
+def register_async_handlers(sio, on_feed_selection: Callable[[str, Dict], Tuple],
+                            on_disconnect: Callable[[str], None],
+                            on_header_resync: Optional[Callable[[str], Optional[Dict]]] = None,
+                            on_replay: Optional[Callable[[Optional[int]], List[Tuple[str, Dict]]]] = None) -> None:
+    """
+    Registra su un socketio.AsyncServer gli stessi handler Socket.IO di app.py.
+    on_feed_selection(sid, data) ritorna (feed precedente, nuovo feed) del client.
+    on_header_resync(sid) ritorna l'header completo corrente del client, o None.
+    on_replay(feed) ritorna gli eventi (nome, payload) da inviare a un client che si sottoscrive
+    a un feed (al collegamento o al cambio di feed).
+    """
+
+    async def _replay(sid, feed):
+        for event, payload in (on_replay(feed) if on_replay else []):
+            await sio.emit(event, payload, to=sid)
+
+    async def _call(method, *args):
+        # enter_room/leave_room sono coroutine solo nelle versioni pi� recenti di python-socketio
+        result = method(*args)
+        if inspect.isawaitable(result):
+            await result
+
+    @sio.event
+    async def connect(sid, environ):
+        logger.info(f"Client connected: {sid}")
+        await sio.emit('status', {'data': 'Connected'}, to=sid)
+
+    @sio.event
+    async def disconnect(sid):
+        logger.info(f"Client disconnected: {sid}")
+        on_disconnect(sid)
+
+    @sio.on('update_feed_selection')
+    async def update_feed_selection(sid, data):
+        previous_feed, new_feed = on_feed_selection(sid, data)
+        if new_feed is not None and new_feed != previous_feed:
+            if previous_feed is not None:
+                await _call(sio.leave_room, sid, state.feed_room(previous_feed))
+            await _call(sio.enter_room, sid, state.feed_room(new_feed))
+            await _replay(sid, new_feed)
+
+    @sio.on('header_resync')
+    async def header_resync(sid, data=None):
+        full_header = on_header_resync(sid) if on_header_resync else None
+        if full_header is not None:
+            await sio.emit('fits_header_resync', full_header, to=sid)
@@ -0,0 +1,76 @@
+# map_baseline.py
+
+import numpy as np
+import logging_setup
+
+from functools import lru_cache
+from typing import List, Tuple
+
+logger = logging_setup.get_logger(__name__)
+
+# --------------------------------------------------------
+# RIMOZIONE DELLA BASELINE PER SUBSCAN (prima dell'accumulo nella mappa)
+# --------------------------------------------------------
+# Le derive lente tra una strisciata e l'altra producono "righe" nella mappa.
+# Per ogni subscan si stima un polinomio di basso grado sui campioni ai bordi
+# (dove si assume di essere fuori sorgente) e lo si sottrae all'intera strisciata.
+
+BASELINE_ORDER = 1            # Grado del polinomio (-1 = rimozione disabilitata)
+BASELINE_EDGE_FRACTION = 0.1  # Frazione di campioni usata a ciascun bordo della strisciata
+
+
+def set_baseline_options(order: int, edge_fraction: float) -> None:
+    """Imposta grado del polinomio (-1 disabilita) e frazione dei bordi. Chiamata da app.py."""
+    global BASELINE_ORDER, BASELINE_EDGE_FRACTION
+    if not 0.0 < edge_fraction <= 0.5:
+        raise ValueError(f"Frazione dei bordi non valida: {edge_fraction}")
+    BASELINE_ORDER = int(order)
+    BASELINE_EDGE_FRACTION = float(edge_fraction)
+    state_str = 'disabilitata' if BASELINE_ORDER < 0 else f"grado {BASELINE_ORDER}, bordi {BASELINE_EDGE_FRACTION:.0%}"
+    logger.info(f"Rimozione baseline delle strisciate: {state_str}.")
+
+
+@lru_cache(maxsize=32)
+def _design_matrices(n_samples: int, order: int, edge_fraction: float) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Matrici precalcolate per una lunghezza di strisciata (le subscan di una mappa hanno
+    quasi sempre la stessa lunghezza, quindi vengono calcolate una sola volta):
+    indici dei campioni ai bordi, pseudo-inversa della matrice di Vandermonde sui bordi
+    e matrice di Vandermonde completa. L'ascissa (indice del campione) � normalizzata in [-1, 1].
+    """
+    n_edge = max(order + 1, int(round(n_samples * edge_fraction)))
+    edge_index = np.concatenate([np.arange(n_edge), np.arange(n_samples - n_edge, n_samples)])
+    t = np.linspace(-1.0, 1.0, n_samples)
+    vander = np.vander(t, order + 1, increasing=True)
+    return edge_index, np.linalg.pinv(vander[edge_index]), vander
+
+
+def remove_subscan_baseline(all_pi_data: List[np.ndarray]) -> List[np.ndarray]:
+    """
+    Sottrae a ciascuna colonna P_i (tutte della stessa strisciata) il polinomio stimato sui bordi.
+    Tutte le polarizzazioni/feed vengono risolte insieme: un unico prodotto matriciale
+    con la pseudo-inversa precalcolata. Ritorna nuovi array (gli originali non vengono modificati).
+    """
+    if BASELINE_ORDER < 0 or not all_pi_data:
+        return list(all_pi_data)
+
+    P = np.vstack(all_pi_data).astype(np.float64)  # (colonne, campioni)
+    n_samples = P.shape[1]
+    if n_samples < 2 * (BASELINE_ORDER + 1):
+        return list(all_pi_data) # Strisciata troppo corta per stimare la baseline
+
+    edge_index, edge_pinv, vander = _design_matrices(n_samples, BASELINE_ORDER, BASELINE_EDGE_FRACTION)
+    P_edge = P[:, edge_index]
+
+    coefficients = edge_pinv @ P_edge.T  # (grado + 1, colonne)
+    # Colonne con campioni non validi ai bordi: fit ai minimi quadrati sui soli campioni finiti
+    bad_columns = np.flatnonzero(~np.isfinite(P_edge).all(axis=1))
+    for j in bad_columns:
+        valid = np.isfinite(P_edge[j])
+        if valid.sum() < BASELINE_ORDER + 1:
+            coefficients[:, j] = 0.0
+            continue
+        coefficients[:, j] = np.linalg.lstsq(vander[edge_index][valid], P_edge[j, valid], rcond=None)[0]
+
+    corrected = P - (vander @ coefficients).T
+    return [row.astype(np.asarray(pi).dtype, copy=False) for row, pi in zip(corrected, all_pi_data)]
@@ -0,0 +1,278 @@
+# map_checkpoint.py
+
+import json
+import os
+import re
+import time
+
+import numpy as np
+
+from typing import Dict, List, Optional, Tuple
+
+import state
+import map_gridding
+import logging_setup
+from bokeh_server import update_bokeh_plot
+
+logger = logging_setup.get_logger(__name__)
+
+# --------------------------------------------------------
+# CHECKPOINT DELLE SESSIONI DI MAPPA SU DISCO
+# --------------------------------------------------------
+# Ogni sessione ha una cartella con:
+#   points.f32         nuvola di punti, record float32 (una colonna per grandezza), solo append
+#   grid_<gen>_*.npy   griglie somma/conteggio per polarizzazione (snapshot, una generazione per checkpoint)
+#   meta.json          chiave della sessione, HPBW, punti validi e generazione delle griglie
+# meta.json viene sostituito atomicamente per ultimo: un checkpoint interrotto lascia valido quello precedente.
+
+CHECKPOINT_DIR: Optional[str] = None   # None = checkpoint disabilitati
+CHECKPOINT_INTERVAL_S = 30.0           # Intervallo minimo tra due checkpoint della stessa sessione
+CHECKPOINT_MAX_SESSIONS = 20           # Sessioni conservate su disco (le meno recenti vengono rimosse)
+IDLE_FLUSH_S = 5.0                     # Senza nuove strisciate per IDLE_FLUSH_S secondi le sessioni vengono salvate subito
+
+POINTS_FILE = 'points.f32'
+META_FILE = 'meta.json'
+POINTS_DTYPE = np.float32
+
+
+def configure(directory: Optional[str], interval_s: float = 30.0, max_sessions: int = 20) -> None:
+    """Abilita i checkpoint nella cartella indicata (None li disabilita). Chiamata da app.py."""
+    global CHECKPOINT_DIR, CHECKPOINT_INTERVAL_S, CHECKPOINT_MAX_SESSIONS
+    CHECKPOINT_DIR = directory
+    CHECKPOINT_INTERVAL_S = max(0.0, float(interval_s))
+    CHECKPOINT_MAX_SESSIONS = max(1, int(max_sessions))
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+        logger.info(f"Map checkpoints enabled in {directory} (every {CHECKPOINT_INTERVAL_S:.0f} s).")
+
+
+def _session_dir(session_key: state.MapSessionKey) -> str:
+    """Cartella del checkpoint di una sessione: nome leggibile ricavato da (scan ID, sistema di coordinate, feed)."""
+    name = re.sub(r'[^A-Za-z0-9_.-]+', '_', '__'.join(str(part) for part in session_key)).strip('_')
+    return os.path.join(CHECKPOINT_DIR, name or 'default')
+
+
+def _write_json_atomic(path: str, payload: Dict) -> None:
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(payload, f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+def _read_meta(directory: str) -> Optional[Dict]:
+    try:
+        with open(os.path.join(directory, META_FILE)) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def _append_points(directory: str, cache: Dict, meta: Optional[Dict]) -> Tuple[List[str], int]:
+    """
+    Aggiunge a points.f32 solo i punti arrivati dopo l'ultimo checkpoint.
+    Il file viene prima troncato ai punti validi del checkpoint precedente (append interrotto).
+    """
+    points = cache['POINTS']
+    columns = list(points.columns)
+    n_points = len(points) # Istantanea: i punti gi� scritti non cambiano pi�
+    path = os.path.join(directory, POINTS_FILE)
+
+    n_saved = 0
+    if meta and meta.get('columns') == columns:
+        n_saved = min(int(meta.get('n_points', 0)), n_points)
+    record_bytes = len(columns) * np.dtype(POINTS_DTYPE).itemsize
+
+    with open(path, 'ab') as f:
+        f.truncate(n_saved * record_bytes)
+        if n_points > n_saved:
+            records = np.empty((n_points - n_saved, len(columns)), dtype=POINTS_DTYPE)
+            for j, name in enumerate(columns):
+                records[:, j] = points.column(name)[n_saved:n_points]
+            f.write(records.tobytes())
+        f.flush()
+        os.fsync(f.fileno())
+    return columns, n_points
+
+
+def _write_grid_snapshot(directory: str, grid: Dict, generation: int) -> Dict:
+    """Salva le griglie di una generazione (file nuovi, quelli della generazione precedente restano validi)."""
+    grid_meta = {k: grid[k] for k in ('step_deg', 'mode', 'ix0', 'iy0', 'nx', 'ny')}
+    grid_meta['generation'] = generation
+    grid_meta['n_gridded'] = {}
+    for pol_key in map_gridding.POLARIZATION_KEYS:
+        for name in ('sum', 'count'):
+            np.save(os.path.join(directory, f'grid_{generation}_{pol_key}_{name}.npy'), grid[pol_key][name])
+        grid_meta['n_gridded'][pol_key] = int(grid[pol_key]['n_gridded'])
+    return grid_meta
+
+
+def _remove_old_generations(directory: str, keep_generation: Optional[int]) -> None:
+    for filename in os.listdir(directory):
+        match = re.match(r'grid_(\d+)_', filename)
+        if match and int(match.group(1)) != keep_generation:
+            os.remove(os.path.join(directory, filename))
+
+
+def checkpoint_session(cache: Dict, force: bool = False) -> bool:
+    """
+    Scrive il checkpoint di una sessione di mappa (al massimo ogni CHECKPOINT_INTERVAL_S secondi,
+    salvo force=True). Va chiamata dal thread della grigliatura (Worker B), che � l'unico a
+    modificare le griglie. Ritorna True se il checkpoint � stato scritto.
+    """
+    session_key = cache.get('KEY')
+    if not CHECKPOINT_DIR or session_key is None:
+        return False
+
+    status = cache.setdefault('CHECKPOINT', {'last_time': 0.0, 'n_points': 0})
+    now = time.time()
+    if not force and now - status['last_time'] < CHECKPOINT_INTERVAL_S:
+        return False
+    if len(cache['POINTS']) == status['n_points'] and status['last_time'] > 0:
+        return False # Nessun punto nuovo dall'ultimo checkpoint
+
+    start = time.time()
+    directory = _session_dir(session_key)
+    os.makedirs(directory, exist_ok=True)
+    meta = _read_meta(directory)
+
+    columns, n_points = _append_points(directory, cache, meta)
+
+    # Se le griglie non possono essere salvate ora resta valida la generazione precedente
+    previous_grid = (meta or {}).get('grid')
+    grid_meta = previous_grid
+    grid = cache.get('GRID')
+    if grid is not None and all(grid[p]['n_gridded'] <= n_points for p in map_gridding.POLARIZATION_KEYS):
+        generation = previous_grid['generation'] + 1 if previous_grid else 0
+        grid_meta = _write_grid_snapshot(directory, grid, generation)
+
+    _write_json_atomic(os.path.join(directory, META_FILE), {
+        'key': list(session_key),
+        'hpbw_arcsec': float(cache.get('HPBW_ARCSEC') or 0.0),
+        'columns': columns,
+        'n_points': n_points,
+        'grid': grid_meta,
+        'saved_at': now,
+    })
+    _remove_old_generations(directory, grid_meta['generation'] if grid_meta else None)
+
+    status.update({'last_time': now, 'n_points': n_points})
+    logger.info(f"MAP CHECKPOINT: Sessione {tuple(session_key)} salvata ({n_points} punti) in {time.time() - start:.3f} s.")
+    _prune_old_checkpoints()
+    return True
+
+
+def flush_sessions() -> int:
+    """
+    Checkpoint forzato di tutte le sessioni in memoria con punti non ancora salvati.
+    Chiamata da app.py alla chiusura, con la grigliatura ferma. Ritorna il numero di sessioni salvate.
+    """
+    with state._map_sessions_lock:
+        caches = list(state.MAP_SESSIONS.values())
+    saved = 0
+    for cache in caches:
+        try:
+            saved += checkpoint_session(cache, force=True)
+        except Exception as e:
+            logger.warning(f"MAP CHECKPOINT: Impossibile salvare la sessione {cache.get('KEY')}: {e}")
+    return saved
+
+
+def _list_checkpoints() -> List[Tuple[float, str, Dict]]:
+    """Checkpoint validi su disco, dal pi� recente al meno recente."""
+    if not CHECKPOINT_DIR or not os.path.isdir(CHECKPOINT_DIR):
+        return []
+    entries = []
+    for name in os.listdir(CHECKPOINT_DIR):
+        directory = os.path.join(CHECKPOINT_DIR, name)
+        meta = _read_meta(directory) if os.path.isdir(directory) else None
+        if meta:
+            entries.append((float(meta.get('saved_at', 0.0)), directory, meta))
+    entries.sort(key=lambda entry: entry[0], reverse=True)
+    return entries
+
+
+def _prune_old_checkpoints() -> None:
+    for _, directory, _ in _list_checkpoints()[CHECKPOINT_MAX_SESSIONS:]:
+        for filename in os.listdir(directory):
+            os.remove(os.path.join(directory, filename))
+        os.rmdir(directory)
+        logger.info(f"MAP CHECKPOINT: Rimosso il checkpoint meno recente {directory}.")
+
+
+def _load_session(directory: str, meta: Dict) -> Dict:
+    """
+    Ricostruisce una sessione di mappa da un checkpoint. Il file dei punti e le griglie vengono
+    letti tramite memory-mapping ma copiati interamente in memoria: la sessione ricaricata
+    continua a crescere e le griglie vengono aggiornate in place.
+    """
+    session_key = tuple(meta['key'])
+    cache = state._new_map_cache(session_key)
+    cache['HPBW_ARCSEC'] = meta.get('hpbw_arcsec', 0.0)
+
+    columns = meta['columns']
+    n_points = int(meta['n_points'])
+    if n_points > 0:
+        records = np.memmap(os.path.join(directory, POINTS_FILE), dtype=POINTS_DTYPE, mode='r',
+                            shape=(n_points, len(columns)))
+        known = set(cache['POINTS'].columns)
+        cache['POINTS'].append(**{name: records[:, j] for j, name in enumerate(columns) if name in known})
+        del records
+
+    grid_meta = meta.get('grid')
+    if grid_meta:
+        generation = grid_meta['generation']
+        grid = {k: grid_meta[k] for k in ('step_deg', 'mode', 'ix0', 'iy0', 'nx', 'ny')}
+        for pol_key in map_gridding.POLARIZATION_KEYS:
+            grid[pol_key] = {
+                # Copia dalla mappatura: le griglie vengono poi aggiornate in place dalla grigliatura
+                name: np.array(np.load(os.path.join(directory, f'grid_{generation}_{pol_key}_{name}.npy'), mmap_mode='r'))
+                for name in ('sum', 'count')
+            }
+            grid[pol_key]['n_gridded'] = int(grid_meta['n_gridded'][pol_key])
+        cache['GRID'] = grid
+
+    cache['CHECKPOINT'] = {'last_time': float(meta.get('saved_at', 0.0)), 'n_points': n_points}
+    return cache
+
+
+def restore_sessions(scan_dir: Optional[str] = None) -> Optional[Dict]:
+    """
+    Ricarica all'avvio le sessioni salvate (dalla meno recente alla pi� recente, cos� l'ordine LRU
+    e la sessione attiva coincidono con quelli prima del riavvio) e ne rigenera il risultato.
+    Con scan_dir (nome della cartella della scansione) ricarica solo le sessioni di quella scansione:
+    in modalità distribuita ogni worker ricarica le scansioni che il broker gli assegna.
+    Ritorna il risultato della sessione pi� recente, o None.
+    """
+    start = time.time()
+    latest_result = None
+    for _, directory, meta in reversed(_list_checkpoints()):
+        key = tuple(meta.get('key') or ('',))
+        if scan_dir is not None and not str(key[0]).startswith(f'{scan_dir}/'):
+            continue # Scansione di un altro worker (chiave: '<cartella della scansione>/<SCANID>')
+        if key in state.MAP_SESSIONS:
+            continue # Sessione già in memoria (più aggiornata del checkpoint)
+        try:
+            cache = _load_session(directory, meta)
+        except Exception as e:
+            logger.warning(f"MAP CHECKPOINT: Impossibile ricaricare {directory}: {e}")
+            continue
+
+        with state._map_sessions_lock:
+            state.MAP_SESSIONS[cache['KEY']] = cache
+            state.MAP_SESSIONS.move_to_end(cache['KEY'])
+            state.GLOBAL_MAP_CACHE = cache
+
+        # Con le griglie ricaricate la grigliatura costruisce solo la piramide
+        result = map_gridding.perform_gridding(cache) if len(cache['POINTS']) else None
+        if result:
+            cache['LATEST_RESULT'] = result
+            latest_result = result
+        state.enforce_map_memory_budget()
+
+    if latest_result:
+        update_bokeh_plot(latest_result) # Il viewer riparte dall'ultima mappa
+    if state.MAP_SESSIONS:
+        logger.info(f"MAP CHECKPOINT: {len(state.MAP_SESSIONS)} sessioni ricaricate in {time.time() - start:.3f} s.")
+    return latest_result
@@ -3,95 +3,560 @@
 import numpy as np
 import state # Per accedere a GLOBAL_MAP_CACHE e GLOBAL_HPBW_ARCSEC
 import math
+import logging_setup
 
-from typing import Dict, Tuple
+from functools import lru_cache
+from typing import Dict, List, Optional, Tuple
+
+logger = logging_setup.get_logger(__name__)
 
 # Costante per conversione: 1 secondo d'arco = 1/3600 gradi
 ARCSEC_TO_DEG = 1.0 / 3600.0
 
-def perform_gridding() -> Dict[str, np.ndarray]:
+# Padding applicato quando la griglia deve crescere: frazione dell'estensione attuale
+# (con un minimo in celle). Cos� la griglia viene riallocata raramente mentre la mappa si allarga.
+GRID_PADDING_FRACTION = 0.25
+GRID_MIN_PADDING_CELLS = 8
+
+POLARIZATION_KEYS = ['Pol0', 'Pol1']
+
+# Modalit� di grigliatura:
+# - 'binning':     media dei punti nella cella (nearest-cell), passo HPBW / 2
+# - 'convolution': convoluzione con kernel gaussiano troncato, passo HPBW / 3
+GRIDDING_MODE = 'binning'
+
+# Parametri della grigliatura a convoluzione
+CONV_CELL_HPBW_FRACTION = 1.0 / 3.0  # Passo griglia in unit� di HPBW
+CONV_KERNEL_FWHM_HPBW = 0.5          # FWHM del kernel gaussiano in unit� di HPBW
+CONV_TRUNCATION_CELLS = 3            # Raggio di troncamento del kernel in celle
+CONV_MIN_WEIGHT = 0.05               # Peso minimo per considerare una cella campionata
+CONV_CHUNK_POINTS = 200_000          # Punti elaborati per blocco (limita la memoria temporanea)
+
+# Piramide multi-risoluzione della mappa (livello 0 = risoluzione piena, ogni livello
+# successivo media blocchi 2x2 del precedente) usata dal viewer Bokeh per inviare al
+# browser solo il livello e il riquadro (tile) adatti al viewport corrente.
+PYRAMID_MIN_SIZE = 64         # Ci si ferma quando il lato maggiore scende sotto questa soglia
+TILE_MARGIN_FRACTION = 0.25   # Margine del tile attorno al viewport (pan senza nuove richieste)
+
+# Riempimento dei buchi (celle non campionate) con convoluzione normalizzata via FFT:
+# mappa riempita = (K * somma) / (K * conteggio), applicata solo alle celle vuote.
+HOLE_FILL_RADIUS_HPBW = 1.0          # Raggio massimo di riempimento in unit� di HPBW (0 = disabilitato)
+HOLE_FILL_KERNEL_FWHM_HPBW = 0.5     # FWHM del kernel gaussiano in unit� di HPBW
+HOLE_FILL_MIN_WEIGHT = 1e-3          # Peso convoluto minimo per riempire una cella
+HOLE_FILL_CACHE_KERNELS = True       # Conserva gli spettri dei kernel per forma della griglia
+
+
+def _cell_index(values: np.ndarray, step_deg: float) -> np.ndarray:
+    """Indice assoluto di cella (origine a 0 gradi) per ciascun valore."""
+    # La nuvola � in float32: il calcolo dell'indice viene fatto in float64
+    return np.floor(values.astype(np.float64) / step_deg).astype(np.int64)
+
+
+def set_gridding_mode(mode: str) -> None:
+    """Seleziona la modalit� di grigliatura ('binning' o 'convolution')."""
+    global GRIDDING_MODE
+    if mode not in ('binning', 'convolution'):
+        raise ValueError(f"Modalit� di grigliatura non valida: {mode}")
+    GRIDDING_MODE = mode
+    logger.info(f"Modalit� di grigliatura impostata a '{mode}'.")
+
+
+def set_hole_filling(radius_hpbw: float, cache_kernels: bool = True) -> None:
+    """Imposta il raggio massimo di riempimento dei buchi (0 = disabilitato) e la cache degli spettri."""
+    global HOLE_FILL_RADIUS_HPBW, HOLE_FILL_CACHE_KERNELS
+    if radius_hpbw < 0:
+        raise ValueError(f"Raggio di riempimento non valido: {radius_hpbw}")
+    HOLE_FILL_RADIUS_HPBW = float(radius_hpbw)
+    HOLE_FILL_CACHE_KERNELS = bool(cache_kernels)
+    if not HOLE_FILL_CACHE_KERNELS:
+        _cached_kernel_spectrum.cache_clear()
+    logger.info(f"Riempimento buchi: raggio {HOLE_FILL_RADIUS_HPBW:.2f} HPBW (cache kernel: {HOLE_FILL_CACHE_KERNELS}).")
+
+
+def _grid_step_deg(hpbw_arcsec: float, mode: str) -> float:
+    """Passo della griglia in gradi per la modalit� richiesta."""
+    fraction = CONV_CELL_HPBW_FRACTION if mode == 'convolution' else 0.5
+    return hpbw_arcsec * fraction * ARCSEC_TO_DEG
+
+
+@lru_cache(maxsize=8)
+def _kernel_offsets(truncation_cells: int) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Offset (dx, dy) delle celle vicine, rispetto alla cella del punto, che possono ricevere
+    peso dal kernel. Precalcolati una sola volta per raggio di troncamento.
+    """
+    r = truncation_cells + 1 # +1: il punto pu� trovarsi ovunque nella propria cella
+    dy, dx = np.mgrid[-r:r + 1, -r:r + 1]
+    keep = (np.abs(dx) - 0.5) ** 2 + (np.abs(dy) - 0.5) ** 2 <= truncation_cells ** 2
+    return dx[keep].astype(np.int64), dy[keep].astype(np.int64)
+
+
+def _scatter_add(target: np.ndarray, flat_index: np.ndarray, values: np.ndarray) -> None:
+    """
+    Somma vettorizzata (scatter-add) di values nelle celle flat_index della griglia 2D target.
+    Per blocchi grandi rispetto alla griglia np.bincount � pi� veloce di np.add.at.
+    """
+    flat_target = target.reshape(-1) # view: le griglie sono contigue
+    if flat_index.size * 4 >= flat_target.size:
+        flat_target += np.bincount(flat_index, weights=values, minlength=flat_target.size)
+    else:
+        np.add.at(flat_target, flat_index, values)
+
+
+def _padded_range(i_min: int, i_max: int) -> Tuple[int, int]:
+    """Intervallo di celle [start, stop) che contiene [i_min, i_max] pi� il padding."""
+    pad = max(GRID_MIN_PADDING_CELLS, int(math.ceil((i_max - i_min + 1) * GRID_PADDING_FRACTION)))
+    return i_min - pad, i_max + pad + 1
+
+
+def _new_grid_state(step_deg: float, mode: str, ix_min: int, ix_max: int, iy_min: int, iy_max: int) -> Dict:
+    """
+    Crea una griglia vuota (somma e conteggio per Pol0/Pol1) che copre gli indici di cella
+    richiesti pi� il padding. Le celle sono allineate a multipli di step_deg, quindi
+    una crescita successiva non richiede di ri-binnare i punti gi� grigliati.
+    """
+    ix0, ix1 = _padded_range(ix_min, ix_max)
+    iy0, iy1 = _padded_range(iy_min, iy_max)
+    grid = {
+        'step_deg': step_deg,
+        'mode': mode,
+        'ix0': ix0, 'iy0': iy0, # Indice assoluto della prima colonna/riga
+        'nx': ix1 - ix0, 'ny': iy1 - iy0,
+    }
+    for pol_key in POLARIZATION_KEYS:
+        grid[pol_key] = {
+            'sum': np.zeros((grid['ny'], grid['nx']), dtype=np.float64),
+            'count': np.zeros((grid['ny'], grid['nx']), dtype=np.float64), # In 'convolution': somma dei pesi
+            'n_gridded': 0 # Numero di punti della nuvola gi� sommati nella griglia
+        }
+    return grid
+
+
+def _grow_grid(grid: Dict, ix_min: int, ix_max: int, iy_min: int, iy_max: int) -> None:
+    """
+    Allarga la griglia (con padding) se i nuovi limiti escono dall'estensione attuale.
+    Le griglie esistenti vengono copiate con un offset intero: nessun ri-binning.
+    """
+    cur_ix0, cur_iy0 = grid['ix0'], grid['iy0']
+    cur_ix1, cur_iy1 = cur_ix0 + grid['nx'], cur_iy0 + grid['ny']
+
+    if ix_min >= cur_ix0 and ix_max < cur_ix1 and iy_min >= cur_iy0 and iy_max < cur_iy1:
+        return # I limiti sono gi� contenuti nella griglia
+
+    new_ix0, new_ix1 = _padded_range(min(ix_min, cur_ix0), max(ix_max, cur_ix1 - 1))
+    new_iy0, new_iy1 = _padded_range(min(iy_min, cur_iy0), max(iy_max, cur_iy1 - 1))
+    nx, ny = new_ix1 - new_ix0, new_iy1 - new_iy0
+    off_x, off_y = cur_ix0 - new_ix0, cur_iy0 - new_iy0
+
+    for pol_key in POLARIZATION_KEYS:
+        for name in ('sum', 'count'):
+            old = grid[pol_key][name]
+            new = np.zeros((ny, nx), dtype=old.dtype)
+            new[off_y:off_y + old.shape[0], off_x:off_x + old.shape[1]] = old
+            grid[pol_key][name] = new
+
+    grid.update({'ix0': new_ix0, 'iy0': new_iy0, 'nx': nx, 'ny': ny})
+    logger.info(f"Griglia estesa a {nx} x {ny} celle (padding incluso).")
+
+
+def _bin_points(grid: Dict, pol_grid: Dict, ra: np.ndarray, dec: np.ndarray, p: np.ndarray) -> None:
+    """Binning nearest-cell: ogni punto contribuisce solo alla propria cella."""
+    ix = _cell_index(ra, grid['step_deg'])
+    iy = _cell_index(dec, grid['step_deg'])
+    if ix.size == 0:
+        return
+    # I limiti globali possono essere aggiornati dopo l'append dei punti:
+    # ci assicuriamo che la griglia contenga comunque i nuovi campioni.
+    _grow_grid(grid, int(ix.min()), int(ix.max()), int(iy.min()), int(iy.max()))
+    ix -= grid['ix0']
+    iy -= grid['iy0']
+
+    # N.B.: le griglie sono indicizzate (Y, X) cio� (DEC, RA), come in np.histogram2d
+    np.add.at(pol_grid['sum'], (iy, ix), p)
+    np.add.at(pol_grid['count'], (iy, ix), 1.0)
+
+
+def _convolve_points(grid: Dict, pol_grid: Dict, ra: np.ndarray, dec: np.ndarray, p: np.ndarray) -> None:
+    """
+    Grigliatura a convoluzione: ogni punto distribuisce P * w e w sulle celle entro il raggio
+    di troncamento, con w gaussiano nella distanza punto-centro cella. Il calcolo �
+    vettorizzato su (punti x offset del kernel) con un unico scatter-add per griglia.
+    """
+    step = grid['step_deg']
+    x = ra.astype(np.float64) / step
+    y = dec.astype(np.float64) / step
+    ix = np.floor(x).astype(np.int64)
+    iy = np.floor(y).astype(np.int64)
+    if ix.size == 0:
+        return
+
+    r = CONV_TRUNCATION_CELLS + 1
+    _grow_grid(grid, int(ix.min()) - r, int(ix.max()) + r, int(iy.min()) - r, int(iy.max()) + r)
+
+    dx, dy = _kernel_offsets(CONV_TRUNCATION_CELLS)
+    sigma_cells = (CONV_KERNEL_FWHM_HPBW / CONV_CELL_HPBW_FRACTION) / (2.0 * math.sqrt(2.0 * math.log(2.0)))
+
+    # Distanza (in celle) tra il punto e il centro di ciascuna cella vicina: shape (n, K)
+    dist_x = (ix[:, None] + dx[None, :] + 0.5) - x[:, None]
+    dist_y = (iy[:, None] + dy[None, :] + 0.5) - y[:, None]
+    r2 = dist_x ** 2 + dist_y ** 2
+    weights = np.exp(-0.5 * r2 / sigma_cells ** 2)
+    weights[r2 > CONV_TRUNCATION_CELLS ** 2] = 0.0
+
+    flat = ((iy[:, None] + dy[None, :] - grid['iy0']) * grid['nx']
+            + (ix[:, None] + dx[None, :] - grid['ix0'])).ravel()
+
+    _scatter_add(pol_grid['sum'], flat, (weights * p[:, None]).ravel())
+    _scatter_add(pol_grid['count'], flat, weights.ravel())
+
+
+def _accumulate_new_points(grid: Dict, pol_key: str, cache: Dict) -> Tuple[int, Optional[Tuple[int, int, int, int]]]:
+    """
+    Aggiunge alle griglie somma/conteggio SOLO i punti arrivati dopo l'ultima grigliatura.
+    Costo O(nuovi punti). Ritorna il numero di punti aggiunti e gli indici assoluti di cella
+    (ix_min, ix_max, iy_min, iy_max) dei nuovi campioni validi, o None se non ce ne sono.
+    """
+    pol_grid = grid[pol_key]
+
+    # La nuvola pu� essere aggiornata da un altro thread: consideriamo solo il prefisso
+    # in cui RA, DEC e P hanno gi� tutti la stessa lunghezza.
+    n_total = min(cache['RA'].size, cache['DEC'].size, cache['P'].size)
+    start = pol_grid['n_gridded']
+    if n_total <= start:
+        return 0, None
+
+    ra_new = cache['RA'][start:n_total]
+    dec_new = cache['DEC'][start:n_total]
+    p_new = cache['P'][start:n_total]
+
+    # Scarta i campioni non finiti (es. righe interamente NaN)
+    valid = np.isfinite(ra_new) & np.isfinite(dec_new) & np.isfinite(p_new)
+
+    ra_new, dec_new, p_new = ra_new[valid], dec_new[valid], p_new[valid]
+
+    bbox = None
+    if p_new.size > 0:
+        ix = _cell_index(np.array([ra_new.min(), ra_new.max()]), grid['step_deg'])
+        iy = _cell_index(np.array([dec_new.min(), dec_new.max()]), grid['step_deg'])
+        bbox = (int(ix[0]), int(ix[1]), int(iy[0]), int(iy[1]))
+
+    if grid['mode'] == 'convolution':
+        for i in range(0, p_new.size, CONV_CHUNK_POINTS):
+            chunk = slice(i, i + CONV_CHUNK_POINTS)
+            _convolve_points(grid, pol_grid, ra_new[chunk], dec_new[chunk], p_new[chunk])
+    else:
+        _bin_points(grid, pol_grid, ra_new, dec_new, p_new)
+
+    pol_grid['n_gridded'] = n_total
+    return n_total - start, bbox
+
+
+def _dirty_window(bboxes: List[Tuple[int, int, int, int]], ix_min: int, iy_min: int, n_cols: int, n_rows: int,
+                  margin_cells: int) -> Tuple[int, int, int, int]:
+    """
+    Unione dei riquadri di cella (assoluti) toccati dai nuovi campioni, allargata di margin_cells
+    e riportata alla finestra della mappa: (r0, r1, c0, c1), vuota se non ci sono nuovi campioni.
+    """
+    if not bboxes:
+        return (0, 0, 0, 0)
+    c0 = min(b[0] for b in bboxes) - margin_cells - ix_min
+    c1 = max(b[1] for b in bboxes) + margin_cells - ix_min + 1
+    r0 = min(b[2] for b in bboxes) - margin_cells - iy_min
+    r1 = max(b[3] for b in bboxes) + margin_cells - iy_min + 1
+    return (max(r0, 0), min(r1, n_rows), max(c0, 0), min(c1, n_cols))
+
+
+def _fft_size(n: int) -> int:
+    """Lunghezza >= n scomponibile in fattori 2, 3 e 5 (veloce per la FFT)."""
+    while True:
+        m = n
+        for factor in (2, 3, 5):
+            while m % factor == 0:
+                m //= factor
+        if m == 1:
+            return n
+        n += 1
+
+
+def _kernel_spectrum(fft_shape: Tuple[int, int], radius_cells: int, sigma_cells: float) -> np.ndarray:
+    """Spettro (rfft2) del kernel gaussiano troncato a radius_cells, centrato nell'origine."""
+    r = np.arange(-radius_cells, radius_cells + 1)
+    dy, dx = np.meshgrid(r, r, indexing='ij')
+    d2 = dx ** 2 + dy ** 2
+    kernel = np.where(d2 <= radius_cells ** 2, np.exp(-0.5 * d2 / sigma_cells ** 2), 0.0)
+    # Il centro del kernel va in (0, 0) con wrap-around: la convoluzione non introduce traslazioni
+    padded = np.zeros(fft_shape, dtype=np.float64)
+    padded[:kernel.shape[0], :kernel.shape[1]] = kernel
+    padded = np.roll(padded, (-radius_cells, -radius_cells), axis=(0, 1))
+    return np.fft.rfft2(padded)
+
+
+_cached_kernel_spectrum = lru_cache(maxsize=8)(_kernel_spectrum)
+
+
+def fill_holes(sums: List[np.ndarray], counts: List[np.ndarray], radius_cells: int, sigma_cells: float,
+               min_count: float = 0.0) -> Tuple[List[np.ndarray], List[np.ndarray], List[np.ndarray]]:
+    """
+    Riempie le celle vuote (count <= min_count) con la convoluzione normalizzata
+    (K * somma) / (K * conteggio), dove K � un kernel gaussiano troncato a radius_cells:
+    una cella viene riempita solo se ci sono celle campionate entro quel raggio.
+    Tutte le griglie (somma e conteggio di ogni polarizzazione) sono trasformate con un'unica
+    rfft2 su pi� assi, con padding lineare (nessun wrap-around), costo O(N log N).
+
+    Ritorna (somme, conteggi, maschere): nelle celle riempite somma e conteggio sono quelli
+    convoluti, cos� la media e la piramide restano coerenti; le celle campionate sono invariate.
+    """
+    ny, nx = sums[0].shape
+    # ny + radius_cells evita il wrap-around; almeno 2 * radius_cells + 1 per contenere il kernel (mappe strette)
+    fft_shape = tuple(_fft_size(max(n + radius_cells, 2 * radius_cells + 1)) for n in (ny, nx))
+    spectrum_fn = _cached_kernel_spectrum if HOLE_FILL_CACHE_KERNELS else _kernel_spectrum
+    kernel_spectrum = spectrum_fn(fft_shape, radius_cells, round(sigma_cells, 6))
+
+    stack = np.stack(list(sums) + list(counts)) # (2 * polarizzazioni, ny, nx)
+    convolved = np.fft.irfft2(np.fft.rfft2(stack, s=fft_shape) * kernel_spectrum, s=fft_shape)[:, :ny, :nx]
+    n = len(sums)
+
+    filled_sums, filled_counts, masks = [], [], []
+    for k in range(n):
+        conv_sum, conv_count = convolved[k], convolved[n + k]
+        mask = (counts[k] <= min_count) & (conv_count > max(HOLE_FILL_MIN_WEIGHT, min_count))
+        filled_sums.append(np.where(mask, conv_sum, sums[k]))
+        filled_counts.append(np.where(mask, conv_count, counts[k]))
+        masks.append(mask)
+    return filled_sums, filled_counts, masks
+
+
+def _block_sum_2x2(a: np.ndarray) -> np.ndarray:
+    """Somma su blocchi 2x2 (le dimensioni dispari vengono completate con zeri)."""
+    ny, nx = a.shape
+    padded = np.zeros((ny + ny % 2, nx + nx % 2), dtype=a.dtype)
+    padded[:ny, :nx] = a
+    return padded[0::2, 0::2] + padded[1::2, 0::2] + padded[0::2, 1::2] + padded[1::2, 1::2]
+
+
+def build_map_pyramid(Z_sum: np.ndarray, N_count: np.ndarray, min_count: float = 0.0) -> List[np.ndarray]:
     """
-    Esegue la grigliatura 2D dei punti accumulati per entrambe le polarizzazioni 
-    (Pol0 e Pol1) utilizzando la media spaziale (binning).
+    Costruisce la piramide delle mappe medie a partire dalle griglie somma e conteggio.
+    Ogni livello � la media (somma / conteggio) su blocchi 2x2 del livello precedente,
+    quindi resta una media pesata corretta dei campioni originali.
+    """
+    levels = []
+    level_sum, level_count = Z_sum, N_count
+    while True:
+        levels.append(np.divide(
+            level_sum, level_count,
+            out=np.full(level_sum.shape, np.nan, dtype=np.float32),
+            where=level_count > min_count
+        ))
+        if max(level_sum.shape) <= PYRAMID_MIN_SIZE:
+            return levels
+        level_sum, level_count = _block_sum_2x2(level_sum), _block_sum_2x2(level_count)
+
 
-    La dimensione della cella della griglia � definita dinamicamente come HPBW / 2.
+def summarize_map_result(result_maps: Dict) -> Dict:
+    """
+    Riassunto compatto (serializzabile in JSON) di un risultato della grigliatura, per i client
+    Socket.IO: geometria, range colore e livello meno risoluto della piramide (NaN -> None).
+    Usato per il replay verso i client appena collegati, senza rileggere i file FITS.
+    """
+    summary = {
+        'session': list(result_maps.get('session_key') or ()),
+        'x0': result_maps['x0'], 'y0': result_maps['y0'], 'step_deg': result_maps['step_deg'],
+        'color_range': {pol_key: list(r) for pol_key, r in result_maps.get('color_range', {}).items()},
+        'preview': {},
+    }
+    for pol_key, levels in result_maps['pyramid'].items():
+        coarse = levels[-1]
+        summary['preview'][pol_key] = {
+            'level': len(levels) - 1,
+            'image': [[float(v) if math.isfinite(v) else None for v in row] for row in coarse.tolist()],
+        }
+    return summary
+
+
+def get_map_tile(result_maps: Dict, pol_key: str, x_start: float, x_end: float, y_start: float, y_end: float,
+                 max_width_px: int, max_height_px: int) -> Dict:
+    """
+    Restituisce il tile della piramide che corrisponde al viewport [x_start, x_end] x [y_start, y_end]:
+    il livello � il pi� fine per cui il viewport contiene al massimo max_width_px x max_height_px celle.
+    La dimensione del tile dipende solo dal viewport, non dall'estensione della mappa.
+
+    Ritorna un dizionario con 'image', 'x', 'y', 'dw', 'dh' (formato ImageRenderer di Bokeh),
+    'level' e 'window' (righe/colonne del livello scelto).
+    """
+    levels = result_maps['pyramid'][pol_key]
+    step = result_maps['step_deg']
+    x0, y0 = result_maps['x0'], result_maps['y0']
+
+    # Viewport non ancora definito (es. documento appena creato): si mostra tutta la mappa
+    full_x_end = x0 + levels[0].shape[1] * step
+    full_y_end = y0 + levels[0].shape[0] * step
+    if any(v is None or not math.isfinite(v) for v in (x_start, x_end, y_start, y_end)) \
+            or x_end <= x_start or y_end <= y_start:
+        x_start, x_end, y_start, y_end = x0, full_x_end, y0, full_y_end
+
+    level = len(levels) - 1
+    for k in range(len(levels)):
+        cell = step * 2 ** k
+        if (x_end - x_start) / cell <= max_width_px and (y_end - y_start) / cell <= max_height_px:
+            level = k
+            break
+
+    image = levels[level]
+    cell = step * 2 ** level
+    margin_x = (x_end - x_start) * TILE_MARGIN_FRACTION
+    margin_y = (y_end - y_start) * TILE_MARGIN_FRACTION
+
+    n_rows, n_cols = image.shape
+    c0 = min(max(int(math.floor((x_start - margin_x - x0) / cell)), 0), n_cols)
+    c1 = min(max(int(math.ceil((x_end + margin_x - x0) / cell)), 0), n_cols)
+    r0 = min(max(int(math.floor((y_start - margin_y - y0) / cell)), 0), n_rows)
+    r1 = min(max(int(math.ceil((y_end + margin_y - y0) / cell)), 0), n_rows)
+
+    if c1 <= c0 or r1 <= r0:
+        # Viewport fuori dalla mappa: tile vuoto (1x1 NaN)
+        return {'image': np.full((1, 1), np.nan, dtype=np.float32), 'x': x_start, 'y': y_start,
+                'dw': cell, 'dh': cell, 'level': level, 'window': (0, 0, 0, 0)}
+
+    return {
+        'image': np.array(image[r0:r1, c0:c1]), # Copia: il viewer la aggiorna in place con patch()
+        'x': x0 + c0 * cell,
+        'y': y0 + r0 * cell,
+        'dw': (c1 - c0) * cell,
+        'dh': (r1 - r0) * cell,
+        'level': level,
+        'window': (r0, r1, c0, c1),
+    }
+
+
+def perform_gridding(map_cache: Optional[Dict] = None) -> Dict[str, np.ndarray]:
+    """
+    Esegue la grigliatura 2D dei punti accumulati per entrambe le polarizzazioni
+    (Pol0 e Pol1) utilizzando la media spaziale (binning) oppure, con
+    GRIDDING_MODE = 'convolution', una convoluzione con kernel gaussiano troncato.
+
+    Parametri:
+    - map_cache: La sessione di mappa da grigliare (default: la sessione attiva, state.GLOBAL_MAP_CACHE).
+
+    La grigliatura � incrementale: le griglie somma e conteggio sono mantenute in
+    map_cache['GRID'] e ad ogni chiamata vengono aggiunti solo i punti della
+    nuova strisciata. La griglia viene ri-binnata da zero solo se cambia il passo
+    (HPBW); se cambiano i limiti viene estesa con padding.
+
+    La dimensione della cella della griglia � definita dinamicamente come HPBW / 2
+    (HPBW / 3 in modalit� 'convolution').
 
     Ritorna:
-    - Dict[str, np.ndarray]: Un dizionario contenente le mappe grigliate (Z_Pol0, Z_Pol1) 
-      e gli assi della griglia (RA_grid, DEC_grid).
+    - Dict[str, np.ndarray]: Un dizionario contenente le mappe grigliate (Z_Pol0, Z_Pol1),
+      gli assi della griglia (RA_grid, DEC_grid), la piramide multi-risoluzione per
+      polarizzazione ('pyramid') con la sua geometria (x0, y0, step_deg), il range colore
+      la maschera delle celle riempite per interpolazione ('filled_mask') e il riquadro
+      modificato rispetto al passaggio precedente ('dirty', None se va reinviata tutta la mappa).
     """
-    
+
     # 1. Controllo Preliminare e Recupero HPBW
-    cache_pol0 = state.GLOBAL_MAP_CACHE['Pol0']
-    
+    if map_cache is None:
+        map_cache = state.GLOBAL_MAP_CACHE # Sessione di mappa attiva
+    cache_pol0 = map_cache['Pol0']
+
     if cache_pol0['RA'].size == 0:
-        print("ATTENZIONE: La cache della mappa � vuota. Nessuna grigliatura da eseguire.")
+        logger.warning("ATTENZIONE: La cache della mappa � vuota. Nessuna grigliatura da eseguire.")
         return {}
 
-    hpbw_arcsec = state.GLOBAL_HPBW_ARCSEC
+    hpbw_arcsec = map_cache.get('HPBW_ARCSEC') or state.GLOBAL_HPBW_ARCSEC
     if hpbw_arcsec <= 0:
-        print("ERRORE: HPBW non � stato definito nello stato globale o � invalido.")
+        logger.error("ERRORE: HPBW non � stato definito nello stato globale o � invalido.")
         return {}
-        
-    # Calcolo del Passo della Griglia Ottimale (HPBW / 2) in gradi
-    grid_step_arcsec = hpbw_arcsec / 2.0
-    GRID_STEP_DEG = grid_step_arcsec * ARCSEC_TO_DEG
-    
-    print(f"HPBW: {hpbw_arcsec:.2f} arcsec. Passo Griglia: {GRID_STEP_DEG:.6f} gradi.")
 
-    output_maps = {}
-    polarization_keys = ['Pol0', 'Pol1']
+    # Calcolo del Passo della Griglia Ottimale (HPBW / 2, oppure HPBW / 3 in 'convolution') in gradi
+    mode = GRIDDING_MODE
+    GRID_STEP_DEG = _grid_step_deg(hpbw_arcsec, mode)
+
+    logger.info(f"HPBW: {hpbw_arcsec:.2f} arcsec. Passo Griglia: {GRID_STEP_DEG:.6f} gradi.")
+
+    output_maps = {'session_key': map_cache.get('KEY')}
 
     # 2. Definizione dell'Area della Griglia (Comune a entrambe le polarizzazioni)
     # Gli estremi del mosaico sono dati dai limiti globali accumulati
     RA_min, RA_max = cache_pol0['RA_min'], cache_pol0['RA_max']
     DEC_min, DEC_max = cache_pol0['DEC_min'], cache_pol0['DEC_max']
 
-    # Crea gli assi della griglia: np.arange include il minimo ed esclude il massimo
-    # Aggiungiamo GRID_STEP_DEG per assicurarci di includere l'estremo massimo
-    RA_grid = np.arange(RA_min, RA_max + GRID_STEP_DEG, GRID_STEP_DEG)
-    DEC_grid = np.arange(DEC_min, DEC_max + GRID_STEP_DEG, GRID_STEP_DEG)
+    ix_min, ix_max = int(math.floor(RA_min / GRID_STEP_DEG)), int(math.floor(RA_max / GRID_STEP_DEG))
+    iy_min, iy_max = int(math.floor(DEC_min / GRID_STEP_DEG)), int(math.floor(DEC_max / GRID_STEP_DEG))
+
+    grid = map_cache.get('GRID')
+    rebuilt = grid is None or grid['mode'] != mode or not math.isclose(grid['step_deg'], GRID_STEP_DEG, rel_tol=1e-9)
+    if rebuilt:
+        # Primo passaggio o cambio di HPBW/modalit�: si ricostruisce la griglia e si ri-binnano tutti i punti
+        logger.info(f"Griglia (ri)creata in modalit� '{mode}': ri-grigliatura completa della nuvola di punti.")
+        grid = _new_grid_state(GRID_STEP_DEG, mode, ix_min, ix_max, iy_min, iy_max)
+        map_cache['GRID'] = grid
+    else:
+        _grow_grid(grid, ix_min, ix_max, iy_min, iy_max)
+
+    # 3. Grigliatura 2D incrementale (Binning) per ciascuna Polarizzazione
+    accumulated = {pol_key: _accumulate_new_points(grid, pol_key, map_cache[pol_key]) for pol_key in POLARIZATION_KEYS}
+    n_added = {pol_key: n for pol_key, (n, _) in accumulated.items()}
+
+    # Finestra della griglia (padding escluso) che copre i dati accumulati
+    col0, col1 = ix_min - grid['ix0'], ix_max - grid['ix0'] + 1
+    row0, row1 = iy_min - grid['iy0'], iy_max - grid['iy0'] + 1
+
+    # Assi della griglia (bordi delle celle), come quelli passati a np.histogram2d
+    RA_grid = (np.arange(ix_min, ix_max + 2)) * GRID_STEP_DEG
+    DEC_grid = (np.arange(iy_min, iy_max + 2)) * GRID_STEP_DEG
 
     output_maps['RA_grid'] = RA_grid
     output_maps['DEC_grid'] = DEC_grid
-    print(f"Griglia Definita: {len(RA_grid)} x {len(DEC_grid)} celle.")
-
-    # 3. Iterazione e Grigliatura per ciascuna Polarizzazione
-    for pol_key in polarization_keys:
-        cache = state.GLOBAL_MAP_CACHE[pol_key]
-        
-        RA_points = cache['RA']
-        DEC_points = cache['DEC']
-        P_points = cache['P']
-        
-        # --- Grigliatura 2D (Binning) ---
-        
-        # 3.1. Calcolo della Somma delle Potenze (Z_sum)
-        # N.B.: np.histogram2d richiede gli assi (Y, X) quindi (DEC, RA)
-        Z_sum, _, _ = np.histogram2d(
-            DEC_points, RA_points, 
-            bins=[DEC_grid, RA_grid], 
-            weights=P_points
-        )
-        
-        # 3.2. Calcolo del Conteggio dei Punti (N_count)
-        N_count, _, _ = np.histogram2d(
-            DEC_points, RA_points, 
-            bins=[DEC_grid, RA_grid] 
-        )
-        
-        # 3.3. Calcolo della Media (Z_map = Z_sum / N_count)
-        # np.divide gestisce la divisione per zero (se N_count=0, imposta a NaN), 
-        # lasciando i buchi (punti non campionati) nella mappa.
+    # Geometria comune alla piramide: bordo inferiore sinistro e passo del livello 0
+    output_maps['x0'] = float(RA_grid[0])
+    output_maps['y0'] = float(DEC_grid[0])
+    output_maps['step_deg'] = GRID_STEP_DEG
+    output_maps['pyramid'] = {}
+    output_maps['color_range'] = {}
+    output_maps['filled_mask'] = {}
+    logger.info(f"Griglia Definita: {len(RA_grid)} x {len(DEC_grid)} celle.")
+
+    # In 'convolution' N_count � la somma dei pesi: le celle con peso trascurabile restano buchi.
+    min_count = CONV_MIN_WEIGHT if mode == 'convolution' else 0.0
+    sums = [grid[pol_key]['sum'][row0:row1, col0:col1] for pol_key in POLARIZATION_KEYS]
+    counts = [grid[pol_key]['count'][row0:row1, col0:col1] for pol_key in POLARIZATION_KEYS]
+    masks = [np.zeros(c.shape, dtype=bool) for c in counts]
+
+    # 4. Riempimento dei Buchi (Hole Filling): convoluzione normalizzata via FFT, entro un raggio in HPBW
+    radius_cells = int(math.floor(HOLE_FILL_RADIUS_HPBW * hpbw_arcsec * ARCSEC_TO_DEG / GRID_STEP_DEG))
+    if radius_cells >= 1 and any((c <= min_count).any() for c in counts):
+        sigma_cells = HOLE_FILL_KERNEL_FWHM_HPBW * hpbw_arcsec * ARCSEC_TO_DEG / GRID_STEP_DEG / 2.3548
+        sums, counts, masks = fill_holes(sums, counts, radius_cells, sigma_cells, min_count)
+        logger.info(f"Riempimento buchi: {sum(int(m.sum()) for m in masks)} celle riempite (raggio {radius_cells} celle).")
+
+    # Riquadro (righe/colonne del livello 0, finestra senza padding) modificato da questo passaggio:
+    # i nuovi campioni pi� il raggio del kernel e del riempimento. None = mappa da reinviare per intero.
+    output_maps['dirty'] = None if rebuilt else _dirty_window(
+        [bbox for _, bbox in accumulated.values() if bbox is not None],
+        ix_min, iy_min, len(RA_grid) - 1, len(DEC_grid) - 1,
+        (CONV_TRUNCATION_CELLS + 1 if mode == 'convolution' else 0) + max(radius_cells, 0))
+
+    # 5. Calcolo della mappa media per ciascuna Polarizzazione
+    for pol_key, Z_sum, N_count, filled_mask in zip(POLARIZATION_KEYS, sums, counts, masks):
+
+        # 5.1. Calcolo della Media (Z_map = Z_sum / N_count)
+        # np.divide gestisce la divisione per zero (se N_count=0, imposta a NaN),
+        # lasciando i buchi non riempiti (punti non campionati lontani dai dati) nella mappa.
         Z_map = np.divide(
-            Z_sum, N_count, 
+            Z_sum, N_count,
             out=np.full_like(Z_sum, np.nan), # Se N_count=0, il risultato � NaN
-            where=N_count!=0
+            where=N_count > min_count
         )
-        
-        print(f"Mappa {pol_key} creata con shape {Z_map.shape}. Punti mediati: {np.sum(N_count)}.")
+
+        logger.info(f"Mappa {pol_key} creata con shape {Z_map.shape}. Nuovi punti: {n_added[pol_key]}. Punti mediati: {np.sum(N_count[~filled_mask])}.")
         output_maps[f'Z_{pol_key}'] = Z_map
-    
-    # 4. Interpolazione/Riempimento Buco (Hole Filling) - Logicabile qui in seguito.
+        output_maps['filled_mask'][pol_key] = filled_mask # True = cella interpolata, non campionata
+
+        # 5.2. Piramide multi-risoluzione e range colore (per il viewer Bokeh)
+        output_maps['pyramid'][pol_key] = build_map_pyramid(Z_sum, N_count, min_count)
+        finite = Z_map[np.isfinite(Z_map)]
+        if finite.size > 0:
+            output_maps['color_range'][pol_key] = (float(finite.min()), float(finite.max()))
 
-    return output_maps
\ No newline at end of file
+    return output_maps
@@ -0,0 +1,172 @@
+# metrics.py
+
+import bisect
+import math
+import threading
+import time
+
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterator, List, Tuple
+
+# --------------------------------------------------------
+# METRICHE DELLA PIPELINE (formato testo Prometheus, endpoint /metrics di app.py)
+# --------------------------------------------------------
+# Istogrammi di latenza per fase, contatori (file elaborati/scartati, byte letti) e
+# profondità delle code (gauge calcolati al momento della lettura). Nessuna dipendenza:
+# il formato di esposizione Prometheus 0.0.4 è scritto direttamente.
+# In modalità distribuita (processing_worker.py) i worker inviano dopo ogni file una copia
+# delle proprie metriche al web tier, che le espone con l'etichetta worker="<nome>".
+
+STAGES = ('detection', 'stabilization_wait', 'fits_read', 'reduction',
+          'nodding_pairing', 'plot_build', 'html_write', 'emit', 'gridding')
+
+# Limiti superiori dei bucket in secondi (da millisecondi ai tempi di attesa dei file)
+LATENCY_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0)
+
+STAGE_LATENCY = 'quicklook_stage_latency_seconds'
+FILES_PROCESSED = 'quicklook_files_processed_total'
+FILES_DROPPED = 'quicklook_files_dropped_total'
+BYTES_READ = 'quicklook_bytes_read_total'
+QUEUE_DEPTH = 'quicklook_queue_depth'
+LOG_RECORDS_DROPPED = 'quicklook_log_records_dropped_total'
+
+_HELP = {
+    STAGE_LATENCY: ('histogram', 'Latency of each pipeline stage in seconds.'),
+    FILES_PROCESSED: ('counter', 'FITS files processed, by result.'),
+    FILES_DROPPED: ('counter', 'FITS files dropped, by reason.'),
+    BYTES_READ: ('counter', 'Bytes of FITS files read.'),
+    QUEUE_DEPTH: ('gauge', 'Items waiting in each queue.'),
+    LOG_RECORDS_DROPPED: ('counter', 'Log records dropped because the log queue was full.'),
+}
+
+Labels = Tuple[Tuple[str, str], ...]
+
+_lock = threading.Lock()
+_histograms: Dict[Tuple[str, Labels], List] = {}  # (nome, etichette) -> [conteggi per bucket, somma, conteggio]
+_counters: Dict[Tuple[str, Labels], float] = {}
+_gauges: Dict[Tuple[str, Labels], Callable[[], float]] = {}
+_remote: Dict[str, Dict] = {}                     # nome del worker -> ultima copia ricevuta
+
+
+def _labels(**labels) -> Labels:
+    return tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+def observe(name: str, seconds: float, **labels) -> None:
+    """Registra un valore nell'istogramma indicato."""
+    key = (name, _labels(**labels))
+    index = bisect.bisect_left(LATENCY_BUCKETS, seconds)
+    with _lock:
+        histogram = _histograms.get(key)
+        if histogram is None:
+            histogram = _histograms[key] = [[0] * (len(LATENCY_BUCKETS) + 1), 0.0, 0]
+        histogram[0][index] += 1
+        histogram[1] += seconds
+        histogram[2] += 1
+
+
+def observe_stage(stage: str, seconds: float) -> None:
+    """Latenza di una fase della pipeline (uno dei valori di STAGES)."""
+    observe(STAGE_LATENCY, seconds, stage=stage)
+
+
+@contextmanager
+def stage_timer(stage: str) -> Iterator[None]:
+    """Misura la durata del blocco come latenza della fase indicata (anche se solleva un'eccezione)."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe_stage(stage, time.perf_counter() - start)
+
+
+def inc(name: str, amount: float = 1.0, **labels) -> None:
+    key = (name, _labels(**labels))
+    with _lock:
+        _counters[key] = _counters.get(key, 0.0) + amount
+
+
+def file_processed(result: str) -> None:
+    inc(FILES_PROCESSED, result=result)
+
+
+def file_dropped(reason: str) -> None:
+    inc(FILES_DROPPED, reason=reason)
+
+
+def bytes_read(n_bytes: int) -> None:
+    inc(BYTES_READ, n_bytes)
+
+
+def register_gauge(name: str, read: Callable[[], float], **labels) -> None:
+    """Gauge letto al momento dell'esposizione (es. lunghezza di una coda)."""
+    with _lock:
+        _gauges[(name, _labels(**labels))] = read
+
+
+def register_queue_depth(queue_name: str, read: Callable[[], float]) -> None:
+    register_gauge(QUEUE_DEPTH, read, queue=queue_name)
+
+
+def snapshot() -> Dict:
+    """Copia serializzabile delle metriche di questo processo (gauge inclusi, già letti)."""
+    with _lock:
+        histograms = {key: [list(h[0]), h[1], h[2]] for key, h in _histograms.items()}
+        counters = dict(_counters)
+        gauges = dict(_gauges)
+    values = {}
+    for key, read in gauges.items():
+        try:
+            values[key] = float(read())
+        except Exception:
+            continue
+    return {'histograms': histograms, 'counters': counters, 'gauges': values}
+
+
+def merge_remote(worker: str, worker_snapshot: Dict) -> None:
+    """Conserva l'ultima copia delle metriche di un worker (i valori sono cumulativi)."""
+    with _lock:
+        _remote[worker] = worker_snapshot
+
+
+def _format_labels(labels: Labels, extra: Labels = ()) -> str:
+    items = labels + extra
+    if not items:
+        return ''
+    escaped = (v.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, v in items)
+    return '{' + ','.join(f'{k}="{v}"' for (k, _), v in zip(items, escaped)) + '}'
+
+
+def _format_value(value: float) -> str:
+    if math.isinf(value):
+        return '+Inf' if value > 0 else '-Inf'
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+
+def render() -> str:
+    """Metriche di questo processo e dei worker nel formato testo di Prometheus."""
+    sources: List[Tuple[Labels, Dict]] = [((), snapshot())]
+    with _lock:
+        sources += [((('worker', name),), snap) for name, snap in sorted(_remote.items())]
+
+    samples: Dict[str, List[str]] = {name: [] for name in _HELP}
+    for extra, snap in sources:
+        for (name, labels), (bucket_counts, total, count) in sorted(snap['histograms'].items()):
+            cumulative = 0
+            for bound, n in zip(LATENCY_BUCKETS + (math.inf,), bucket_counts):
+                cumulative += n
+                le = _format_labels(labels, extra + (('le', _format_value(bound)),))
+                samples.setdefault(name, []).append(f'{name}_bucket{le} {cumulative}')
+            samples[name].append(f'{name}_sum{_format_labels(labels, extra)} {_format_value(total)}')
+            samples[name].append(f'{name}_count{_format_labels(labels, extra)} {count}')
+        for kind in ('counters', 'gauges'):
+            for (name, labels), value in sorted(snap[kind].items()):
+                samples.setdefault(name, []).append(f'{name}{_format_labels(labels, extra)} {_format_value(value)}')
+
+    lines = []
+    for name, name_samples in samples.items():
+        metric_type, help_text = _HELP.get(name, ('untyped', name))
+        lines.append(f'# HELP {name} {help_text}')
+        lines.append(f'# TYPE {name} {metric_type}')
+        lines.extend(name_samples)
+    return '\n'.join(lines) + '\n'
@@ -1,8 +1,16 @@
 import threading
 import os
 import re
+import time
+
+import logging_setup
+import metrics
+import pipeline_trace
+
+logger = logging_setup.get_logger(__name__)
 
 _nodding_state = {} 
+_first_seen_at = {} # base_id -> istante di registrazione del primo file della coppia (traccia della pipeline)
 _state_lock = threading.Lock() 
 
 # Assumiamo che SKARAB Nodding sia sempre Dual-Feed (2 files).
@@ -11,6 +19,10 @@ _state_lock = threading.Lock()
 # Per ora, lo fissiamo a 2 (Dual Feed / Nodding).
 EXPECTED_FEED_COUNT = 2
 
+# Un file senza partner entro PAIR_TTL_S secondi (es. secondo feed mai scritto) viene scartato:
+# lo stato delle coppie non cresce durante le sessioni lunghe.
+PAIR_TTL_S = 600.0
+
 # Regex per estrarre l'ID di Accoppiamento e l'ID del Feed
 SKARAB_NODDING_PATTERN = re.compile(r"(.+)_FEED_(\d+)\.fits$", re.IGNORECASE)
 
@@ -28,6 +40,35 @@ SKARAB_NODDING_PATTERN = re.compile(r"(.+)_FEED_(\d+)\.fits$", re.IGNORECASE)
 
 
 
+def set_pair_ttl(seconds: float) -> None:
+    """Attesa massima del partner di un file di nodding, in secondi (chiamata da app.py)."""
+    global PAIR_TTL_S
+    PAIR_TTL_S = max(1.0, float(seconds))
+
+
+def pending_pair_count() -> int:
+    """Osservazioni in attesa del partner (esposto da metrics.py)."""
+    with _state_lock:
+        return len(_nodding_state)
+
+
+def expire_stale_pairs() -> None:
+    """Scarta le osservazioni in attesa del partner da più di PAIR_TTL_S."""
+    with _state_lock:
+        _expire_stale_pairs(time.time())
+
+
+def _expire_stale_pairs(now: float) -> None:
+    """Come expire_stale_pairs(), da chiamare con _state_lock acquisito."""
+    for base_id in [b for b, first_seen in _first_seen_at.items() if now - first_seen > PAIR_TTL_S]:
+        files = _nodding_state.pop(base_id, [])
+        del _first_seen_at[base_id]
+        for _ in files:
+            metrics.file_dropped('nodding_unpaired')
+        logger.warning(f"NODDING MANAGER: Nessun partner per {base_id} entro {PAIR_TTL_S:.0f} s. "
+                       f"Scartati {len(files)} file.")
+
+
 def check_and_pair_skarab_nodding(filepath):
     """
     Controlla se il file appartiene a un'osservazione SKARAB a Feed Multipli.
@@ -48,19 +89,22 @@ def check_and_pair_skarab_nodding(filepath):
     feed_index = int(match.group(2)) # L'indice del Feed (non usato per la logica di accoppiamento, solo per debug)
     
     with _state_lock:
-        
+
+        _expire_stale_pairs(time.time())
+
         # Inizializza la lista se l'ID di Osservazione � nuovo
         if base_id not in _nodding_state:
             _nodding_state[base_id] = []
+            _first_seen_at[base_id] = time.time()
 
         # 1. Controlla che il file non sia gi� stato registrato (utile per on_modified)
         if filepath in _nodding_state[base_id]:
-            print(f"NODDING MANAGER: {filename} gi� registrato. Ignorato l'evento duplicato.")
+            logger.info(f"NODDING MANAGER: {filename} gi� registrato. Ignorato l'evento duplicato.")
             return None
 
         # 2. Aggiungi il file alla lista dei file associati
         _nodding_state[base_id].append(filepath)
-        print(f"NODDING MANAGER: {filename} registrato (Feed: {feed_index}). Stato attuale per {base_id}: {len(_nodding_state[base_id])}/{EXPECTED_FEED_COUNT}")
+        logger.info(f"NODDING MANAGER: {filename} registrato (Feed: {feed_index}). Stato attuale per {base_id}: {len(_nodding_state[base_id])}/{EXPECTED_FEED_COUNT}")
         
         # 3. Verifica se l'accoppiamento � completo
         if len(_nodding_state[base_id]) == EXPECTED_FEED_COUNT:
@@ -70,8 +114,11 @@ def check_and_pair_skarab_nodding(filepath):
             
             # Pulisci lo stato
             del _nodding_state[base_id]
+            # Attesa del partner: dal primo file registrato al completamento della coppia
+            pipeline_trace.record_span('nodding_pairing', _first_seen_at.pop(base_id, time.time()), time.time(),
+                                       file_id=f"{base_id}_nodding_pair", files=len(coupled_files))
             
-            print(f"NODDING MANAGER: Accoppiamento completato per {base_id}. Pronti i file: {', '.join(os.path.basename(f) for f in coupled_files)}")
+            logger.info(f"NODDING MANAGER: Accoppiamento completato per {base_id}. Pronti i file: {', '.join(os.path.basename(f) for f in coupled_files)}")
             return coupled_files # Restituisce una tupla (file_A, file_B)
         
         else:
@@ -0,0 +1,147 @@
+# pipeline_trace.py
+
+import itertools
+import os
+import threading
+import time
+
+from collections import deque
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, List, Optional
+
+import metrics
+
+# --------------------------------------------------------
+# TRACCIA PER FILE DELLA PIPELINE (esportata come Chrome trace-event JSON)
+# --------------------------------------------------------
+# Ogni fase dell'elaborazione di un file registra uno span (file, fase, inizio, fine, thread,
+# byte) in un ring in memoria di dimensione fissa; la stessa durata alimenta gli istogrammi
+# di metrics.py. app.py espone il ring all'endpoint /trace: il JSON si apre direttamente in
+# chrome://tracing o in Perfetto (un processo per riga, un thread per traccia, il file negli args).
+#
+# Il file corrente è per thread: fits_watcher.py lo imposta con file_context() attorno
+# all'elaborazione, i thread dedicati (coppie di nodding) con set_current_file().
+
+TRACE_MAX_SPANS = 20000
+
+_spans: deque = deque(maxlen=TRACE_MAX_SPANS)
+_lock = threading.Lock()
+_sequence = itertools.count(1)
+_local = threading.local()
+_process_name = f'quicklook-{os.getpid()}'
+
+
+def configure(max_spans: int, process_name: Optional[str] = None) -> None:
+    """Dimensione del ring (gli span più vecchi vengono scartati) e nome del processo nella traccia."""
+    global _spans, TRACE_MAX_SPANS, _process_name
+    with _lock:
+        TRACE_MAX_SPANS = max(1, int(max_spans))
+        _spans = deque(_spans, maxlen=TRACE_MAX_SPANS)
+        if process_name:
+            _process_name = process_name
+
+
+def _file_id(path_or_id: Optional[str]) -> Optional[str]:
+    return os.path.basename(path_or_id) if path_or_id else None
+
+
+def set_current_file(path_or_id: Optional[str]) -> None:
+    """File a cui vengono attribuiti gli span registrati da questo thread (None = nessuno)."""
+    _local.file_id = _file_id(path_or_id)
+
+
+def current_file() -> Optional[str]:
+    return getattr(_local, 'file_id', None)
+
+
+@contextmanager
+def file_context(path_or_id: str) -> Iterator[None]:
+    """Attribuisce al file gli span registrati nel blocco da questo thread."""
+    previous = current_file()
+    set_current_file(path_or_id)
+    try:
+        yield
+    finally:
+        _local.file_id = previous
+
+
+def record_span(stage: str, start: float, end: float, file_id: Optional[str] = None,
+                n_bytes: Optional[int] = None, **args: Any) -> None:
+    """
+    Registra uno span già misurato (start/end in secondi epoch, come time.time()) e ne
+    aggiunge la durata all'istogramma della fase in metrics.py.
+    """
+    metrics.observe_stage(stage, max(0.0, end - start))
+    thread = threading.current_thread()
+    span = {
+        'seq': next(_sequence),
+        'file': _file_id(file_id) or current_file(),
+        'stage': stage,
+        'start': start,
+        'end': end,
+        'process': _process_name,
+        'thread': thread.name,
+        'tid': thread.ident,
+    }
+    if n_bytes is not None:
+        span['bytes'] = int(n_bytes)
+    if args:
+        span['args'] = args
+    with _lock:
+        _spans.append(span)
+
+
+@contextmanager
+def span(stage: str, file_id: Optional[str] = None, n_bytes: Optional[int] = None, **args: Any) -> Iterator[None]:
+    """Misura il blocco come span della fase indicata (registrato anche se solleva un'eccezione)."""
+    start = time.time()
+    try:
+        yield
+    finally:
+        record_span(stage, start, time.time(), file_id=file_id, n_bytes=n_bytes, **args)
+
+
+def spans_since(sequence: int = 0) -> List[Dict[str, Any]]:
+    """Span con numero di sequenza maggiore di sequence (per l'invio incrementale dai worker)."""
+    with _lock:
+        return [s for s in _spans if s['seq'] > sequence]
+
+
+def add_spans(spans: List[Dict[str, Any]]) -> None:
+    """Aggiunge al ring gli span ricevuti da un altro processo (worker di processing_worker.py)."""
+    with _lock:
+        for s in spans:
+            _spans.append(dict(s, seq=next(_sequence)))
+
+
+def chrome_trace(file_filter: Optional[str] = None, since: Optional[float] = None) -> Dict[str, Any]:
+    """
+    Span del ring nel formato Chrome trace-event ('X' = evento completo, tempi in microsecondi).
+    file_filter: sottostringa del file; since: solo gli span terminati dopo questo istante (epoch).
+    """
+    with _lock:
+        spans = list(_spans)
+    if file_filter:
+        spans = [s for s in spans if s['file'] and file_filter in s['file']]
+    if since is not None:
+        spans = [s for s in spans if s['end'] >= since]
+
+    pids: Dict[str, int] = {}
+    events: List[Dict[str, Any]] = []
+    named_threads = set()
+    for s in sorted(spans, key=lambda s: s['start']):
+        pid = pids.setdefault(s['process'], len(pids) + 1)
+        if (pid, s['tid']) not in named_threads:
+            named_threads.add((pid, s['tid']))
+            events.append({'name': 'thread_name', 'ph': 'M', 'pid': pid, 'tid': s['tid'], 'args': {'name': s['thread']}})
+        args = {'file': s['file']}
+        if 'bytes' in s:
+            args['bytes'] = s['bytes']
+        args.update(s.get('args', {}))
+        events.append({
+            'name': s['stage'], 'cat': 'pipeline', 'ph': 'X', 'pid': pid, 'tid': s['tid'],
+            'ts': round(s['start'] * 1e6), 'dur': max(0, round((s['end'] - s['start']) * 1e6)), 'args': args,
+        })
+    for process, pid in pids.items():
+        events.append({'name': 'process_name', 'ph': 'M', 'pid': pid, 'tid': 0, 'args': {'name': process}})
+    return {'traceEvents': events, 'displayTimeUnit': 'ms'}
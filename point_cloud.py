@@ -0,0 +1,121 @@
+# point_cloud.py
+
+import threading
+import numpy as np
+
+from typing import Dict, Iterable, Optional
+
+
+class PointCloudBuffer:
+    """
+    Nuvola di punti della mappa in formato structure-of-arrays (una colonna NumPy per grandezza).
+
+    Le colonne sono preallocate e crescono geometricamente (growth_factor), quindi l'append
+    di una strisciata costa O(nuovi punti) ammortizzato invece di O(punti totali) come con
+    np.concatenate. I dati sono salvati in float32.
+
+    column(name) restituisce una view (senza copia) del prefisso valido: i punti gi� scritti
+    non vengono mai modificati, per cui una view resta valida anche dopo una riallocazione.
+    """
+
+    def __init__(self, columns: Iterable[str], initial_capacity: int = 65536,
+                 growth_factor: float = 2.0, dtype=np.float32):
+        self._dtype = np.dtype(dtype)
+        self._growth_factor = growth_factor
+        self._initial_capacity = max(1, int(initial_capacity))
+        self._lock = threading.Lock()
+        self._columns: Dict[str, np.ndarray] = {
+            name: np.empty(self._initial_capacity, dtype=self._dtype) for name in columns
+        }
+        self._size = 0
+        self.bounds = {
+            'RA_min': float('inf'), 'RA_max': float('-inf'),
+            'DEC_min': float('inf'), 'DEC_max': float('-inf')
+        }
+
+    def __len__(self) -> int:
+        return self._size
+
+    @property
+    def columns(self):
+        return tuple(self._columns)
+
+    @property
+    def capacity(self) -> int:
+        return next(iter(self._columns.values())).size
+
+    @property
+    def nbytes(self) -> int:
+        """Memoria allocata (capacit�, non solo il prefisso valido)."""
+        return sum(col.nbytes for col in self._columns.values())
+
+    def column(self, name: str) -> np.ndarray:
+        """View senza copia dei punti validi della colonna richiesta."""
+        return self._columns[name][:self._size]
+
+    def _reserve(self, needed: int) -> None:
+        capacity = self.capacity
+        if needed <= capacity:
+            return
+        new_capacity = capacity
+        while new_capacity < needed:
+            new_capacity = int(new_capacity * self._growth_factor) + 1
+        for name, old in self._columns.items():
+            new = np.empty(new_capacity, dtype=self._dtype)
+            new[:self._size] = old[:self._size]
+            self._columns[name] = new
+
+    def append(self, **arrays: Optional[np.ndarray]) -> int:
+        """
+        Aggiunge una strisciata. Tutte le colonne passate devono avere la stessa lunghezza;
+        le colonne non passate (o None) vengono riempite con NaN.
+        RA e DEC aggiornano i limiti globali. Ritorna il numero totale di punti.
+        """
+        lengths = {len(v) for v in arrays.values() if v is not None}
+        if len(lengths) != 1:
+            raise ValueError(f"Colonne di lunghezza diversa o assenti: {sorted(lengths)}")
+        n_new = lengths.pop()
+
+        with self._lock:
+            start = self._size
+            self._reserve(start + n_new)
+            for name, col in self._columns.items():
+                values = arrays.get(name)
+                col[start:start + n_new] = np.nan if values is None else values
+
+            # Il prefisso valido viene esteso solo dopo aver scritto tutte le colonne,
+            # cos� un lettore concorrente vede sempre colonne della stessa lunghezza.
+            self._size = start + n_new
+
+            if n_new > 0:
+                for axis in ('RA', 'DEC'):
+                    values = arrays.get(axis)
+                    if values is None or not np.isfinite(values).any():
+                        continue
+                    self.bounds[f'{axis}_min'] = min(self.bounds[f'{axis}_min'], float(np.nanmin(values)))
+                    self.bounds[f'{axis}_max'] = max(self.bounds[f'{axis}_max'], float(np.nanmax(values)))
+            return self._size
+
+
+class PolarizationView:
+    """
+    Vista di una polarizzazione sulla PointCloudBuffer condivisa, con la stessa interfaccia
+    a dizionario della vecchia cache ('RA', 'DEC', 'P', 'RA_min', ...).
+    """
+
+    def __init__(self, buffer: PointCloudBuffer, p_column: str):
+        self.buffer = buffer
+        self.p_column = p_column
+
+    def __getitem__(self, key: str):
+        if key == 'P':
+            return self.buffer.column(self.p_column)
+        if key in self.buffer.bounds:
+            return self.buffer.bounds[key]
+        return self.buffer.column(key)
+
+    def get(self, key: str, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
@@ -0,0 +1,529 @@
+# processing_worker.py
+
+import argparse
+import multiprocessing
+import os
+import queue
+import socket
+import threading
+import time
+
+from collections import OrderedDict, deque
+from multiprocessing.managers import BaseManager
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+
+import logging_setup
+import metrics
+import pipeline_trace
+import state
+
+logger = logging_setup.get_logger(__name__)
+
+# --------------------------------------------------------
+# ELABORAZIONE DISTRIBUITA: WORKER DI ELABORAZIONE DIETRO UNA CODA CONDIVISA
+# --------------------------------------------------------
+# Il web tier (app.py, [Workers] enabled = true) non elabora i file: il watcher li consegna a
+# un FileBroker servito via TCP (multiprocessing.managers, nessun servizio esterno richiesto)
+# e N processi worker, locali o su altri host con lo stesso filesystem montato, li elaborano.
+#
+# - Instradamento per cartella della scansione: tutte le subscan di una scansione vanno allo
+#   stesso worker (nuvola di punti della mappa e coppie di nodding restano in un solo processo).
+#   Le nuove scansioni vanno al worker con meno file in coda.
+# - Eventi per i browser: tramite il message_queue di Flask-SocketIO (es. redis://) se
+#   configurato, altrimenti tramite la coda dei risultati del broker (stand-in locale).
+# - Mappe grigliate, eventi per il replay e file completati tornano sempre al web tier
+#   tramite la coda dei risultati del broker. Delle mappe viaggia solo la piramide, e dopo la
+#   prima grigliatura di una sessione solo il riquadro modificato di ciascun livello (MapUpdateEncoder).
+#
+# Avvio di un worker remoto:
+#   python processing_worker.py --broker host:5050 --authkey <chiave> [--message-queue redis://host:6379]
+
+DEFAULT_BROKER_PORT = 5050
+WORKER_TIMEOUT_S = 120.0  # Un worker che non chiede file oltre questo intervallo perde le sue scansioni
+TASK_POLL_S = 5.0         # Attesa massima di get_task() (il worker resta visibile come vivo)
+RESULT_POLL_S = 0.5
+MAP_GEOMETRY_SESSIONS = 256  # Sessioni di mappa di cui il worker ricorda la geometria inviata
+
+
+class FileBroker:
+    """
+    Coda dei file e dei risultati condivisa tra web tier e worker. Vive nel processo del
+    web tier; i worker la usano tramite proxy (_BrokerClientManager). Thread-safe.
+    """
+
+    def __init__(self, worker_timeout_s: float = WORKER_TIMEOUT_S):
+        self._cond = threading.Condition()
+        self._workers: Dict[int, Dict[str, Any]] = {}  # id -> nome, coda, scansioni, ultimo contatto
+        self._scan_owner: Dict[str, int] = {}         # cartella della scansione -> worker
+        self._unassigned: deque = deque()              # file arrivati senza worker attivi
+        self._results: queue.Queue = queue.Queue()
+        self._subscriptions: Dict[str, int] = {}
+        self._settings: Dict[str, Any] = {}
+        self._full_map_requests: set = set()          # sessioni di mappa da reinviare complete
+        self._next_id = 0
+        self._worker_timeout_s = worker_timeout_s
+
+    # --- Lato web tier ---
+
+    def submit(self, filepath: str) -> None:
+        """Accoda un file al worker che possiede la sua scansione."""
+        with self._cond:
+            self._route(filepath, time.time())
+            self._cond.notify_all()
+
+    def put_subscriptions(self, subscriptions: Dict[str, int]) -> None:
+        """Copia delle sottoscrizioni dei client (sid -> feed): i worker filtrano i file con queste."""
+        with self._cond:
+            self._subscriptions = dict(subscriptions)
+
+    def put_settings(self, settings: Dict[str, Any]) -> None:
+        """Impostazioni di elaborazione (sezione [Map] di config.ini) applicate dai worker all'avvio."""
+        with self._cond:
+            self._settings = dict(settings)
+
+    def request_full_map(self, session_key: Tuple) -> None:
+        """Il web tier non ha la base di un aggiornamento incrementale: il worker reinvia la piramide completa."""
+        with self._cond:
+            self._full_map_requests.add(tuple(session_key))
+
+    def get_result(self, timeout: float) -> Optional[Tuple]:
+        try:
+            return self._results.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+    def queued_count(self) -> int:
+        """File in attesa di un worker (profondità della coda per metrics.py)."""
+        with self._cond:
+            return len(self._unassigned) + sum(len(w['queue']) for w in self._workers.values())
+
+    def stats(self) -> Dict[str, Any]:
+        with self._cond:
+            now = time.time()
+            return {
+                'workers': {w['name']: {'queued': len(w['queue']), 'scans': len(w['scans']),
+                                        'alive': now - w['last_seen'] <= self._worker_timeout_s}
+                            for w in self._workers.values()},
+                'unassigned': len(self._unassigned),
+            }
+
+    # --- Lato worker ---
+
+    def register_worker(self, name: str) -> int:
+        with self._cond:
+            worker_id = self._next_id
+            self._next_id += 1
+            self._workers[worker_id] = {'name': name, 'queue': deque(), 'scans': set(), 'last_seen': time.time()}
+            logger.info(f"BROKER: Worker '{name}' registrato (id {worker_id}).")
+            # I file arrivati mentre non c'erano worker attivi
+            pending, self._unassigned = list(self._unassigned), deque()
+            for filepath in pending:
+                self._route(filepath, time.time())
+            self._cond.notify_all()
+            return worker_id
+
+    def get_task(self, worker_id: int, timeout: float) -> Optional[str]:
+        """Prossimo file per il worker (None allo scadere del timeout)."""
+        deadline = time.time() + timeout
+        with self._cond:
+            worker = self._workers.get(worker_id)
+            if worker is None:
+                raise KeyError(f"Worker {worker_id} non registrato")
+            while True:
+                now = time.time()
+                worker['last_seen'] = now
+                self._reassign_stale_workers(now)
+                if worker['queue']:
+                    return worker['queue'].popleft()
+                if now >= deadline:
+                    return None
+                self._cond.wait(deadline - now)
+
+    def put_result(self, item: Tuple) -> None:
+        self._results.put(item)
+
+    def take_full_map_request(self, session_key: Optional[Tuple]) -> bool:
+        """True (una sola volta) se il web tier ha chiesto la mappa completa della sessione."""
+        with self._cond:
+            if session_key is None or tuple(session_key) not in self._full_map_requests:
+                return False
+            self._full_map_requests.discard(tuple(session_key))
+            return True
+
+    def get_subscriptions(self) -> Dict[str, int]:
+        with self._cond:
+            return dict(self._subscriptions)
+
+    def get_settings(self) -> Dict[str, Any]:
+        with self._cond:
+            return dict(self._settings)
+
+    # --- Instradamento (con self._cond acquisito) ---
+
+    def _alive(self, now: float) -> List[int]:
+        return [wid for wid, w in self._workers.items() if now - w['last_seen'] <= self._worker_timeout_s]
+
+    def _route(self, filepath: str, now: float) -> None:
+        scan_dir = os.path.dirname(os.path.abspath(filepath))
+        alive = self._alive(now)
+        owner = self._scan_owner.get(scan_dir)
+        if owner not in alive:
+            if not alive:
+                self._unassigned.append(filepath)
+                return
+            owner = min(alive, key=lambda wid: (len(self._workers[wid]['queue']), len(self._workers[wid]['scans'])))
+            self._scan_owner[scan_dir] = owner
+            self._workers[owner]['scans'].add(scan_dir)
+        self._workers[owner]['queue'].append(filepath)
+
+    def _reassign_stale_workers(self, now: float) -> None:
+        """I file e le scansioni dei worker che non rispondono passano ai worker attivi."""
+        for wid in [wid for wid in self._workers if wid not in self._alive(now)]:
+            worker = self._workers.pop(wid)
+            logger.warning(f"BROKER: Worker '{worker['name']}' non risponde: {len(worker['queue'])} file riassegnati.")
+            for scan_dir in worker['scans']:
+                self._scan_owner.pop(scan_dir, None)
+            for filepath in worker['queue']:
+                self._route(filepath, now)
+
+
+class _BrokerServerManager(BaseManager):
+    pass
+
+
+class _BrokerClientManager(BaseManager):
+    pass
+
+
+_BrokerClientManager.register('broker')
+
+_broker: Optional[FileBroker] = None
+_result_thread: Optional[threading.Thread] = None
+_local_workers: List[multiprocessing.Process] = []
+
+
+def parse_address(address: str) -> Tuple[str, int]:
+    """'host:porta' -> (host, porta); senza porta si usa DEFAULT_BROKER_PORT."""
+    host, _, port = address.strip().rpartition(':')
+    if not host:
+        return port or '127.0.0.1', DEFAULT_BROKER_PORT
+    return host, int(port)
+
+
+def start_broker(address: Tuple[str, int], authkey: bytes) -> FileBroker:
+    """Avvia nel web tier il broker servito via TCP (thread daemon). Chiamata da app.py."""
+    global _broker
+    _broker = FileBroker()
+    _BrokerServerManager.register('broker', callable=lambda: _broker)
+    server = _BrokerServerManager(address=address, authkey=authkey).get_server()
+    threading.Thread(target=server.serve_forever, name='FileBroker', daemon=True).start()
+    logger.info(f"BROKER: In ascolto su {address[0]}:{address[1]}.")
+    return _broker
+
+
+def start_result_drain(broker: FileBroker, emit: Callable[[str, Any, Dict], None],
+                       on_map: Callable[[Dict], None], on_record: Callable[[List[int], str, Dict], None],
+                       on_done: Callable[[str], None],
+                       on_metrics: Optional[Callable[[str, Dict], None]] = None,
+                       on_trace: Optional[Callable[[List[Dict]], None]] = None) -> None:
+    """Thread del web tier che consegna i risultati dei worker (eventi, mappe, replay, file completati, metriche, tracce)."""
+    global _result_thread
+
+    def drain():
+        while True:
+            item = broker.get_result(RESULT_POLL_S)
+            if item is None:
+                continue
+            kind = item[0]
+            try:
+                if kind == 'emit':
+                    emit(item[1], item[2], item[3])
+                elif kind == 'map':
+                    on_map(item[1])
+                elif kind == 'record':
+                    on_record(item[1], item[2], item[3])
+                elif kind == 'done':
+                    on_done(item[1])
+                elif kind == 'metrics' and on_metrics is not None:
+                    on_metrics(item[1], item[2])
+                elif kind == 'trace' and on_trace is not None:
+                    on_trace(item[1])
+            except Exception as e:
+                logger.error(f"BROKER: Errore nella consegna del risultato '{kind}': {e}")
+
+    _result_thread = threading.Thread(target=drain, name='WorkerResults', daemon=True)
+    _result_thread.start()
+
+
+def start_local_workers(n_workers: int, address: Tuple[str, int], authkey: bytes,
+                        message_queue: Optional[str] = None) -> None:
+    """Avvia n_workers processi worker su questo host (spawn: nessun thread ereditato dal web tier)."""
+    ctx = multiprocessing.get_context('spawn')
+    for i in range(n_workers):
+        process = ctx.Process(target=run_worker, args=(address, authkey, message_queue, f'local-{i}'),
+                              name=f'ProcessingWorker-{i}', daemon=True)
+        process.start()
+        _local_workers.append(process)
+    logger.info(f"BROKER: {n_workers} worker locali avviati.")
+
+
+def stop_local_workers() -> None:
+    for process in _local_workers:
+        process.terminate()
+    for process in _local_workers:
+        process.join(timeout=5)
+    _local_workers.clear()
+
+
+# --------------------------------------------------------
+# MAPPE GRIGLIATE TRA WORKER E WEB TIER
+# --------------------------------------------------------
+# Il viewer Bokeh del web tier usa solo la piramide multi-risoluzione, la sua geometria e il range
+# colore. La piramide completa viene inviata alla prima grigliatura di una sessione e quando cambiano
+# origine, passo o numero di livelli; negli altri passaggi solo il riquadro 'dirty' di ciascun livello.
+# Con la stessa origine la mappa può crescere solo verso l'alto e verso destra: il web tier estende
+# i livelli della mappa precedente e vi copia i riquadri ricevuti.
+
+def _map_geometry(result_maps: Dict[str, Any]) -> Tuple:
+    """Origine, passo e numero di livelli della piramide (uguali per tutte le polarizzazioni)."""
+    n_levels = len(next(iter(result_maps['pyramid'].values())))
+    return (result_maps['x0'], result_maps['y0'], result_maps['step_deg'], n_levels)
+
+
+def _level_window(dirty: Tuple[int, int, int, int], level: int, shape: Tuple[int, int]) -> Tuple[int, int, int, int]:
+    """Riquadro del livello 'level' della piramide che contiene il riquadro dirty del livello 0."""
+    r0, r1, c0, c1 = dirty
+    scale = 2 ** level
+    return (r0 // scale, min(-(-r1 // scale), shape[0]), c0 // scale, min(-(-c1 // scale), shape[1]))
+
+
+def _grown_window(dirty: Tuple[int, int, int, int], old_shape: Tuple[int, int],
+                  shape: Tuple[int, int]) -> Tuple[int, int, int, int]:
+    """
+    Riquadro dirty esteso alle righe e colonne aggiunte dalla crescita della mappa: le celle nuove
+    lontane dai nuovi campioni possono essere riempite (hole filling) dai dati già presenti.
+    """
+    (old_ny, old_nx), (ny, nx) = old_shape, shape
+    windows = [dirty] if dirty[1] > dirty[0] and dirty[3] > dirty[2] else []
+    if ny > old_ny:
+        windows.append((old_ny, ny, 0, nx))
+    if nx > old_nx:
+        windows.append((0, ny, old_nx, nx))
+    if not windows:
+        return (0, 0, 0, 0)
+    return (min(w[0] for w in windows), max(w[1] for w in windows),
+            min(w[2] for w in windows), max(w[3] for w in windows))
+
+
+class MapUpdateEncoder:
+    """
+    Lato worker: trasforma i risultati della grigliatura nei messaggi 'map' per il web tier
+    (piramide completa oppure riquadri modificati), ricordando la geometria inviata per sessione.
+    """
+
+    def __init__(self, max_sessions: int = MAP_GEOMETRY_SESSIONS):
+        self._sent: "OrderedDict[Any, Tuple]" = OrderedDict()  # sessione -> (geometria, shape del livello 0)
+        self._max_sessions = max_sessions
+
+    def encode(self, result_maps: Dict[str, Any], force_full: bool = False) -> Dict[str, Any]:
+        session_key = result_maps.get('session_key')
+        geometry = _map_geometry(result_maps)
+        shape = next(iter(result_maps['pyramid'].values()))[0].shape
+        sent = self._sent.get(session_key)
+        update = {
+            'session_key': session_key,
+            'x0': result_maps['x0'], 'y0': result_maps['y0'], 'step_deg': result_maps['step_deg'],
+            'color_range': dict(result_maps.get('color_range', {})),
+            'dirty': result_maps.get('dirty'),
+        }
+        if force_full or update['dirty'] is None or sent is None or sent[0] != geometry:
+            update['dirty'] = None
+            update['pyramid'] = result_maps['pyramid']
+        else:
+            update['dirty'] = _grown_window(update['dirty'], sent[1], shape)
+            update['shapes'] = [level.shape for level in next(iter(result_maps['pyramid'].values()))]
+            update['patches'] = {}
+            for pol_key, levels in result_maps['pyramid'].items():
+                patches = []
+                for k, level in enumerate(levels):
+                    r0, r1, c0, c1 = window = _level_window(update['dirty'], k, level.shape)
+                    patches.append((window, np.array(level[r0:r1, c0:c1])))
+                update['patches'][pol_key] = patches
+
+        self._sent[session_key] = (geometry, shape)
+        self._sent.move_to_end(session_key)
+        while len(self._sent) > self._max_sessions:
+            self._sent.popitem(last=False)
+        return update
+
+
+def apply_map_update(update: Dict[str, Any], base: Optional[Dict[str, Any]]) -> Optional[Dict[str, Any]]:
+    """
+    Lato web tier: ricostruisce il risultato della grigliatura (piramide completa) da un messaggio 'map',
+    a partire dall'ultimo risultato della stessa sessione (base). Ritorna None se la base manca o non
+    ha la stessa geometria: il web tier chiede allora la mappa completa (FileBroker.request_full_map).
+    """
+    if 'pyramid' in update:
+        return update
+    if not base or 'pyramid' not in base \
+            or _map_geometry(base) != (update['x0'], update['y0'], update['step_deg'], len(update['shapes'])):
+        return None
+
+    pyramid = {}
+    for pol_key, patches in update['patches'].items():
+        levels = []
+        for level, shape, (window, values) in zip(base['pyramid'][pol_key], update['shapes'], patches):
+            if level.shape[0] > shape[0] or level.shape[1] > shape[1]:
+                return None
+            # Nuovo array: il risultato precedente resta invariato per i documenti che lo mostrano
+            new_level = np.full(shape, np.nan, dtype=level.dtype)
+            new_level[:level.shape[0], :level.shape[1]] = level
+            r0, r1, c0, c1 = window
+            new_level[r0:r1, c0:c1] = values
+            levels.append(new_level)
+        pyramid[pol_key] = levels
+
+    result_maps = {key: value for key, value in update.items() if key not in ('shapes', 'patches')}
+    result_maps['pyramid'] = pyramid
+    return result_maps
+
+
+# --------------------------------------------------------
+# PROCESSO WORKER
+# --------------------------------------------------------
+
+class _WorkerEmitter:
+    """Sostituisce l'istanza SocketIO in fits_processor (stessi metodi emit/start_background_task)."""
+
+    def __init__(self, emit: Callable[..., None]):
+        self._emit = emit
+
+    def emit(self, event: str, data: Any = None, **kwargs) -> None:
+        self._emit(event, data, **kwargs)
+
+    def start_background_task(self, target: Callable, *args, **kwargs) -> None:
+        target(*args, **kwargs) # L'emit non blocca: nessun thread necessario
+
+
+def apply_processing_settings(settings: Dict[str, Any]) -> None:
+    """Applica le impostazioni di elaborazione: nel web tier (app.py) e, con gli stessi valori, nei worker."""
+    import bokeh_visuals
+    import fits_processor
+    import map_baseline
+    import map_checkpoint
+    import map_gridding
+    import nodding_manager
+
+    if 'gridding_mode' in settings:
+        map_gridding.set_gridding_mode(settings['gridding_mode'])
+    if 'hole_filling' in settings:
+        map_gridding.set_hole_filling(*settings['hole_filling'])
+    if 'min_gridding_interval' in settings:
+        fits_processor.set_min_gridding_interval(settings['min_gridding_interval'])
+    if 'memory_budget_bytes' in settings:
+        state.MAP_MEMORY_BUDGET_BYTES = int(settings['memory_budget_bytes'])
+    if 'multi_feed' in settings:
+        state.MULTI_FEED_MAP = bool(settings['multi_feed'])
+    if 'baseline' in settings:
+        map_baseline.set_baseline_options(*settings['baseline'])
+    if 'plot_retention' in settings:
+        bokeh_visuals.set_plot_retention(*settings['plot_retention'])
+    if 'nodding_pair_ttl' in settings:
+        nodding_manager.set_pair_ttl(settings['nodding_pair_ttl'])
+    if 'map_checkpoint' in settings:
+        map_checkpoint.configure(*settings['map_checkpoint'])
+
+
+def run_worker(address: Tuple[str, int], authkey: bytes, message_queue: Optional[str] = None,
+               name: Optional[str] = None, stop_event: Optional[threading.Event] = None) -> None:
+    """
+    Ciclo del worker: prende i file dal broker, li elabora e restituisce i risultati.
+    stop_event (opzionale) termina il ciclo dopo il file in corso, es. per un worker eseguito in un thread.
+    """
+    import bokeh_server
+    import fits_processor
+    import map_checkpoint
+
+    name = name or f'{socket.gethostname()}-{os.getpid()}'
+    pipeline_trace.configure(pipeline_trace.TRACE_MAX_SPANS, process_name=f'worker {name}')
+    manager = _BrokerClientManager(address=address, authkey=authkey)
+    manager.connect()
+    broker = manager.broker()
+    settings = broker.get_settings()
+    logging_setup.setup_logging(**settings.get('logging', {}))
+    metrics.register_gauge(metrics.LOG_RECORDS_DROPPED, logging_setup.dropped_records)
+    apply_processing_settings(settings)
+
+    if message_queue:
+        from flask_socketio import SocketIO
+        external = SocketIO(message_queue=message_queue)
+        emitter = _WorkerEmitter(external.emit)
+    else:
+        emitter = _WorkerEmitter(lambda event, data=None, **kwargs: broker.put_result(('emit', event, data, kwargs)))
+    fits_processor.set_socketio_instance_for_processor(emitter)
+    # Lo stato delta degli header sarebbe diviso tra i worker: gli header vengono inviati completi
+    fits_processor.set_header_delta(False)
+    fits_processor.set_event_recorder(
+        lambda feeds, scan_id, payload: broker.put_result(('record', [int(f) for f in feeds], scan_id, payload)))
+    # Al web tier solo la piramide e, dopo la prima grigliatura, i riquadri modificati
+    map_encoder = MapUpdateEncoder()
+
+    def dispatch_map(fn, result_maps):
+        full = broker.take_full_map_request(result_maps.get('session_key'))
+        broker.put_result(('map', map_encoder.encode(result_maps, force_full=full)))
+
+    bokeh_server.set_update_dispatcher(dispatch_map)
+    metrics.register_queue_depth('gridding', fits_processor.pending_gridding_sessions)
+
+    worker_id = broker.register_worker(name)
+    last_span_sent = 0
+    restored_scans = set()  # Scansioni di cui sono già stati ricaricati i checkpoint
+    logger.info(f"WORKER {name}: Collegato al broker {address[0]}:{address[1]}.")
+    while stop_event is None or not stop_event.is_set():
+        try:
+            filepath = broker.get_task(worker_id, TASK_POLL_S)
+        except KeyError:
+            # Dichiarato non attivo dal broker (es. elaborazione oltre WORKER_TIMEOUT_S): nuova registrazione
+            worker_id = broker.register_worker(name)
+            continue
+        if filepath is None:
+            continue
+        with state._feed_subscriptions_lock:
+            state.FEED_SUBSCRIPTIONS.clear()
+            state.FEED_SUBSCRIPTIONS.update(broker.get_subscriptions())
+        start = time.time()
+        try:
+            # Il broker assegna ogni scansione a un solo worker: le sue sessioni di mappa salvate
+            # vengono ricaricate qui, al primo file, e aggiornate solo da questo worker
+            scan_dir = os.path.basename(os.path.dirname(os.path.abspath(filepath)))
+            if map_checkpoint.CHECKPOINT_DIR and scan_dir not in restored_scans:
+                restored_scans.add(scan_dir)
+                map_checkpoint.restore_sessions(scan_dir)
+            with pipeline_trace.file_context(filepath):
+                fits_processor.process_fits_file(filepath)
+        except Exception as e:
+            logger.error(f"WORKER {name}: Errore nell'elaborazione di {filepath}: {e}")
+        finally:
+            broker.put_result(('done', filepath))
+            broker.put_result(('metrics', name, metrics.snapshot()))
+            spans = pipeline_trace.spans_since(last_span_sent)
+            if spans:
+                last_span_sent = spans[-1]['seq']
+                broker.put_result(('trace', spans))
+        logger.info(f"WORKER {name}: {os.path.basename(filepath)} elaborato in {time.time() - start:.3f} s.")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Worker di elaborazione dei file FITS (modalità distribuita).")
+    parser.add_argument('--broker', default=f'127.0.0.1:{DEFAULT_BROKER_PORT}', help="Indirizzo host:porta del broker")
+    parser.add_argument('--authkey', required=True, help="Chiave condivisa con il web tier ([Workers] authkey)")
+    parser.add_argument('--message-queue', default=None, help="URL del message queue di Flask-SocketIO (es. redis://host:6379)")
+    parser.add_argument('--name', default=None, help="Nome del worker nei log del broker")
+    args = parser.parse_args()
+    run_worker(parse_address(args.broker), args.authkey.encode(), args.message_queue, args.name)
+
+
+if __name__ == '__main__':
+    main()
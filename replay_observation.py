@@ -0,0 +1,351 @@
+# replay_observation.py
+
+import argparse
+import json
+import os
+import re
+import shutil
+import tempfile
+import threading
+import time
+import urllib.request
+
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Optional, Tuple
+
+import config
+
+# --------------------------------------------------------
+# REPLAY DI UN'OSSERVAZIONE NELLA CARTELLA MONITORATA (sostituisce copy_files*.sh)
+# --------------------------------------------------------
+# Scrive i file di un'osservazione registrata (cartella della scansione o lista di percorsi) o
+# sintetica (synthetic_fits.py, manifest observation.json) nella cartella monitorata dall'app,
+# rispettando la cadenza originale (ricavata dal timestamp nel nome dei file) o N volte più veloce.
+# Le scritture possono simulare un filesystem di rete (NFS): il file compare subito e cresce a
+# blocchi, come durante il trasferimento dall'acquisizione.
+#
+# A fine replay la latenza di ogni file viene letta dalla traccia della pipeline esposta
+# dall'app (/trace): rilevamento -> emit e fine scrittura -> emit. Con --find-max-rate il replay
+# viene ripetuto a velocità crescenti fino a trovare la cadenza massima sostenibile.
+#
+# Ogni replay scrive in una nuova cartella <dest>/replay-<data>-<ora>[-x<velocità>]/<scansione>/:
+# il watcher vede sempre file nuovi e le sessioni di mappa restano separate per scansione.
+#
+# Esempi (app avviata con python app.py -d):
+#   python replay_observation.py --source /home02/.../20250212-185345-KBAND-3C84AZ --speed 5
+#   python replay_observation.py --list replay_lists/file_types.txt --interval 10
+#   python replay_observation.py --generate sardara_map --subscans 40 --speed 10 --chunk-kb 256 --chunk-delay 0.05
+#   python replay_observation.py --source /tmp/synth --find-max-rate --latency-budget 5
+
+MANIFEST_FILE = 'observation.json'  # come synthetic_fits.MANIFEST_FILE
+FITS_NAME_PATTERN = re.compile(r'\.fits(\d+)?$', re.IGNORECASE)  # come fits_watcher.FITS_EXTENSION_PATTERN
+TIMESTAMP_PATTERN = re.compile(r'^(\d{8}-\d{6})-')
+EXCLUDED_SUBFOLDERS = {'tempfits', 'tmp'}
+NODDING_PAIR_SUFFIX = '_nodding_pair'  # file della traccia delle coppie di nodding (fits_processor.py)
+NODDING_PREFIX_PATTERN = re.compile(r'(.+)_FEED_\d+\.fits$', re.IGNORECASE)
+
+Entry = Dict[str, Any]  # {'src': percorso sorgente, 'rel': percorso relativo di destinazione, 't': secondi dall'inizio}
+
+
+# --------------------------------------------------------
+# 1. CARICAMENTO DELL'OSSERVAZIONE
+# --------------------------------------------------------
+
+def _is_fits(name: str) -> bool:
+    lower = name.lower()
+    return bool(FITS_NAME_PATTERN.search(name)) and not lower.startswith('sum')
+
+
+def _file_time(path: str) -> float:
+    """Istante di acquisizione dal nome del file (YYYYMMDD-HHMMSS-...), altrimenti la data di modifica."""
+    match = TIMESTAMP_PATTERN.match(os.path.basename(path))
+    if match:
+        return time.mktime(time.strptime(match.group(1), '%Y%m%d-%H%M%S'))
+    return os.path.getmtime(path)
+
+
+def _relative_to_scan(path: str) -> str:
+    """Percorso di destinazione: cartella della scansione + nome del file."""
+    return os.path.join(os.path.basename(os.path.dirname(os.path.abspath(path))), os.path.basename(path))
+
+
+def load_observation(source: Optional[str] = None, list_file: Optional[str] = None) -> List[Entry]:
+    """
+    File da riprodurre, in ordine, con il loro istante relativo:
+      - list_file: un percorso per riga ('#' = commento)
+      - source con observation.json: manifest di synthetic_fits.py
+      - source: cartella registrata (file FITS anche nelle sottocartelle, esclusi Sum* e tempfits/tmp)
+    """
+    if list_file:
+        with open(list_file) as f:
+            paths = [line.strip() for line in f if line.strip() and not line.lstrip().startswith('#')]
+        entries = [{'src': p, 'rel': _relative_to_scan(p), 't': _file_time(p)} for p in paths]
+    elif os.path.exists(os.path.join(source, MANIFEST_FILE)):
+        with open(os.path.join(source, MANIFEST_FILE)) as f:
+            manifest = json.load(f)
+        entries = [{'src': os.path.join(source, e['path']), 'rel': e['path'], 't': float(e['t'])}
+                   for e in manifest['files']]
+    else:
+        entries = []
+        for root, dirs, files in os.walk(source):
+            dirs[:] = sorted(d for d in dirs if d.lower() not in EXCLUDED_SUBFOLDERS)
+            for name in files:
+                if _is_fits(name):
+                    path = os.path.join(root, name)
+                    entries.append({'src': path, 'rel': _relative_to_scan(path), 't': _file_time(path)})
+        entries.sort(key=lambda e: (e['t'], e['rel']))
+
+    if entries:
+        t0 = min(e['t'] for e in entries)
+        for e in entries:
+            e['t'] -= t0
+    return entries
+
+
+# --------------------------------------------------------
+# 2. REPLAY
+# --------------------------------------------------------
+
+def write_file(src: str, dst: str, chunk_bytes: int = 0, chunk_delay_s: float = 0.0) -> None:
+    """Copia src in dst: in un colpo (come cp) o a blocchi con una pausa tra l'uno e l'altro (come NFS)."""
+    os.makedirs(os.path.dirname(dst), exist_ok=True)
+    if chunk_bytes <= 0:
+        shutil.copyfile(src, dst)
+        return
+    with open(src, 'rb') as fin, open(dst, 'wb') as fout:
+        while True:
+            chunk = fin.read(chunk_bytes)
+            if not chunk:
+                break
+            fout.write(chunk)
+            fout.flush()
+            time.sleep(chunk_delay_s)
+
+
+def replay(entries: List[Entry], dest: str, speed: float = 1.0, interval: Optional[float] = None,
+           chunk_bytes: int = 0, chunk_delay_s: float = 0.0, flat: bool = False, writers: int = 4,
+           verbose: bool = True) -> Dict[str, Dict[str, float]]:
+    """
+    Scrive i file in dest alla cadenza originale divisa per speed (o ogni interval secondi).
+    Ritorna per ogni nome di file gli istanti (epoch) di inizio e fine scrittura e il ritardo
+    rispetto alla cadenza prevista (scrittura più lenta della cadenza richiesta).
+    """
+    writes: Dict[str, Dict[str, float]] = {}
+    lock = threading.Lock()
+
+    def _write(entry: Entry, scheduled: float) -> None:
+        dst = os.path.join(dest, os.path.basename(entry['rel']) if flat else entry['rel'])
+        start = time.time()
+        try:
+            write_file(entry['src'], dst, chunk_bytes, chunk_delay_s)
+        except OSError as e:
+            print(f"ERRORE: impossibile scrivere {entry['rel']}: {e}")
+            return
+        end = time.time()
+        with lock:
+            writes[os.path.basename(dst)] = {'start': start, 'end': end, 'lag': start - scheduled}
+        if verbose:
+            print(f"{time.strftime('%H:%M:%S')} - Scritto: {entry['rel']} ({end - start:.2f} s)")
+
+    replay_start = time.time()
+    with ThreadPoolExecutor(max_workers=max(1, writers), thread_name_prefix='ReplayWriter') as pool:
+        for k, entry in enumerate(entries):
+            offset = k * interval if interval is not None else entry['t'] / speed
+            scheduled = replay_start + offset
+            time.sleep(max(0.0, scheduled - time.time()))
+            pool.submit(_write, entry, scheduled)
+    return writes
+
+
+# --------------------------------------------------------
+# 3. LATENZE DALLA TRACCIA DELLA PIPELINE (/trace)
+# --------------------------------------------------------
+
+def fetch_trace(server: str, since: float) -> Dict[str, Any]:
+    with urllib.request.urlopen(f"{server.rstrip('/')}/trace?since={since:.3f}", timeout=30) as response:
+        return json.load(response)
+
+
+def file_stages(trace: Dict[str, Any]) -> Dict[str, Dict[str, Tuple[float, float]]]:
+    """Per ogni file della traccia: fase -> (primo inizio, ultima fine) in secondi epoch."""
+    stages: Dict[str, Dict[str, Tuple[float, float]]] = {}
+    for event in trace.get('traceEvents', []):
+        if event.get('ph') != 'X':
+            continue
+        file_id = (event.get('args') or {}).get('file')
+        if not file_id:
+            continue
+        start = event['ts'] / 1e6
+        end = start + event['dur'] / 1e6
+        previous = stages.setdefault(file_id, {}).get(event['name'])
+        stages[file_id][event['name']] = (min(start, previous[0]), max(end, previous[1])) if previous else (start, end)
+    return stages
+
+
+def measure_latencies(writes: Dict[str, Dict[str, float]], stages: Dict[str, Dict[str, Tuple[float, float]]]) -> Dict[str, Any]:
+    """
+    Per ogni file scritto: rilevamento -> emit e fine scrittura -> emit.
+    Una coppia di nodding viene emessa una volta sola (<prefisso>_nodding_pair): la latenza è
+    misurata dal secondo file della coppia. I file letti ma non emessi (es. feed non sottoscritto,
+    primo file di una coppia) sono 'filtered'; quelli senza traccia di elaborazione sono 'pending'.
+    """
+    result = {'detect_to_emit': [], 'write_to_emit': [], 'emitted': 0, 'filtered': 0, 'pending': 0,
+              'order': []}  # (fine scrittura, rilevamento -> emit) per il controllo dell'arretrato
+    pairs: Dict[str, List[str]] = {}
+    for name in writes:
+        match = NODDING_PREFIX_PATTERN.match(name)
+        if match:
+            pairs.setdefault(match.group(1), []).append(name)
+
+    for name, write in writes.items():
+        file_stages_ = stages.get(name, {})
+        emit = file_stages_.get('emit')
+        detection = file_stages_.get('detection')
+        match = NODDING_PREFIX_PATTERN.match(name)
+        if emit is None and match:
+            pair = sorted(pairs[match.group(1)], key=lambda n: writes[n]['end'])
+            pair_emit = stages.get(match.group(1) + NODDING_PAIR_SUFFIX, {}).get('emit')
+            if pair_emit is not None and name == pair[-1]:
+                emit = pair_emit
+        if emit is not None:
+            result['emitted'] += 1
+            result['write_to_emit'].append(emit[1] - write['end'])
+            if detection is not None:
+                result['detect_to_emit'].append(emit[1] - detection[0])
+                result['order'].append((write['end'], emit[1] - detection[0]))
+        elif 'fits_read' in file_stages_:
+            result['filtered'] += 1
+        else:
+            result['pending'] += 1
+    result['order'].sort()
+    return result
+
+
+def _percentile(values: List[float], q: float) -> float:
+    if not values:
+        return float('nan')
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, int(round(q / 100.0 * (len(ordered) - 1)))))
+    return ordered[index]
+
+
+def print_latencies(title: str, latencies: Dict[str, Any]) -> None:
+    print(f"\n{title}: {latencies['emitted']} emessi, {latencies['filtered']} letti e non emessi, "
+          f"{latencies['pending']} senza elaborazione.")
+    print(f"{'latenza':>24} {'count':>7} {'p50 [s]':>9} {'p90 [s]':>9} {'p99 [s]':>9} {'max [s]':>9}")
+    for key, label in (('detect_to_emit', 'rilevamento -> emit'), ('write_to_emit', 'fine scrittura -> emit')):
+        values = latencies[key]
+        print(f"{label:>24} {len(values):>7} {_percentile(values, 50):>9.2f} {_percentile(values, 90):>9.2f} "
+              f"{_percentile(values, 99):>9.2f} {max(values) if values else float('nan'):>9.2f}")
+
+
+def is_sustainable(latencies: Dict[str, Any], budget_s: float) -> bool:
+    """
+    Cadenza sostenibile: tutti i file elaborati, p95 rilevamento -> emit entro il budget e
+    latenza che non cresce durante il replay (ultimo quarto dei file non oltre il doppio del primo).
+    """
+    values = latencies['detect_to_emit']
+    if latencies['pending'] or not values or _percentile(values, 95) > budget_s:
+        return False
+    ordered = [latency for _, latency in latencies['order']]
+    quarter = max(1, len(ordered) // 4)
+    first, last = _percentile(ordered[:quarter], 50), _percentile(ordered[-quarter:], 50)
+    return last <= 2.0 * max(first, 0.1)
+
+
+def run_once(entries: List[Entry], dest: str, tag: str, args: argparse.Namespace, speed: float) -> Dict[str, Any]:
+    run_dir = os.path.join(dest, tag)
+    print(f"\nReplay di {len(entries)} file in {run_dir} (velocità x{speed:g}"
+          f"{f', intervallo {args.interval:g} s' if args.interval is not None else ''}).")
+    start = time.time()
+    writes = replay(entries, run_dir, speed, args.interval, args.chunk_kb * 1024, args.chunk_delay, args.flat,
+                    args.writers, verbose=not args.quiet)
+    if writes:
+        lag = max(w['lag'] for w in writes.values())
+        if lag > 1.0:
+            print(f"ATTENZIONE: le scritture sono in ritardo fino a {lag:.1f} s sulla cadenza richiesta.")
+    print(f"Replay completato in {time.time() - start:.1f} s. Attesa di {args.drain:g} s per l'elaborazione...")
+    time.sleep(args.drain)
+    try:
+        stages = file_stages(fetch_trace(args.server, start))
+    except OSError as e:
+        print(f"Traccia non disponibile da {args.server}/trace ({e}): latenze non misurate.")
+        return {}
+    latencies = measure_latencies(writes, stages)
+    print_latencies(f"{tag}", latencies)
+    return latencies
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay di un'osservazione FITS nella cartella monitorata dall'app.")
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument('--source', help="Cartella registrata o generata da synthetic_fits.py (observation.json)")
+    source.add_argument('--list', help="File con un percorso FITS per riga (es. replay_lists/file_types.txt)")
+    source.add_argument('--generate', metavar='KIND', help="Genera un'osservazione sintetica (tipi di synthetic_fits.py)")
+    parser.add_argument('--subscans', type=int, default=20, help="Subscan dell'osservazione generata")
+    parser.add_argument('--dest', default=config.FITS_FILES_DIR, help="Cartella monitorata (default: fits_files)")
+    parser.add_argument('--speed', type=float, default=1.0, help="Fattore di accelerazione della cadenza originale")
+    parser.add_argument('--interval', type=float, default=None, help="Intervallo fisso tra i file in secondi")
+    parser.add_argument('--chunk-kb', type=int, default=0, help="Scrittura a blocchi di N kB (0 = copia diretta)")
+    parser.add_argument('--chunk-delay', type=float, default=0.05, help="Pausa tra due blocchi in secondi")
+    parser.add_argument('--writers', type=int, default=4, help="Scritture contemporanee al massimo")
+    parser.add_argument('--flat', action='store_true', help="Tutti i file nella cartella del replay (senza scansione)")
+    parser.add_argument('--server', default='http://localhost:5000', help="URL dell'app (endpoint /trace)")
+    parser.add_argument('--drain', type=float, default=15.0, help="Attesa dopo l'ultimo file prima della misura")
+    parser.add_argument('--find-max-rate', action='store_true', help="Ripete il replay a velocità doppia fino al limite")
+    parser.add_argument('--max-speed', type=float, default=256.0)
+    parser.add_argument('--latency-budget', type=float, default=10.0, help="p95 massimo rilevamento -> emit in secondi")
+    parser.add_argument('--quiet', action='store_true', help="Non stampa una riga per file")
+    args = parser.parse_args()
+
+    generated_dir = None
+    if args.generate:
+        import synthetic_fits
+        generated_dir = tempfile.mkdtemp(prefix='quicklook_replay_')
+        synthetic_fits.generate_observation(generated_dir, args.generate, args.subscans)
+        args.source = generated_dir
+
+    try:
+        entries = load_observation(args.source, args.list)
+        if not entries:
+            print("Nessun file FITS da riprodurre.")
+            return
+        duration = entries[-1]['t']
+        print(f"{len(entries)} file, durata originale {duration:.0f} s.")
+        tag = time.strftime('replay-%Y%m%d-%H%M%S')
+
+        if not args.find_max_rate:
+            run_once(entries, args.dest, tag, args, args.speed)
+            return
+
+        # Ricerca della cadenza massima sostenibile: velocità raddoppiata a ogni passo
+        results = []
+        speed = args.speed
+        while speed <= args.max_speed:
+            latencies = run_once(entries, args.dest, f"{tag}-x{speed:g}", args, speed)
+            if not latencies:
+                return
+            rate = len(entries) / max(duration / speed, 1e-9) if args.interval is None else 1.0 / args.interval
+            sustainable = is_sustainable(latencies, args.latency_budget)
+            results.append((speed, rate, latencies, sustainable))
+            if not sustainable or args.interval is not None:
+                break
+            speed *= 2
+
+        print(f"\n{'velocità':>9} {'file/s':>8} {'p50 [s]':>9} {'p95 [s]':>9} {'pending':>8} {'esito':>12}")
+        for speed, rate, latencies, sustainable in results:
+            values = latencies['detect_to_emit']
+            print(f"{'x' + format(speed, 'g'):>9} {rate:>8.2f} {_percentile(values, 50):>9.2f} "
+                  f"{_percentile(values, 95):>9.2f} {latencies['pending']:>8} {'sostenibile' if sustainable else 'saturato':>12}")
+        best = [r for r in results if r[3]]
+        if best:
+            print(f"Cadenza massima sostenibile: {best[-1][1]:.2f} file/s (velocità x{best[-1][0]:g}).")
+        else:
+            print("Nessuna cadenza sostenibile entro il budget di latenza: ridurre --speed.")
+    finally:
+        if generated_dir:
+            shutil.rmtree(generated_dir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
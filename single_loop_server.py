@@ -0,0 +1,78 @@
+# single_loop_server.py
+
+import asyncio
+
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, List, Optional, Tuple
+
+import socketio
+from tornado.ioloop import IOLoop
+from tornado.web import Application, FallbackHandler
+from tornado.wsgi import WSGIContainer
+
+import bokeh_server
+import logging_setup
+from loop_bridge import LoopBridge, LoopSocketIO, register_async_handlers
+
+logger = logging_setup.get_logger(__name__)
+
+# --------------------------------------------------------
+# MODALIT� "SINGLE LOOP": Socket.IO, Flask e server Bokeh sullo stesso IOLoop Tornado
+# --------------------------------------------------------
+# I worker (watchdog, elaborazione FITS, grigliatura) restano thread, ma invece di
+# svegliare i loop di Socket.IO e Bokeh separatamente pubblicano i risultati in un'unica
+# coda thread-safe (loop_bridge.LoopBridge), svuotata a blocchi dal loop.
+
+WSGI_THREADS = 4 # Thread per le richieste Flask (WSGI � sincrono: non deve bloccare il loop)
+
+
+_io_loop: Optional[IOLoop] = None
+_bridge: Optional[LoopBridge] = None
+
+
+def setup(flask_app, on_feed_selection: Callable[[str, Dict], Tuple], on_disconnect: Callable[[str], None],
+          port: int = 5000, bokeh_port: int = 5006,
+          bokeh_origins: Optional[List[str]] = None,
+          on_header_resync: Optional[Callable[[str], Optional[Dict]]] = None,
+          on_replay: Optional[Callable[[Optional[int]], List[Tuple[str, Dict]]]] = None) -> LoopSocketIO:
+    """
+    Prepara sul loop del thread corrente: server Socket.IO asincrono e Flask (porta port),
+    server Bokeh (bokeh_port, 0 = disabilitato). Ritorna l'istanza Socket.IO da passare ai worker.
+    """
+    global _io_loop, _bridge
+    asyncio.set_event_loop(asyncio.new_event_loop())
+    _io_loop = IOLoop.current()
+    _bridge = LoopBridge(_io_loop.add_callback)
+
+    sio = socketio.AsyncServer(async_mode='tornado', cors_allowed_origins='*')
+    register_async_handlers(sio, on_feed_selection, on_disconnect, on_header_resync, on_replay)
+
+    try:
+        wsgi = WSGIContainer(flask_app, executor=ThreadPoolExecutor(WSGI_THREADS, thread_name_prefix='Flask'))
+    except TypeError:
+        wsgi = WSGIContainer(flask_app) # Tornado < 6.3: le richieste Flask girano sul loop
+    web_app = Application([
+        (r'/socket.io/', socketio.get_tornado_handler(sio)),
+        (r'.*', FallbackHandler, dict(fallback=wsgi)),
+    ])
+    web_app.listen(port)
+    logger.info(f"SINGLE LOOP: Flask + Socket.IO su http://0.0.0.0:{port}")
+
+    if bokeh_port > 0:
+        bokeh_server.start_bokeh_server(port=bokeh_port, allow_websocket_origin=bokeh_origins, io_loop=_io_loop)
+    # Gli aggiornamenti della mappa passano dalla stessa coda (accorpati per sessione)
+    bokeh_server.set_update_dispatcher(
+        lambda fn, result_maps: _bridge.post(fn, result_maps, coalesce_key=('map', result_maps.get('session_key'))))
+
+    return LoopSocketIO(sio, _bridge)
+
+
+def run() -> None:
+    """Esegue il loop condiviso (blocca fino allo stop)."""
+    logger.info("SINGLE LOOP: Avvio del loop condiviso.")
+    _io_loop.start()
+
+
+def stop() -> None:
+    if _io_loop is not None:
+        _io_loop.add_callback(_io_loop.stop)
@@ -1,14 +1,64 @@
 # state.py
 
-import numpy as np
-from typing import Dict, Any, Optional
+import threading
+import logging_setup
+from collections import OrderedDict
+from typing import Dict, Any, List, Optional, Set, Tuple
+
+from point_cloud import PointCloudBuffer, PolarizationView
+
+logger = logging_setup.get_logger(__name__)
 
 # --------------------------------------------------------
 # 1. STATO RELATIVO AL FRONTEND
 # --------------------------------------------------------
-# Global variable to store the feed selected by the user on the front-end
+# Feed di default: usato per filtrare i file quando nessun client ha ancora scelto un feed
 CURRENT_SELECTED_FEED = 0
 
+# Sottoscrizioni per client (Socket.IO sid -> feed). Ogni feed ha una room Socket.IO:
+# un file viene elaborato una sola volta se contiene almeno un feed sottoscritto e i
+# prodotti vengono emessi solo nelle room dei feed sottoscritti che contiene.
+FEED_SUBSCRIPTIONS: Dict[str, int] = {}
+_feed_subscriptions_lock = threading.Lock()
+
+
+def feed_room(feed: int) -> str:
+    """Nome della room Socket.IO di un feed."""
+    return f"feed_{int(feed)}"
+
+
+def subscribe_feed(sid: str, feed: int) -> Optional[int]:
+    """Sottoscrive il client al feed. Ritorna il feed sottoscritto in precedenza (o None)."""
+    with _feed_subscriptions_lock:
+        previous = FEED_SUBSCRIPTIONS.get(sid)
+        FEED_SUBSCRIPTIONS[sid] = int(feed)
+        return previous
+
+
+def unsubscribe_client(sid: str) -> Optional[int]:
+    """Rimuove la sottoscrizione di un client disconnesso. Ritorna il suo feed (o None)."""
+    with _feed_subscriptions_lock:
+        return FEED_SUBSCRIPTIONS.pop(sid, None)
+
+
+def subscribed_feeds() -> Set[int]:
+    """Unione dei feed sottoscritti; senza client sottoscritti vale il feed di default."""
+    with _feed_subscriptions_lock:
+        feeds = set(FEED_SUBSCRIPTIONS.values())
+    return feeds or {CURRENT_SELECTED_FEED}
+
+
+def rooms_for_feeds(feeds) -> Optional[List[str]]:
+    """
+    Room a cui inviare un prodotto che contiene i feed indicati: quelle dei feed sottoscritti.
+    None se nessun client ha sottoscrizioni (invio a tutti, come prima delle room).
+    """
+    with _feed_subscriptions_lock:
+        if not FEED_SUBSCRIPTIONS:
+            return None
+        subscribed = set(FEED_SUBSCRIPTIONS.values())
+    return [feed_room(f) for f in sorted({int(f) for f in feeds} & subscribed)]
+
 # --------------------------------------------------------
 # 2. STATO RELATIVO ALLA MAPPA (La Nuvola di Punti Persistente)
 # --------------------------------------------------------
@@ -21,28 +71,139 @@ GLOBAL_MAP_CACHE: Dict = {}
 # Questo � l'input cruciale per map_gridding.py.
 GLOBAL_HPBW_ARCSEC: float = 0.0
 
+# Sessioni di mappa indicizzate per (scan ID, sistema di coordinate, feed), in ordine LRU
+# (la meno usata di recente per prima). GLOBAL_MAP_CACHE punta alla sessione attiva,
+# cio� quella che ha ricevuto l'ultima strisciata.
+# Ogni feed ha la propria sessione; feed None = mappa multi-feed (tutti i feed nella stessa nuvola).
+MapSessionKey = Tuple[str, str, Optional[int]]
+MAP_SESSIONS: "OrderedDict[MapSessionKey, Dict]" = OrderedDict()
+
+# Budget di memoria complessivo delle sessioni di mappa: oltre questa soglia vengono
+# eliminate le sessioni usate meno di recente (mai quella attiva).
+MAP_MEMORY_BUDGET_BYTES: int = 512 * 1024 * 1024
+
+# Modalit� mappa multi-feed: tutti i feed di una mappa (es. banda K, 7 feed) vengono
+# accumulati nella stessa nuvola di punti, ciascuno con il proprio offset sul cielo.
+MULTI_FEED_MAP: bool = False
+
+_map_sessions_lock = threading.RLock()
+
+
+def _new_map_cache(session_key: Optional[MapSessionKey] = None) -> Dict:
+    """Crea una cache di mappa vuota (nuvola di punti Pol0/Pol1 e griglie)."""
+    # Nuvola di punti condivisa (RA, DEC e una colonna P per polarizzazione), float32 e
+    # preallocata con crescita geometrica. 'Pol0'/'Pol1' sono viste senza copia su di essa.
+    # P_raw_* conservano i valori prima della rimozione della baseline delle strisciate.
+    points = PointCloudBuffer(columns=('RA', 'DEC', 'P_Pol0', 'P_Pol1', 'P_raw_Pol0', 'P_raw_Pol1'))
+    return {
+        'KEY': session_key,   # (scan ID, sistema di coordinate, feed)
+        'HPBW_ARCSEC': 0.0,   # HPBW della sessione (la frequenza pu� differire tra sessioni)
+        'POINTS': points,
+        'Pol0': PolarizationView(points, 'P_Pol0'),
+        'Pol1': PolarizationView(points, 'P_Pol1'),
+        # Griglie incrementali (somma e conteggio) mantenute da map_gridding.py.
+        # None finch� non viene eseguita la prima grigliatura.
+        'GRID': None,
+        # Ultimo risultato della grigliatura: il viewer pu� tornare a questa mappa senza ri-grigliare
+        'LATEST_RESULT': None
+    }
+
+
 def initialize_map_cache():
     """Inizializza/Reset la struttura della cache della mappa per le polarizzazioni Pol0 e Pol1."""
     global GLOBAL_MAP_CACHE
     global GLOBAL_HPBW_ARCSEC # Importante: dichiara che stai modificando la globale
     
-    # Inizializza gli array
-    GLOBAL_MAP_CACHE = {
-        'Pol0': { 
-            'RA': np.array([]), 'DEC': np.array([]), 'P': np.array([]),            
-            'RA_min': float('inf'), 'RA_max': float('-inf'),
-            'DEC_min': float('inf'), 'DEC_max': float('-inf')
-        },
-        'Pol1': { 
-            'RA': np.array([]), 'DEC': np.array([]), 'P': np.array([]),
-            'RA_min': float('inf'), 'RA_max': float('-inf'),
-            'DEC_min': float('inf'), 'DEC_max': float('-inf')
-        }
-    }
+    GLOBAL_MAP_CACHE = _new_map_cache()
     
     # Reset del valore HPBW (se passi dalla Mappa allo Spettro, questo valore � da ricalcolare)
     GLOBAL_HPBW_ARCSEC = 0.0 
 
+
+def map_cache_nbytes(cache: Dict) -> int:
+    """Memoria occupata da una sessione: nuvola di punti, griglie e piramide dell'ultimo risultato."""
+    nbytes = cache['POINTS'].nbytes
+    grid = cache.get('GRID')
+    if grid:
+        for pol_key in ('Pol0', 'Pol1'):
+            nbytes += grid[pol_key]['sum'].nbytes + grid[pol_key]['count'].nbytes
+    result = cache.get('LATEST_RESULT')
+    if result:
+        for levels in result.get('pyramid', {}).values():
+            nbytes += sum(level.nbytes for level in levels)
+    return nbytes
+
+
+def get_map_session(session_key: MapSessionKey) -> Dict:
+    """
+    Restituisce (creandola se necessario) la sessione di mappa per (scan ID, sistema di coordinate, feed),
+    la rende attiva (GLOBAL_MAP_CACHE) e la sposta in fondo all'ordine LRU.
+    """
+    global GLOBAL_MAP_CACHE
+    with _map_sessions_lock:
+        cache = MAP_SESSIONS.get(session_key)
+        if cache is None:
+            cache = _new_map_cache(session_key)
+            MAP_SESSIONS[session_key] = cache
+            logger.info(f"STATE: Nuova sessione di mappa {session_key}. Sessioni attive: {len(MAP_SESSIONS)}")
+        MAP_SESSIONS.move_to_end(session_key)
+        GLOBAL_MAP_CACHE = cache
+        enforce_map_memory_budget()
+        return cache
+
+
+def touch_map_session(session_key: MapSessionKey) -> Optional[Dict]:
+    """Segna una sessione come usata di recente (es. selezionata nel viewer) senza renderla attiva."""
+    with _map_sessions_lock:
+        cache = MAP_SESSIONS.get(session_key)
+        if cache is not None:
+            MAP_SESSIONS.move_to_end(session_key)
+        return cache
+
+
+def put_map_result(session_key: MapSessionKey, result_maps: Dict) -> Dict:
+    """
+    Modalità distribuita: le nuvole di punti restano nei worker e il web tier conserva solo l'ultimo
+    risultato della grigliatura di ogni sessione (selettore del viewer Bokeh e replay delle mappe).
+    La sessione, senza punti, segue lo stesso ordine LRU e lo stesso budget di memoria.
+    """
+    with _map_sessions_lock:
+        cache = MAP_SESSIONS.get(session_key)
+        if cache is None:
+            cache = _new_map_cache(session_key)
+            MAP_SESSIONS[session_key] = cache
+        MAP_SESSIONS.move_to_end(session_key)
+        cache['LATEST_RESULT'] = result_maps
+        enforce_map_memory_budget()
+        return cache
+
+
+def list_map_sessions() -> List[MapSessionKey]:
+    """Chiavi delle sessioni di mappa, dalla usata pi� di recente alla meno recente."""
+    with _map_sessions_lock:
+        return list(reversed(MAP_SESSIONS))
+
+
+def map_sessions_nbytes() -> int:
+    """Memoria totale occupata dalle sessioni di mappa."""
+    with _map_sessions_lock:
+        return sum(map_cache_nbytes(cache) for cache in MAP_SESSIONS.values())
+
+
+def enforce_map_memory_budget():
+    """Elimina le sessioni meno usate di recente finch� la memoria totale rientra nel budget."""
+    with _map_sessions_lock:
+        total = map_sessions_nbytes()
+        for session_key in list(MAP_SESSIONS):
+            if total <= MAP_MEMORY_BUDGET_BYTES:
+                break
+            cache = MAP_SESSIONS[session_key]
+            if cache is GLOBAL_MAP_CACHE:
+                continue # La sessione attiva non viene mai eliminata
+            total -= map_cache_nbytes(cache)
+            del MAP_SESSIONS[session_key]
+            logger.warning(f"STATE: Sessione di mappa {session_key} eliminata (budget memoria {MAP_MEMORY_BUDGET_BYTES / 1e6:.0f} MB).")
+
 # Inizializza la cache all'avvio del modulo
 initialize_map_cache()
 
@@ -50,6 +211,12 @@ initialize_map_cache()
 # 3. STATO RELATIVO AL BOKEH SERVER (Nuova Sezione)
 # --------------------------------------------------------
 
-# Memorizza i riferimenti al documento Bokeh (doc) e ai suoi ColumnDataSource.
-# Inizializzato a None. Viene popolato *dopo* l'avvio del server.
-BOKEH_DOC_STATE: Optional[Dict[str, Any]] = None
\ No newline at end of file
+# Documenti Bokeh aperti (uno per scheda del viewer), indicizzati per ID di sessione Bokeh:
+# ciascuno contiene i riferimenti al documento (doc) e ai suoi ColumnDataSource.
+# Popolato *dopo* l'avvio del server; le sessioni chiuse vengono rimosse.
+BOKEH_SESSIONS: Dict[str, Dict[str, Any]] = {}
+bokeh_sessions_lock = threading.Lock()
+
+# Ultimo risultato della grigliatura (mappe, piramide multi-risoluzione e geometria).
+# Il viewer Bokeh ne estrae il tile corrispondente al viewport di ciascun documento.
+LATEST_MAP_RESULT: Optional[Dict[str, Any]] = None
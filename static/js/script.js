@@ -84,6 +84,11 @@ updateConnectionStatus(false); // Set to offline initially
 socket.on('connect', function() {
     console.log('Connected to Flask-SocketIO server!');
     updateConnectionStatus(true); // Update status to online
+
+    // Subscriptions are per client (Socket.IO room of the feed): (re)subscribe on every connection.
+    // Before the first header the combobox is empty: subscribe to the default feed, whose latest
+    // state is replayed by the server and populates the combobox.
+    socket.emit('update_feed_selection', { feed: feedCombobox.value || '0' });
 });
 
 // Event listener for disconnection
@@ -92,8 +97,130 @@ socket.on('disconnect', function() {
     updateConnectionStatus(false); // Update status to offline
 });
 
+// Last full header received for the current scan: the server sends the full header on the first
+// subscan of a scan and then only the changed keywords ('delta'), numbered by header_version.
+let headerState = { scan: null, version: 0, header: {} };
+let pendingHeaderUpdate = null; // Update waiting for a resync (a delta was lost or arrived out of order)
+
+// Rebuilds the full header from a 'full' or 'delta' message; returns false if a resync is needed
+function applyHeaderMessage(data) {
+    if (data.header_mode === undefined) {
+        return true; // Server without delta encoding: the header is always complete
+    }
+    if (data.header_mode === 'full') {
+        headerState = { scan: data.header_scan, version: data.header_version, header: Object.assign({}, data.header) };
+    } else if (data.header_scan === headerState.scan && data.header_version === headerState.version + 1) {
+        const merged = Object.assign({}, headerState.header, data.header);
+        (data.header_removed || []).forEach(key => delete merged[key]);
+        headerState = { scan: data.header_scan, version: data.header_version, header: merged };
+    } else {
+        return false;
+    }
+    data.header = Object.assign({}, headerState.header);
+    return true;
+}
+
 // Event listener for 'fits_header_update' events from the server
 socket.on('fits_header_update', function(data) {
+    if (!applyHeaderMessage(data)) {
+        console.warn(`Header delta v${data.header_version} for ${data.header_scan} does not follow v${headerState.version} for ${headerState.scan}: requesting a resync.`);
+        pendingHeaderUpdate = data;
+        socket.emit('header_resync', {});
+        return;
+    }
+    handleFitsHeaderUpdate(data);
+});
+
+// Full header sent by the server after a 'header_resync' request
+socket.on('fits_header_resync', function(data) {
+    headerState = { scan: data.header_scan, version: data.header_version, header: Object.assign({}, data.header) };
+    if (pendingHeaderUpdate !== null) {
+        const update = pendingHeaderUpdate;
+        pendingHeaderUpdate = null;
+        // The resync already contains the keywords of the pending update (or of a newer one)
+        update.header = Object.assign({}, headerState.header);
+        handleFitsHeaderUpdate(update);
+    }
+});
+
+// Summary of the current map of the subscribed feed (replayed from memory on feed subscription,
+// see ReplayBuffer in app.py): the coarsest pyramid level is drawn in the map panel until the
+// Bokeh map viewer, which starts from the latest map, is opened.
+const MAP_PREVIEW_COLORS = [[68, 1, 84], [59, 82, 139], [33, 145, 140], [94, 201, 98], [253, 231, 37]]; // Viridis stops
+
+// Map panel below the spectrum plot, created on the first map summary
+function getMapStateContainer() {
+    let container = document.getElementById('mapStateContainer');
+    if (container === null) {
+        container = document.createElement('div');
+        container.id = 'mapStateContainer';
+        fitsPlotContainer.insertAdjacentElement('afterend', container);
+    }
+    return container;
+}
+
+function previewColor(value, low, high) {
+    const t = high > low ? Math.min(Math.max((value - low) / (high - low), 0), 1) : 0.5;
+    const pos = t * (MAP_PREVIEW_COLORS.length - 1);
+    const i = Math.min(Math.floor(pos), MAP_PREVIEW_COLORS.length - 2);
+    const f = pos - i;
+    return MAP_PREVIEW_COLORS[i].map((c, k) => Math.round(c + f * (MAP_PREVIEW_COLORS[i + 1][k] - c)));
+}
+
+// Draws a preview image (rows from the lowest latitude up, null = unsampled cell) on a canvas
+function drawMapPreview(canvas, image, colorRange) {
+    const nRows = image.length;
+    const nCols = nRows > 0 ? image[0].length : 0;
+    canvas.width = Math.max(nCols, 1);
+    canvas.height = Math.max(nRows, 1);
+    const ctx = canvas.getContext('2d');
+    const pixels = ctx.createImageData(canvas.width, canvas.height);
+    const [low, high] = colorRange || [0, 1];
+    for (let r = 0; r < nRows; r++) {
+        for (let c = 0; c < nCols; c++) {
+            const value = image[r][c];
+            const offset = ((nRows - 1 - r) * nCols + c) * 4; // Canvas rows go from the top down
+            if (value === null) {
+                continue; // Transparent
+            }
+            const [red, green, blue] = previewColor(value, low, high);
+            pixels.data.set([red, green, blue, 255], offset);
+        }
+    }
+    ctx.putImageData(pixels, 0, 0);
+}
+
+socket.on('map_state', function(data) {
+    const [scanId, frame, feed] = data.session;
+    const container = getMapStateContainer();
+    container.innerHTML = '';
+
+    const title = document.createElement('h5');
+    title.textContent = `Map ${scanId} [${frame}]` + (feed === null ? ' (multi-feed)' : ` feed ${feed}`);
+    container.appendChild(title);
+
+    const previews = document.createElement('div');
+    previews.className = 'map-previews';
+    for (const [polKey, preview] of Object.entries(data.preview)) {
+        const figure = document.createElement('figure');
+        const canvas = document.createElement('canvas');
+        drawMapPreview(canvas, preview.image, data.color_range[polKey]);
+        const caption = document.createElement('figcaption');
+        const range = data.color_range[polKey];
+        caption.textContent = range ? `${polKey}: ${range[0].toPrecision(4)} .. ${range[1].toPrecision(4)}` : polKey;
+        figure.append(canvas, caption);
+        previews.appendChild(figure);
+    }
+    container.appendChild(previews);
+
+    const extent = document.createElement('p');
+    extent.className = 'text-muted';
+    extent.textContent = `Origin (${data.x0.toFixed(4)}, ${data.y0.toFixed(4)}) deg, cell ${(data.step_deg * 3600).toFixed(1)} arcsec` +
+        (data.replay ? ' (from memory)' : '');
+    container.appendChild(extent);
+});
+
+function handleFitsHeaderUpdate(data) {
     console.log('Received fits_header_update event:', data);
 
     // --- Always post the header info immediately ---
@@ -290,5 +417,5 @@ socket.on('fits_header_update', function(data) {
         //clearData();
         return; // Stop processing this event if no match
     }
-});
+}
 
@@ -0,0 +1,289 @@
+# synthetic_fits.py
+
+import argparse
+import json
+import math
+import os
+import time
+
+import numpy as np
+
+from astropy.io import fits
+from typing import Any, Dict, Iterator, List, Optional, Sequence, Tuple
+
+# --------------------------------------------------------
+# GENERATORE DI FILE FITS SINTETICI (formato DISCOS: SARDARA, SKARAB, TotalPower)
+# --------------------------------------------------------
+# Scrive osservazioni complete con la stessa struttura letta da fits_processor.py:
+#   - header primario con SCANID, SubScanID e SubScanType (HIERARCH), sorgente, ...
+#   - SECTION TABLE (type, bins, bandwidth), RF INPUTS (feed, frequency, localOscillator),
+#     FEED TABLE (offset dei feed in radianti), DATA TABLE (coordinate + colonne Ch<N>)
+# Nomi dei file come in acquisizione:
+#   SARDARA/TotalPower mono o dual feed:  <scansione>/<data>-<ora>-<progetto>-<sorgente>_<scan>_<subscan>.fits
+#   SARDARA multi-feed (un file per feed): ..._<scan>_<subscan>.fits<N>
+#   SKARAB (un file per feed):             ..._<scan>_<subscan>_FEED_<N>.fits (coppie di nodding con feed 0 e 1)
+#
+# Ogni osservazione ha un manifest (observation.json) con i file nell'ordine di scrittura e
+# l'istante nominale di ciascuno: usato dai benchmark e da replay_observation.py.
+#
+# Uso:
+#   python synthetic_fits.py --out /tmp/synth --kind sardara_multifeed_map --subscans 20 --rows 200
+
+MANIFEST_FILE = 'observation.json'
+
+# Tipi di osservazione: backend, tipo di spettro, feed acquisiti, un file per feed, tipo di subscan
+OBSERVATION_KINDS: Dict[str, Dict[str, Any]] = {
+    'sardara_tracking':      {'backend': 'SARDARA', 'spectrum': 'spectra', 'feeds': (0,), 'file_per_feed': False, 'sub_scan_type': 'TRACKING'},
+    'sardara_stokes':        {'backend': 'SARDARA', 'spectrum': 'stokes', 'feeds': (0,), 'file_per_feed': False, 'sub_scan_type': 'TRACKING'},
+    'sardara_map':           {'backend': 'SARDARA', 'spectrum': 'spectra', 'feeds': (0,), 'file_per_feed': False, 'sub_scan_type': 'RA'},
+    'sardara_multifeed_map': {'backend': 'SARDARA', 'spectrum': 'spectra', 'feeds': tuple(range(7)), 'file_per_feed': True, 'sub_scan_type': 'RA'},
+    'skarab_ps':             {'backend': 'SKARAB', 'spectrum': 'spectra', 'feeds': (0,), 'file_per_feed': True, 'sub_scan_type': 'TRACKING'},
+    'skarab_nodding':        {'backend': 'SKARAB', 'spectrum': 'spectra', 'feeds': (0, 1), 'file_per_feed': True, 'sub_scan_type': 'TRACKING'},
+    'totalpower_map':        {'backend': 'TotalPower', 'spectrum': 'simple', 'feeds': (0,), 'file_per_feed': False, 'sub_scan_type': 'RA'},
+}
+
+DEFAULT_CHANNELS = {'SARDARA': 1024, 'SKARAB': 2048, 'TotalPower': 1}
+DEFAULT_ROWS = 100
+DEFAULT_FREQUENCY_MHZ = 22000.0   # Banda K
+DEFAULT_BANDWIDTH_MHZ = 1500.0
+FEED_SPACING_DEG = 0.0236         # Distanza dei feed esterni dal centrale (multi-feed a esagono)
+NODDING_PAIR_DELAY_S = 0.5        # Ritardo del secondo file di una coppia di nodding
+FEED_FILE_DELAY_S = 0.05          # Ritardo tra i file dei feed di una stessa subscan
+
+
+def feed_offsets(feeds: Sequence[int]) -> Dict[int, Tuple[float, float]]:
+    """Offset (x, y) in gradi: feed 0 al centro, gli altri su un esagono (come il 7 feed in banda K)."""
+    offsets = {}
+    for feed in feeds:
+        if feed == 0:
+            offsets[feed] = (0.0, 0.0)
+        else:
+            angle = math.radians(60.0 * (feed - 1))
+            offsets[feed] = (FEED_SPACING_DEG * math.cos(angle), FEED_SPACING_DEG * math.sin(angle))
+    return offsets
+
+
+def map_subscans(n_subscans: int, rows: int, axis: str = 'RA', center: Tuple[float, float] = (45.0, 60.0),
+                 size_deg: float = 0.2) -> Iterator[Tuple[np.ndarray, np.ndarray]]:
+    """
+    Strisciate on-the-fly di una mappa quadrata centrata in center (gradi): lungo l'asse indicato
+    ('RA'/'AZ' = longitudine, 'DEC'/'EL' = latitudine), a passo costante sull'altro asse,
+    alternando il verso di scansione. Ritorna (longitudine, latitudine) per ogni strisciata.
+    """
+    lon0, lat0 = center
+    cos_lat = max(math.cos(math.radians(lat0)), 1e-6)
+    scan = np.linspace(-size_deg / 2, size_deg / 2, rows)
+    steps = np.linspace(-size_deg / 2, size_deg / 2, n_subscans) if n_subscans > 1 else np.zeros(1)
+    for k, step in enumerate(steps):
+        along = scan if k % 2 == 0 else scan[::-1]
+        if axis in ('RA', 'AZ'):
+            yield lon0 + along / cos_lat, np.full(rows, lat0 + step)
+        else:
+            yield np.full(rows, lon0 + step / cos_lat), lat0 + along
+
+
+def _row_power(lon: np.ndarray, lat: np.ndarray, center: Tuple[float, float], hpbw_deg: float,
+               feed_offset: Tuple[float, float], drift: float, rng: np.random.Generator) -> np.ndarray:
+    """Potenza per riga: Tsys + sorgente gaussiana (larga un HPBW) vista dal feed + deriva lineare + rumore."""
+    sigma = hpbw_deg / (2.0 * math.sqrt(2.0 * math.log(2.0)))
+    cos_lat = max(math.cos(math.radians(center[1])), 1e-6)
+    d_lon = (lon - center[0]) * cos_lat + feed_offset[0]
+    d_lat = (lat - center[1]) + feed_offset[1]
+    source = 5.0 * np.exp(-(d_lon ** 2 + d_lat ** 2) / (2.0 * sigma ** 2))
+    return 30.0 + source + drift * np.linspace(-1.0, 1.0, len(lon)) + rng.normal(0.0, 0.05, len(lon))
+
+
+def _spectra(power: np.ndarray, channels: int, rng: np.random.Generator, line: bool) -> np.ndarray:
+    """Spettri [righe x canali]: banda passante * potenza della riga, con riga spettrale opzionale."""
+    ch = np.linspace(-1.0, 1.0, channels)
+    bandpass = 1.0 - 0.3 * ch ** 2
+    if line:
+        bandpass = bandpass + 0.2 * np.exp(-((ch - 0.1) ** 2) / (2 * 0.01 ** 2))
+    spectra = power[:, None] * bandpass[None, :]
+    spectra += rng.normal(0.0, 0.01, spectra.shape) * power[:, None]
+    return spectra.astype(np.float32)
+
+
+def write_subscan(path: str, backend: str = 'SARDARA', spectrum: str = 'spectra', feeds: Sequence[int] = (0,),
+                  data_feeds: Optional[Sequence[int]] = None, channels: Optional[int] = None, rows: int = DEFAULT_ROWS,
+                  sub_scan_type: str = 'TRACKING', scan_id: int = 1, subscan_id: int = 1,
+                  lon: Optional[np.ndarray] = None, lat: Optional[np.ndarray] = None,
+                  center: Tuple[float, float] = (45.0, 60.0), source: str = 'SYNTH',
+                  frequency_mhz: float = DEFAULT_FREQUENCY_MHZ, bandwidth_mhz: float = DEFAULT_BANDWIDTH_MHZ,
+                  timestamp: Optional[float] = None, seed: int = 0) -> int:
+    """
+    Scrive un file FITS di una subscan e ne ritorna la dimensione in byte.
+
+    feeds:      feed acquisiti (RF INPUTS, FEED TABLE)
+    data_feeds: feed i cui dati sono nel file (default: tutti; uno solo per .fits<N> e SKARAB)
+    lon, lat:   coordinate (gradi) delle righe per le mappe; default: puntamento fisso su center
+    """
+    channels = channels or DEFAULT_CHANNELS.get(backend, 1024)
+    data_feeds = list(feeds if data_feeds is None else data_feeds)
+    timestamp = time.time() if timestamp is None else timestamp
+    rng = np.random.default_rng(seed)
+    if lon is None or lat is None:
+        lon, lat = np.full(rows, center[0]), np.full(rows, center[1])
+    rows = len(lon)
+    is_map = sub_scan_type in ('RA', 'DEC', 'AZ', 'EL')
+    hpbw_deg = 1.22 * (3.0e8 / (frequency_mhz * 1e6)) / 64.0 * 180.0 / math.pi
+    offsets = feed_offsets(feeds)
+
+    # --- HEADER PRIMARIO ---
+    primary = fits.PrimaryHDU()
+    header = primary.header
+    header['DATE'] = time.strftime('%Y-%m-%dT%H:%M:%S', time.gmtime(timestamp))
+    header['SCANID'] = scan_id
+    header['SOURCE'] = source
+    header['ANTENNA'] = 'SRT'
+    header['HIERARCH RightAscension'] = math.radians(center[0])
+    header['HIERARCH Declination'] = math.radians(center[1])
+    header['HIERARCH SubScanType'] = sub_scan_type
+    header['HIERARCH BackendName'] = backend
+    header['HIERARCH LogFileName'] = 'synthetic'
+    header['HIERARCH ScheduleName'] = 'synthetic.scd'
+    header['HIERARCH SubScanID'] = subscan_id
+
+    # --- SECTION TABLE / RF INPUTS: una sezione per colonna di dati (due polarizzazioni in 'spectra'/'simple') ---
+    pols = ('LCP', 'RCP') if spectrum in ('spectra', 'simple') else ('LCP',)
+    rf_feeds = [f for f in feeds for _ in pols]
+    n_sections = len(rf_feeds)
+    sections = fits.BinTableHDU.from_columns([
+        fits.Column(name='id', format='J', array=np.arange(n_sections)),
+        fits.Column(name='type', format='8A', array=np.array([spectrum] * n_sections)),
+        fits.Column(name='bins', format='J', array=np.full(n_sections, channels)),
+        fits.Column(name='bandwidth', format='D', unit='MHz', array=np.full(n_sections, bandwidth_mhz)),
+        fits.Column(name='sampleRate', format='D', unit='MHz', array=np.full(n_sections, 2 * bandwidth_mhz)),
+    ], name='SECTION TABLE')
+    rf_inputs = fits.BinTableHDU.from_columns([
+        fits.Column(name='feed', format='J', array=np.array(rf_feeds)),
+        fits.Column(name='ifChain', format='J', array=np.arange(n_sections)),
+        fits.Column(name='polarization', format='3A', array=np.array([p for _ in feeds for p in pols])),
+        fits.Column(name='frequency', format='D', unit='MHz', array=np.full(n_sections, frequency_mhz)),
+        fits.Column(name='bandWidth', format='D', unit='MHz', array=np.full(n_sections, bandwidth_mhz)),
+        fits.Column(name='localOscillator', format='D', unit='MHz', array=np.full(n_sections, frequency_mhz - 100.0)),
+        fits.Column(name='section', format='J', array=np.arange(n_sections)),
+    ], name='RF INPUTS')
+    feed_table = fits.BinTableHDU.from_columns([
+        fits.Column(name='id', format='J', array=np.array(list(feeds))),
+        fits.Column(name='xOffset', format='D', unit='rad', array=np.radians([offsets[f][0] for f in feeds])),
+        fits.Column(name='yOffset', format='D', unit='rad', array=np.radians([offsets[f][1] for f in feeds])),
+        fits.Column(name='relativePower', format='D', array=np.ones(len(feeds))),
+    ], name='FEED TABLE')
+
+    # --- DATA TABLE: coordinate in gradi (TUNIT) e colonne Ch<N> numerate come in acquisizione ---
+    columns = [
+        fits.Column(name='time', format='D', unit='MJD', array=40587.0 + (timestamp + np.arange(rows) * 0.04) / 86400.0),
+        fits.Column(name='raj2000', format='D', unit='deg', array=lon),
+        fits.Column(name='decj2000', format='D', unit='deg', array=lat),
+        fits.Column(name='az', format='D', unit='deg', array=lon),
+        fits.Column(name='el', format='D', unit='deg', array=lat),
+        fits.Column(name='par_angle', format='D', unit='rad', array=np.full(rows, 0.3)),
+        fits.Column(name='flag_track', format='J', array=np.ones(rows, dtype=np.int32)),
+    ]
+    for k, feed in enumerate(data_feeds):
+        power = _row_power(lon, lat, center, hpbw_deg, offsets[feed], drift=0.5 if is_map else 0.0, rng=rng)
+        if backend == 'SKARAB':
+            names = ['Ch0', 'Ch1'][:len(pols)]          # SKARAB: colonne fisse Ch0 (e Ch1)
+        elif spectrum in ('spectra', 'simple'):
+            names = [f'Ch{feed * 2}', f'Ch{feed * 2 + 1}']
+        else:
+            names = [f'Ch{feed}']
+        for name in names:
+            if channels == 1:
+                columns.append(fits.Column(name=name, format='D', array=power * 1000.0))
+            elif spectrum == 'stokes':
+                # Stokes: L, R, Q, U concatenati nella stessa riga
+                stokes = np.concatenate([_spectra(power, channels, rng, line=not is_map)] * 2 +
+                                        [_spectra(power * 0.01, channels, rng, line=False)] * 2, axis=1)
+                columns.append(fits.Column(name=name, format=f'{4 * channels}E', array=stokes))
+            else:
+                columns.append(fits.Column(name=name, format=f'{channels}E',
+                                           array=_spectra(power, channels, rng, line=not is_map)))
+    data_table = fits.BinTableHDU.from_columns(columns, name='DATA TABLE')
+
+    fits.HDUList([primary, sections, rf_inputs, feed_table, data_table]).writeto(path, overwrite=True)
+    return os.path.getsize(path)
+
+
+def _stamp(timestamp: float) -> str:
+    return time.strftime('%Y%m%d-%H%M%S', time.gmtime(timestamp))
+
+
+def generate_observation(out_dir: str, kind: str = 'sardara_map', subscans: int = 10, rows: int = DEFAULT_ROWS,
+                         channels: Optional[int] = None, feeds: Optional[Sequence[int]] = None,
+                         axis: Optional[str] = None, cadence_s: float = 10.0, map_size_deg: float = 0.2,
+                         project: str = 'SYNTH', source: str = 'W3OH', scan_id: int = 1,
+                         start: Optional[float] = None, seed: int = 0) -> Dict[str, Any]:
+    """
+    Scrive in out_dir/<cartella della scansione> tutte le subscan di un'osservazione del tipo indicato
+    (vedi OBSERVATION_KINDS) e il manifest observation.json. Ritorna il manifest:
+        {'kind', 'scan_dir', 'files': [{'path' (relativo a out_dir), 't' (s dall'inizio), 'bytes'}]}
+    cadence_s: intervallo nominale tra due subscan (i file di una subscan escono quasi insieme).
+    """
+    if kind not in OBSERVATION_KINDS:
+        raise ValueError(f"Tipo di osservazione non valido: {kind} (validi: {', '.join(OBSERVATION_KINDS)})")
+    spec = dict(OBSERVATION_KINDS[kind])
+    feeds = tuple(feeds) if feeds is not None else spec['feeds']
+    sub_scan_type = axis or spec['sub_scan_type']
+    is_map = sub_scan_type in ('RA', 'DEC', 'AZ', 'EL')
+    start = time.time() if start is None else start
+    center = (45.0, 60.0)
+
+    scan_dir = f"{_stamp(start)}-{project}-{source}"
+    os.makedirs(os.path.join(out_dir, scan_dir), exist_ok=True)
+
+    tracks = map_subscans(subscans, rows, sub_scan_type, center, map_size_deg) if is_map else None
+    files: List[Dict[str, Any]] = []
+    for k in range(subscans):
+        t = k * cadence_s
+        lon, lat = next(tracks) if tracks is not None else (None, None)
+        prefix = f"{_stamp(start + t)}-{project}-{source}_{scan_id:03d}_{k + 1:03d}"
+
+        if spec['backend'] == 'SKARAB':
+            delay = NODDING_PAIR_DELAY_S if len(feeds) == 2 else FEED_FILE_DELAY_S
+            targets = [(f"{prefix}_FEED_{feed}.fits", [feed], t + i * delay) for i, feed in enumerate(feeds)]
+        elif spec['file_per_feed']:
+            targets = [(f"{prefix}.fits{feed}", [feed], t + i * FEED_FILE_DELAY_S) for i, feed in enumerate(feeds)]
+        else:
+            targets = [(f"{prefix}.fits", list(feeds), t)]
+
+        for filename, data_feeds, t_file in targets:
+            relative = os.path.join(scan_dir, filename)
+            n_bytes = write_subscan(
+                os.path.join(out_dir, relative), backend=spec['backend'], spectrum=spec['spectrum'], feeds=feeds,
+                data_feeds=data_feeds, channels=channels, rows=rows, sub_scan_type=sub_scan_type, scan_id=scan_id,
+                subscan_id=k + 1, lon=lon, lat=lat, center=center, source=source, timestamp=start + t_file,
+                seed=seed + len(files))
+            files.append({'path': relative, 't': round(t_file, 3), 'bytes': n_bytes})
+
+    manifest = {'kind': kind, 'scan_dir': scan_dir, 'files': files}
+    with open(os.path.join(out_dir, MANIFEST_FILE), 'w') as f:
+        json.dump(manifest, f, indent=1)
+    return manifest
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Generatore di osservazioni FITS sintetiche (SARDARA, SKARAB, TotalPower).")
+    parser.add_argument('--out', required=True, help="Cartella di destinazione")
+    parser.add_argument('--kind', default='sardara_map', choices=sorted(OBSERVATION_KINDS))
+    parser.add_argument('--subscans', type=int, default=10)
+    parser.add_argument('--rows', type=int, default=DEFAULT_ROWS, help="Righe (campioni) per subscan")
+    parser.add_argument('--channels', type=int, default=None, help="Canali per spettro (default per backend)")
+    parser.add_argument('--feeds', type=int, default=None, help="Numero di feed acquisiti (default per tipo)")
+    parser.add_argument('--axis', default=None, choices=['TRACKING', 'RA', 'DEC', 'AZ', 'EL'], help="SubScanType")
+    parser.add_argument('--cadence', type=float, default=10.0, help="Secondi tra due subscan (manifest)")
+    parser.add_argument('--map-size', type=float, default=0.2, help="Lato della mappa in gradi")
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    feeds = tuple(range(args.feeds)) if args.feeds else None
+    manifest = generate_observation(args.out, args.kind, args.subscans, args.rows, args.channels, feeds, args.axis,
+                                    args.cadence, args.map_size, seed=args.seed)
+    total = sum(f['bytes'] for f in manifest['files'])
+    print(f"{len(manifest['files'])} file scritti in {os.path.join(args.out, manifest['scan_dir'])} "
+          f"({total / 1e6:.1f} MB, manifest {MANIFEST_FILE}).")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,59 @@
+# tests/conftest.py
+#
+# Shared fixtures: the FITS pipeline in-process on synthetic observations (synthetic_fits.py),
+# with the emits recorded instead of sent to Socket.IO clients.
+
+import os
+import sys
+import threading
+import time
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import fits_processor  # noqa: E402
+import state  # noqa: E402
+
+
+class RecordingEmitter:
+    """Stands in for the SocketIO instance: keeps the (event, data, kwargs) of every emit."""
+
+    def __init__(self):
+        self.emitted = []
+        self._lock = threading.Lock()
+
+    def emit(self, event, data=None, **kwargs):
+        with self._lock:
+            self.emitted.append((event, data, kwargs))
+
+    def start_background_task(self, target, *args, **kwargs):
+        target(*args, **kwargs)
+
+
+def wait_for_gridding(timeout=30.0):
+    """Waits until the gridding worker has no map session left to grid."""
+    deadline = time.time() + timeout
+    while fits_processor.pending_gridding_sessions() and time.time() < deadline:
+        time.sleep(0.05)
+
+
+@pytest.fixture
+def pipeline(tmp_path, monkeypatch):
+    """
+    process_fits_file() ready to run on files in tmp_path: plots written under tmp_path, no
+    stabilization wait, a recording emitter. Feed subscriptions and map sessions are reset afterwards.
+    """
+    monkeypatch.setattr(fits_processor, 'PLOT_SAVE_DIR', str(tmp_path / 'plots'))
+    monkeypatch.setattr(fits_processor, 'FILE_STABLE_CHECK_INTERVAL_S', 0.0)
+    os.makedirs(fits_processor.PLOT_SAVE_DIR)
+    emitter = RecordingEmitter()
+    fits_processor.set_socketio_instance_for_processor(emitter)
+    yield emitter
+    wait_for_gridding()
+    fits_processor.set_socketio_instance_for_processor(None)
+    with state._feed_subscriptions_lock:
+        state.FEED_SUBSCRIPTIONS.clear()
+    with state._map_sessions_lock:
+        state.MAP_SESSIONS.clear()
+    state.LATEST_MAP_RESULT = None
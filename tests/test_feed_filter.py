@@ -0,0 +1,25 @@
+# tests/test_feed_filter.py
+
+import os
+
+import fits_processor
+import metrics
+import state
+import synthetic_fits
+
+
+def _dropped(reason):
+    return metrics.snapshot()['counters'].get((metrics.FILES_DROPPED, (('reason', reason),)), 0.0)
+
+
+def test_file_without_subscribed_feed_is_counted_as_feed_filter(pipeline, tmp_path):
+    state.subscribe_feed('client-3', 3)
+    manifest = synthetic_fits.generate_observation(str(tmp_path / 'data'), 'sardara_tracking', subscans=1,
+                                                   rows=10, channels=64, feeds=(0,))
+    feed_filter_before, error_before = _dropped('feed_filter'), _dropped('error')
+
+    fits_processor.process_fits_file(os.path.join(str(tmp_path / 'data'), manifest['files'][0]['path']))
+
+    assert _dropped('feed_filter') == feed_filter_before + 1
+    assert _dropped('error') == error_before
+    assert not pipeline.emitted
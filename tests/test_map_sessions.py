@@ -0,0 +1,43 @@
+# tests/test_map_sessions.py
+
+import os
+
+import fits_processor
+import state
+import synthetic_fits
+
+ROWS = 50
+SUBSCANS = 2
+
+
+def _process_observation(out_dir, feeds):
+    manifest = synthetic_fits.generate_observation(str(out_dir), 'sardara_multifeed_map', subscans=SUBSCANS,
+                                                   rows=ROWS, channels=64, feeds=feeds)
+    for entry in manifest['files']:
+        fits_processor.process_fits_file(os.path.join(str(out_dir), entry['path']))
+    return manifest
+
+
+def _session_points():
+    return {key[2]: len(state.MAP_SESSIONS[key]['POINTS']) for key in state.list_map_sessions()}
+
+
+def test_map_sessions_are_kept_per_feed(pipeline, tmp_path):
+    for feed in (0, 3):
+        state.subscribe_feed(f'client-{feed}', feed)
+
+    manifest = _process_observation(tmp_path / 'data', feeds=(0, 3))
+
+    assert _session_points() == {0: SUBSCANS * ROWS, 3: SUBSCANS * ROWS}
+    assert all(key[0].startswith(manifest['scan_dir'] + '/') for key in state.list_map_sessions())
+
+
+def test_multi_feed_map_grids_every_feed_in_one_session(pipeline, tmp_path, monkeypatch):
+    monkeypatch.setattr(state, 'MULTI_FEED_MAP', True)
+    for feed in (0, 3):
+        state.subscribe_feed(f'client-{feed}', feed)
+
+    _process_observation(tmp_path / 'data', feeds=(0, 3))
+
+    assert _session_points() == {None: 2 * SUBSCANS * ROWS}
+
@@ -0,0 +1,142 @@
+# tests/test_processing_worker.py
+
+import os
+import socket
+import threading
+import time
+
+import numpy as np
+import pytest
+
+import app
+import bokeh_server
+import fits_processor
+import map_gridding
+import processing_worker
+import state
+import synthetic_fits
+
+AUTHKEY = b'quicklook-test'
+
+
+def _free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+@pytest.fixture
+def broker(monkeypatch):
+    """FileBroker served in-process on a free port; the worker's changes to the pipeline globals are undone."""
+    for module, name in ((fits_processor, '_socketio_instance'), (fits_processor, 'HEADER_DELTA_ENABLED'),
+                         (fits_processor, '_event_recorder'), (bokeh_server, '_update_dispatcher')):
+        monkeypatch.setattr(module, name, getattr(module, name))
+    monkeypatch.setattr(processing_worker, 'TASK_POLL_S', 0.2)
+    address = ('127.0.0.1', _free_port())
+    return address, processing_worker.start_broker(address, AUTHKEY)
+
+
+def _collect_results(file_broker, until, timeout=60.0, quiet_s=1.0):
+    """Results of the broker until the condition holds and no result arrived for quiet_s (last gridding passes)."""
+    results = []
+    deadline = time.time() + timeout
+    last_item = time.time()
+    while time.time() < deadline and not (until(results) and time.time() - last_item >= quiet_s):
+        item = file_broker.get_result(0.1)
+        if item is not None:
+            results.append(item)
+            last_item = time.time()
+    return results
+
+
+def _assert_same_pyramid(received, result_maps):
+    # Cells outside the changed window may differ by rounding: the hole filling FFT changes size with the map
+    for pol_key, levels in result_maps['pyramid'].items():
+        assert len(received['pyramid'][pol_key]) == len(levels)
+        for rebuilt, level in zip(received['pyramid'][pol_key], levels):
+            np.testing.assert_allclose(rebuilt, level, rtol=1e-6)
+
+
+def _run_worker_on_map(broker, tmp_path):
+    """Two subscans of a map processed by a worker thread; returns (file paths, results)."""
+    address, file_broker = broker
+    file_broker.put_settings({'min_gridding_interval': 0.0})
+    file_broker.put_subscriptions({'client-0': 0})
+    manifest = synthetic_fits.generate_observation(str(tmp_path / 'data'), 'sardara_map', subscans=2,
+                                                   rows=20, channels=64)
+    paths = [os.path.join(str(tmp_path / 'data'), entry['path']) for entry in manifest['files']]
+
+    stop = threading.Event()
+    worker = threading.Thread(target=processing_worker.run_worker, args=(address, AUTHKEY, None, 'test-worker', stop),
+                              daemon=True)
+    worker.start()
+    try:
+        for path in paths:
+            file_broker.submit(path)
+        results = _collect_results(
+            file_broker, lambda results: {r[1] for r in results if r[0] == 'done'} == set(paths)
+            and any(r[0] == 'map' for r in results))
+    finally:
+        stop.set()
+        worker.join(timeout=10)
+    assert not worker.is_alive()
+    return paths, results
+
+
+def test_worker_processes_files_from_the_broker(pipeline, broker, tmp_path):
+    paths, results = _run_worker_on_map(broker, tmp_path)
+
+    kinds = [r[0] for r in results]
+    assert {r[1] for r in results if r[0] == 'done'} == set(paths)
+    assert [r[1] for r in results if r[0] == 'emit'].count('fits_header_update') == len(paths)
+    assert kinds.count('record') == len(paths)
+    assert 'map' in kinds and 'metrics' in kinds
+
+
+def test_web_tier_keeps_the_map_sessions_of_the_workers(pipeline, broker, tmp_path):
+    _, results = _run_worker_on_map(broker, tmp_path)
+    # The worker thread shares this process: only the results received from the broker must remain
+    with state._map_sessions_lock:
+        worker_results = {key: cache['LATEST_RESULT'] for key, cache in state.MAP_SESSIONS.items()}
+        state.MAP_SESSIONS.clear()
+
+    map_results = [item[1] for item in results if item[0] == 'map']
+    for result_maps in map_results:
+        app._receive_worker_map(result_maps)
+
+    session_key = tuple(map_results[-1]['session_key'])
+    assert state.list_map_sessions() == [session_key]
+    received = app._latest_map_result(session_key[0], 0)
+    assert received is state.MAP_SESSIONS[session_key]['LATEST_RESULT']
+    _assert_same_pyramid(received, worker_results[session_key])
+
+
+def test_map_updates_rebuild_the_worker_pyramid():
+    cache = state._new_map_cache(('scan/1', 'RA_DEC', 0))
+    cache['HPBW_ARCSEC'] = 60.0
+    encoder = processing_worker.MapUpdateEncoder()
+    rng = np.random.default_rng(0)
+    received, kinds = None, []
+    for k in range(6):
+        # RA subscans further up each time: the map grows without moving its origin
+        ra = np.linspace(10.0, 10.6, 200)
+        dec = np.full(ra.shape, 20.0 + 0.05 * k)  # Gap rows filled from the previous subscan too
+        p = rng.normal(size=ra.shape)
+        fits_processor.update_global_point_cloud_dual_pol(ra, dec, [p, 2 * p], map_cache=cache)
+        result_maps = map_gridding.perform_gridding(cache)
+
+        update = encoder.encode(result_maps)
+        kinds.append('full' if 'pyramid' in update else 'patch')
+        received = processing_worker.apply_map_update(update, received)
+
+        assert received['color_range'] == result_maps['color_range']
+        _assert_same_pyramid(received, result_maps)
+
+    assert kinds[0] == 'full' and 'patch' in kinds
+    # Without the previous map the web tier asks the worker for the full pyramid
+    assert processing_worker.apply_map_update(encoder.encode(result_maps), None) is None
+    file_broker = processing_worker.FileBroker()
+    file_broker.request_full_map(cache['KEY'])
+    assert file_broker.take_full_map_request(cache['KEY'])
+    assert 'pyramid' in encoder.encode(result_maps, force_full=True)
+    assert not file_broker.take_full_map_request(cache['KEY'])
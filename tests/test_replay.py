@@ -0,0 +1,28 @@
+# tests/test_replay.py
+
+import app
+import state
+
+
+def _payload(feed):
+    return {'filename': f'scan_feed{feed}.fits', 'feeds': f'[{feed}]', 'header': {'FEED': str(feed)}}
+
+
+def test_replay_follows_the_feed_subscription(monkeypatch):
+    replay_buffer = app.ReplayBuffer()
+    replay_buffer.record([0], 'scan/1', _payload(0))
+    replay_buffer.record([3], 'scan/1', _payload(3))
+    monkeypatch.setattr(app, 'replay_buffer', replay_buffer)
+
+    client = app.socketio.test_client(app.app)
+    try:
+        # Nothing is replayed before the client picks a feed
+        assert [m['name'] for m in client.get_received()] == ['status']
+
+        client.emit('update_feed_selection', {'feed': 3})
+        replayed = [m['args'][0] for m in client.get_received() if m['name'] == 'fits_header_update']
+        assert len(replayed) == 1
+        assert replayed[0]['replay'] and replayed[0]['header']['FEED'] == '3'
+    finally:
+        client.disconnect()
+    assert not state.FEED_SUBSCRIPTIONS